@@ -0,0 +1,55 @@
+"""
+Benchmark del motor FIFO sobre transacciones sintéticas.
+
+Uso:
+    python -m benchmarks.bench_engine 10000 100000 1000000
+    python -m benchmarks.bench_engine --losses 10000
+    python -m benchmarks.bench_engine --workers=4 1000000
+
+Por defecto todas las ventas son con ganancia para medir solo el bucle FIFO;
+con --losses las ventas pueden dar pérdidas y pasar por la regla de los 2 meses.
+--workers=N usa el modo paralelo por ISIN con N procesos.
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from degiro_app.engine import PortfolioEngine
+
+def make_transactions(n_rows: int, n_isins: int = 500, with_losses: bool = False,
+                      seed: int = 42) -> pd.DataFrame:
+    """Genera compras y ventas aleatorias (aprox. 70% compras) repartidas en n_isins valores."""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3650, n_rows)), unit='D')
+    isin_ids = rng.integers(0, n_isins, n_rows)
+    qty = rng.integers(1, 50, n_rows).astype(float)
+    is_sale = rng.random(n_rows) < 0.3
+    qty[is_sale] *= -1
+    price = rng.uniform(5, 200, n_rows)
+    if not with_losses:
+        price[is_sale] = 1000.0
+    return pd.DataFrame({
+        'date': dates.strftime('%d-%m-%Y'),
+        'time': '10:00',
+        'product': [f'PRODUCT {i}' for i in isin_ids],
+        'isin': [f'ES{i:010d}' for i in isin_ids],
+        'qty': qty,
+        'total_eur': -qty * price,
+        'fee_eur': np.full(n_rows, -1.0),
+        'date_obj': dates,
+    })
+
+def bench(n_rows: int, with_losses: bool = False, workers: int = 1) -> float:
+    df_t = make_transactions(n_rows, with_losses=with_losses)
+    engine = PortfolioEngine(df_t, pd.DataFrame())
+    start = time.perf_counter()
+    engine.process(workers=workers)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    with_losses = '--losses' in args
+    workers = next((int(a.split('=', 1)[1]) for a in args if a.startswith('--workers=')), 1)
+    sizes = [int(a) for a in args if not a.startswith('--')] or [10_000, 100_000]
+    for n in sizes:
+        print(f"{n:>9} filas: {bench(n, with_losses, workers):8.3f} s")
@@ -0,0 +1,61 @@
+"""
+Benchmark del FIFO en coma fija frente al FIFO en float de LotLedger.
+
+Uso:
+    python -m benchmarks.bench_exact 100000 1000000
+
+Mide solo el cálculo FIFO (coste de cada venta y cartera final) en ambos modos, el
+motor completo en float y con exact=True, y resume el informe de divergencias
+(exact=True, report_divergences=True).
+"""
+import sys
+import time
+from collections import Counter
+import pandas as pd
+from degiro_app.engine import PortfolioEngine, iter_transactions
+from degiro_app.exact import exact_fifo
+from degiro_app.models import LotLedger, PortfolioBatch
+from benchmarks.bench_engine import make_transactions
+
+def float_fifo(df: pd.DataFrame):
+    portfolio = {}
+    costs = []
+    for tx in iter_transactions(df):
+        ledger = portfolio.get(tx.isin)
+        if ledger is None:
+            ledger = portfolio[tx.isin] = LotLedger(tx.product)
+        if tx.qty > 0:
+            ledger.add(PortfolioBatch(tx.qty, abs(tx.total_eur) / tx.qty, tx.date))
+        else:
+            costs.append(ledger.consume(-tx.qty)[0])
+    return costs
+
+def bench(n_rows: int):
+    df_t = make_transactions(n_rows, with_losses=True)
+    df_t['total_eur'] = df_t['total_eur'].round(2) # Importes al céntimo, como en el CSV de DEGIRO
+    df_t = df_t.sort_values(by=['date_obj', 'time']).reset_index(drop=True)
+
+    start = time.perf_counter()
+    float_fifo(df_t)
+    float_time = time.perf_counter() - start
+    start = time.perf_counter()
+    exact_fifo(df_t)
+    exact_time = time.perf_counter() - start
+    print(f"{n_rows:>9} filas: FIFO float {float_time:7.3f} s | FIFO exacto {exact_time:7.3f} s")
+
+    times = {}
+    for exact in (False, True):
+        engine = PortfolioEngine(df_t.copy(), pd.DataFrame(), exact=exact)
+        start = time.perf_counter()
+        engine.process()
+        times[exact] = time.perf_counter() - start
+    print(f"{'':>16}motor float {times[False]:7.3f} s | motor exacto {times[True]:7.3f} s")
+
+    engine = PortfolioEngine(df_t.copy(), pd.DataFrame(), exact=True, report_divergences=True)
+    engine.process()
+    kinds = Counter(d['kind'] for d in engine.divergences)
+    print(f"{'':>16}divergencias: {kinds.get('sale', 0)} ventas, {kinds.get('position', 0)} posiciones")
+
+if __name__ == '__main__':
+    for n in [int(a) for a in sys.argv[1:]] or [100_000]:
+        bench(n)
@@ -0,0 +1,52 @@
+"""
+Benchmark de memoria y serialización de los resultados del motor.
+
+Uso:
+    python -m benchmarks.bench_serialize 1000000
+
+Mide la memoria por venta (objeto + campos no compartidos) y el tiempo de
+convertir todas las ventas a dict con to_dict() frente a dataclasses.asdict,
+además del JSON resultante.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from degiro_app.models import SaleResult
+
+def make_sales(n: int, n_isins: int = 500):
+    # Nombres e ISIN compartidos entre ventas, como los que salen de df.tolist()
+    products = [f'PRODUCT {i}' for i in range(n_isins)]
+    isins = [f'ES{i:010d}' for i in range(n_isins)]
+    dates = [datetime(2015, 1, 1) + timedelta(days=d) for d in range(3650)]
+    return [
+        SaleResult(date=dates[i % 3650], product=products[i % n_isins], isin=isins[i % n_isins],
+                   qty=float(i % 50 + 1), sale_net=100.0 + i, cost_basis=90.0 + i, pnl=10.0,
+                   note='', repurchase_safe_date='01-01-2024')
+        for i in range(n)
+    ]
+
+def bench(n: int):
+    tracemalloc.start()
+    sales = make_sales(n)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{n:>9} ventas: {used / n:8.1f} bytes/venta")
+
+    start = time.perf_counter()
+    [asdict(s) for s in sales]
+    print(f"{'asdict':>16}: {time.perf_counter() - start:8.3f} s")
+
+    start = time.perf_counter()
+    rows = [s.to_dict() for s in sales]
+    print(f"{'to_dict':>16}: {time.perf_counter() - start:8.3f} s")
+
+    start = time.perf_counter()
+    json.dumps(rows, default=str)
+    print(f"{'json.dumps':>16}: {time.perf_counter() - start:8.3f} s")
+
+if __name__ == '__main__':
+    for n in [int(a) for a in sys.argv[1:]] or [1_000_000]:
+        bench(n)
@@ -1,47 +1,263 @@
 import os
 import io
-import csv
-import zipfile
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file
-from .logic import load_data_frames, analyze_full_history
+import gzip
+import hashlib
+import re
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, session
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime
+from .logic import (
+    load_data_frames_cached, run_engine, build_analysis, clean_number,
+    frames_cache_key, page_items, PAGED_KINDS
+)
+from .engine import ENGINE_VERSION, reference_date
+from .reports import year_report_files, all_years_report_files, zip_report
+from .harvest import plan_harvest
+from .holdings import HoldingsIndex
+from .series import cost_basis_series
+from .events import load_event_rules
+from .cache import ResultCache
+from .jobs import JobQueue, QueueFull
 from degiro_app.config import Config
 
+class ModelJSONProvider(DefaultJSONProvider):
+    """Serializa los modelos con su to_dict() generado en lugar de dataclasses.asdict."""
+    @staticmethod
+    def default(o):
+        if hasattr(o, 'to_dict'): return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ModelJSONProvider(app)
 
 # Directorio persistente
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-PATH_ACC = os.path.join(DATA_DIR, 'Account.csv')
-PATH_TRANS = os.path.join(DATA_DIR, 'Transactions.csv')
+# CSV subidos, DataFrames normalizados (Parquet) y checkpoints de cada conjunto de
+# datos: datasets/<id de sesión>/. Nada se comparte entre sesiones.
+DATASETS_DIR = os.path.join(DATA_DIR, 'datasets')
+# Formato anterior, un único conjunto para todos: <LEGACY_DIR>/*.csv y cache/
+LEGACY_DIR = DATA_DIR
+# Cada cuánto (segundos) se buscan conjuntos de datos caducados
+CLEANUP_INTERVAL = 3600
+_datasets_lock = threading.Lock()
+_last_cleanup = 0.0
+
+# Resultados en memoria por conjunto de datos (LRU acotado por memoria)
+DB_CACHE = ResultCache(max_bytes=app.config['RESULT_CACHE_MB'] * 2**20)
+# Análisis de las subidas en segundo plano
+JOBS = JobQueue(workers=app.config['ANALYSIS_WORKERS'], max_pending=app.config['ANALYSIS_QUEUE'])
+UPLOAD_ERROR = "Error procesando los archivos subidos. Verifique el formato."
+# Respuestas JSON ya codificadas (y comprimidas) que se guardan por conjunto de datos
+ENCODED_RESPONSES = 64
+# Content-Encoding admitidos y sufijo de su ETag (cada representación tiene el suyo)
+COMPRESSORS = {'gzip': lambda body: gzip.compress(body, mtime=0), 'deflate': zlib.compress}
+ETAG_SUFFIX = {'identity': '', 'gzip': '-gz', 'deflate': '-df'}
+_encoded_lock = threading.Lock()
+# Hilos para preparar a la vez los CSV de cada año del informe completo
+REPORT_WORKERS = 4
+# Puntos de la serie diaria de capital invertido que se envían para el gráfico
+SERIES_POINTS = 500
+
+def dataset_paths(dataset):
+    """Rutas (Transactions.csv, Account.csv, checkpoints) de un conjunto de datos."""
+    folder = os.path.join(DATASETS_DIR, dataset)
+    return (os.path.join(folder, 'Transactions.csv'), os.path.join(folder, 'Account.csv'),
+            os.path.join(folder, 'engine_checkpoints.pkl'))
+
+def touch_dataset(dataset):
+    """Marca el conjunto de datos como usado ahora (la mtime de su carpeta, ver cleanup_datasets)."""
+    try:
+        os.utime(os.path.join(DATASETS_DIR, dataset))
+    except FileNotFoundError:
+        pass
+
+def cleanup_datasets(now=None):
+    """
+    Borra del disco (y de memoria) los conjuntos de datos sin usar en más de
+    DATASET_RETENTION_DAYS: su cookie de sesión ya ha caducado y nadie puede volver
+    a ellos. Devuelve los ids borrados.
+    """
+    cutoff = (now or time.time()) - app.config['DATASET_RETENTION_DAYS'] * 86400
+    removed = []
+    with _datasets_lock:
+        names = os.listdir(DATASETS_DIR) if os.path.isdir(DATASETS_DIR) else []
+        for dataset in names:
+            folder = os.path.join(DATASETS_DIR, dataset)
+            if not re.fullmatch(r'[0-9a-f]{32}', dataset) or JOBS.active(dataset) is not None: continue
+            if os.path.getmtime(folder) < cutoff:
+                DB_CACHE.pop(dataset)
+                shutil.rmtree(folder, ignore_errors=True)
+                removed.append(dataset)
+    return removed
+
+def migrate_legacy_data():
+    """
+    Migración única del formato anterior: los CSV de LEGACY_DIR (y sus checkpoints)
+    pasan a un conjunto de datos nuevo, cuyo id se devuelve para la sesión que lo
+    pide. El cache de DataFrames antiguo se borra. None si no hay nada que migrar.
+    """
+    legacy_cache = os.path.join(LEGACY_DIR, 'cache')
+    legacy = (os.path.join(LEGACY_DIR, 'Transactions.csv'), os.path.join(LEGACY_DIR, 'Account.csv'),
+              os.path.join(legacy_cache, 'engine_checkpoints.pkl'))
+    with _datasets_lock:
+        if not (os.path.exists(legacy[0]) and os.path.exists(legacy[1])): return None
+        dataset = uuid.uuid4().hex
+        os.makedirs(os.path.join(DATASETS_DIR, dataset))
+        for src, dst in zip(legacy, dataset_paths(dataset)):
+            if os.path.exists(src): os.replace(src, dst)
+        shutil.rmtree(legacy_cache, ignore_errors=True)
+    return dataset
 
-# Base de datos en memoria (Cache)
-DB_CACHE = {}
+@app.before_request
+def maintain_datasets():
+    """Limpieza periódica de conjuntos caducados y adopción de los datos del formato anterior."""
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup >= CLEANUP_INTERVAL:
+        _last_cleanup = now
+        cleanup_datasets(now)
+    if request.endpoint != 'static' and current_dataset() is None:
+        dataset = migrate_legacy_data()
+        if dataset is not None:
+            session['dataset'] = dataset
+            session.permanent = True
 
-def process_files_from_disk():
-    """Carga y procesa los archivos desde el disco."""
+def current_dataset():
+    """Id del conjunto de datos de la sesión, o None."""
+    dataset = session.get('dataset')
+    return dataset if isinstance(dataset, str) and re.fullmatch(r'[0-9a-f]{32}', dataset) else None
+
+def process_files_from_disk(dataset=None, progress=None):
+    """
+    Carga y procesa los archivos del conjunto de datos (por defecto, el de la sesión).
+    progress(etapa, filas hechas, total) recibe el avance (ver jobs.Job.progress).
+    """
+    dataset = dataset or current_dataset()
+    progress = progress or (lambda stage, done=0, total=None: None)
     try:
-        if not os.path.exists(PATH_ACC) or not os.path.exists(PATH_TRANS):
+        if dataset is None: return False
+        path_trans, path_acc, path_checkpoints = dataset_paths(dataset)
+        if not os.path.exists(path_acc) or not os.path.exists(path_trans):
             return False
             
-        with open(PATH_TRANS, 'r', encoding='utf-8') as ft, \
-             open(PATH_ACC, 'r', encoding='utf-8') as fa:
-             
-            # Cargar en streams para no cambiar la firma de logic
-            # Aunque analyze_full_history ya acepta file objects, así que ft/fa sirven directo.
-            full_data = analyze_full_history(ft, fa)
+        # Si el contenido no ha cambiado se reutilizan los DataFrames ya parseados
+        progress('parsing')
+        df_t, df_a = load_data_frames_cached(path_trans, path_acc, os.path.dirname(path_trans))
+        progress('parsing', len(df_t) + len(df_a), len(df_t) + len(df_a))
+        if df_t.empty:
+            print("Error: Datos procesados vacíos o estructura inválida.")
+            return False
+        event_rules = load_event_rules(app.config.get('EVENT_RULES_FILE'))
+        version = dataset_version(path_trans, path_acc, event_rules)
+        engine = run_engine(df_t, df_a, checkpoint_path=path_checkpoints, event_rules=event_rules,
+                            progress=progress)
+        progress('serialization', 0, len(df_t))
+        full_data = build_analysis(engine)
+
+        if not full_data or 'global' not in full_data: 
+            print("Error: Datos procesados vacíos o estructura inválida.")
+            return False
             
-            if not full_data or 'global' not in full_data: 
-                print("Error: Datos procesados vacíos o estructura inválida.")
-                return False
-                
-            DB_CACHE['data'] = full_data
-            return True
+        DB_CACHE.put(dataset, {
+            'data': full_data,
+            # Motor ya procesado, para simulaciones sin reprocesar
+            'engine': engine,
+            'series': cost_basis_series(engine.df_trans),
+            # Hash de entradas, motor y reglas: base de los ETag de la API
+            'version': version,
+        })
+        progress('serialization', len(df_t), len(df_t))
+        return True
     except Exception as e:
         print(f"Error procesando archivos persistentes: {e}")
         return False
 
+def dataset_version(path_trans, path_acc, event_rules):
+    """Hash de todo lo que determina el resultado de un conjunto de datos."""
+    with open(path_trans, 'rb') as ft, open(path_acc, 'rb') as fa:
+        files_key = frames_cache_key(ft.read(), fa.read())
+    return hashlib.sha256(f'{files_key}:{ENGINE_VERSION}:{event_rules!r}'.encode()).hexdigest()
+
+def conditional_json(entry, build):
+    """
+    Respuesta JSON con ETag fuerte: versión del conjunto de datos más ruta, parámetros
+    y fecha de referencia (el estado fiscal de las ventas cambia con el día). Si el
+    cliente ya tiene esa versión (If-None-Match) se responde 304 sin llamar a build.
+
+    El JSON se codifica una sola vez por ETag y se guarda en la entrada junto con sus
+    versiones gzip/deflate (cada una se comprime la primera vez que se pide), de modo
+    que las peticiones repetidas solo copian bytes ya preparados.
+    """
+    key = repr((request.path, sorted(request.args.items(multi=True)), reference_date().date()))
+    base = f"{entry['version'][:32]}-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+    encoding = request.accept_encodings.best_match(list(COMPRESSORS)) or 'identity'
+    etag = base + ETAG_SUFFIX[encoding]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(encoded_body(entry, base, encoding, build), mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Datos de la sesión: solo en la cache del navegador, revalidando siempre
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def encoded_body(entry, base, encoding, build):
+    """Bytes de la respuesta base en la codificación pedida, calculados una sola vez."""
+    dataset = current_dataset()
+    # Los dicts compartidos solo se leen y escriben con el lock; se codifica sin él
+    with _encoded_lock:
+        encoded = entry.setdefault('encoded', {}) # {base: {codificación: bytes}}
+        bodies = dict(encoded.get(base, {}))
+    if encoding in bodies: return bodies[encoding]
+    if 'identity' not in bodies:
+        bodies['identity'] = (app.json.dumps(build()) + "\n").encode()
+    if encoding not in bodies:
+        bodies[encoding] = COMPRESSORS[encoding](bodies['identity'])
+
+    with _encoded_lock:
+        stored = encoded.setdefault(base, {})
+        # Otro hilo puede haber guardado ya alguna de las dos: solo cuenta lo nuevo
+        added = sum(len(body) for name, body in bodies.items() if name not in stored)
+        for name, body in bodies.items():
+            stored.setdefault(name, body)
+        # Solo las más recientes: las páginas y fechas posibles no tienen límite
+        while len(encoded) > ENCODED_RESPONSES:
+            added -= sum(map(len, encoded.pop(next(iter(encoded))).values()))
+    DB_CACHE.resize(dataset, added)
+    return stored[encoding]
+
+def as_of_arg():
+    """Fecha de ?as_of= (None = hoy); ValueError si no es válida."""
+    if not request.args.get('as_of'): return None
+    as_of = parse_date_arg(request.args['as_of'])
+    if as_of is None: raise ValueError("Fecha no válida (dd-mm-aaaa o aaaa-mm-dd)")
+    return as_of
+
+def session_entry():
+    """
+    Resultado del conjunto de datos de la sesión. Si no está en memoria (primera
+    visita tras reiniciar o descartado por el LRU) se reconstruye desde disco.
+    """
+    dataset = current_dataset()
+    # Mientras se analiza una subida no hay resultado (ni se reconstruye en paralelo)
+    if dataset is None or JOBS.active(dataset) is not None: return None
+    touch_dataset(dataset)
+    entry = DB_CACHE.get(dataset)
+    if entry is None and process_files_from_disk(dataset):
+        entry = DB_CACHE.peek(dataset)
+    return entry
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -51,128 +267,276 @@ def index():
         acc_file = request.files['account']
         trans_file = request.files['transactions']
         
-        # Guardar en disco (sobrescribir)
-        acc_file.save(PATH_ACC)
-        trans_file.save(PATH_TRANS)
+        # Con un análisis en curso no se tocan sus archivos: se espera a que termine
+        running = JOBS.active(current_dataset())
+        if running is not None:
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({**running.to_dict(), 'error': "Ya hay un análisis en curso"}), 409
+            return redirect(url_for('job_page', job_id=running.id))
 
-        # Procesar
-        if process_files_from_disk():
-            return redirect(url_for('dashboard'))
-        else:
-            return "Error procesando los archivos subidos. Verifique el formato.", 400
+        # Guardar en disco (sobrescribir los de la sesión)
+        dataset = current_dataset() or uuid.uuid4().hex
+        session['dataset'] = dataset
+        session.permanent = True
+        DB_CACHE.pop(dataset)
+        path_trans, path_acc, _ = dataset_paths(dataset)
+        with _datasets_lock: # No coincidir con cleanup_datasets
+            os.makedirs(os.path.dirname(path_trans), exist_ok=True)
+            acc_file.save(path_acc)
+            trans_file.save(path_trans)
+            touch_dataset(dataset)
 
-    # GET: Verificar si ya existen datos
-    if 'data' in DB_CACHE:
-        return redirect(url_for('dashboard'))
-    
-    # Intentar cargar desde disco si se reinició el servidor
-    if process_files_from_disk():
+        # Procesar en segundo plano; se responde al momento con el id del trabajo
+        try:
+            job = JOBS.submit(dataset, lambda progress: process_files_from_disk(dataset, progress), UPLOAD_ERROR)
+        except QueueFull as e:
+            return str(e), 503
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(job.to_dict()), 202
+        return redirect(url_for('job_page', job_id=job.id))
+
+    # GET: Verificar si ya existen datos (en memoria o, tras reiniciar, en disco)
+    job = JOBS.active(current_dataset())
+    if job is not None:
+        return redirect(url_for('job_page', job_id=job.id))
+    if session_entry() is not None:
         return redirect(url_for('dashboard'))
 
     return render_template('index.html')
 
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    """Progreso del análisis de una subida; redirige al dashboard al terminar."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return redirect(url_for('index'))
+    return render_template('job.html', job=job.to_dict())
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Estado del trabajo: state, stage (parsing, fifo, dividends, serialization), done/total filas."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': "Trabajo no encontrado"}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/dashboard')
 def dashboard():
-    if 'data' not in DB_CACHE:
-        # Intento de último recurso si se accede directo
-        if process_files_from_disk():
-            return render_template('dashboard.html')
+    job = JOBS.active(current_dataset())
+    if job is not None:
+        return redirect(url_for('job_page', job_id=job.id))
+    if session_entry() is None:
         return redirect(url_for('index'))
-        
     return render_template('dashboard.html')
 
+@app.route('/update')
+def update_data():
+    """
+    Formulario para subir CSV actualizados sin borrar nada: la subida sobrescribe los
+    archivos de la sesión y conserva sus checkpoints, de modo que el motor reanuda
+    desde el último año cerrado que no haya cambiado.
+    """
+    job = JOBS.active(current_dataset())
+    if job is not None:
+        return redirect(url_for('job_page', job_id=job.id))
+    return render_template('index.html')
+
 @app.route('/reset')
 def reset_data():
-    """Borra los datos en memoria y disco."""
-    DB_CACHE.clear()
-    if os.path.exists(PATH_ACC): os.remove(PATH_ACC)
-    if os.path.exists(PATH_TRANS): os.remove(PATH_TRANS)
+    """Borra los datos de la sesión en memoria y disco."""
+    dataset = current_dataset()
+    if dataset is not None:
+        DB_CACHE.pop(dataset)
+        # CSV, cache de DataFrames y checkpoints de esta sesión, no los de las demás
+        shutil.rmtree(os.path.dirname(dataset_paths(dataset)[0]), ignore_errors=True)
+    session.pop('dataset', None)
     return redirect(url_for('index'))
 
+@app.route('/api/cache')
+def cache_stats():
+    """Contadores del cache de resultados (aciertos, fallos, descartes, memoria)."""
+    return jsonify(DB_CACHE.stats())
+
 @app.route('/api/data')
 def get_data():
-    return jsonify(DB_CACHE.get('data', {}))
+    """Análisis completo; ?as_of=dd-mm-aaaa da el estado fiscal de las ventas a esa fecha (por defecto hoy)."""
+    entry = session_entry()
+    if not entry: return jsonify({})
+    try:
+        as_of = as_of_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Los años se convierten a dict aquí (una vez por fecha de referencia) y no al procesar
+    years = entry['data']['years']
+    return conditional_json(entry, lambda: {
+        'years': {y: years.as_of(y, as_of) for y in years}, 'global': entry['data']['global'],
+        'series': entry['series'].downsample(SERIES_POINTS)})
 
-# --- NUEVA RUTA PARA DESCARGAR ZIP ---
-@app.route('/download/<int:year>')
-def download_report(year):
-    if 'data' not in DB_CACHE or year not in DB_CACHE['data']['years']:
-        return "Datos no encontrados para este año", 404
+@app.route('/api/summary')
+def get_summary():
+    """Resumen global y serie de capital invertido, sin el detalle de cada año."""
+    entry = session_entry()
+    if not entry: return jsonify({})
+    return conditional_json(entry, lambda: {'global': entry['data']['global'],
+                                            'series': entry['series'].downsample(SERIES_POINTS)})
 
-    data = DB_CACHE['data']['years'][year]
-    
-    # Crear buffer en memoria para el ZIP
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        
-        # Función auxiliar para escribir CSV
-        def add_csv_to_zip(filename, headers, rows):
-            si = io.StringIO()
-            # Excel europeo usa ; como separador y codificación utf-8-sig
-            cw = csv.writer(si, delimiter=';')
-            cw.writerow(headers)
-            cw.writerows(rows)
-            zip_file.writestr(filename, si.getvalue().encode('utf-8-sig'))
-
-        # 1. COMPRAS.csv
-        rows_buys = []
-        for b in data['purchases']:
-            rows_buys.append([
-                b['date'], b['product'], b['isin'],
-                fmt_num(b['qty']), fmt_num(b['price']), fmt_num(b['total']), fmt_num(b['fee'])
-            ])
-        add_csv_to_zip(f"compras_{year}.csv", 
-                      ["FECHA", "PRODUCTO", "ISIN", "CANTIDAD", "PRECIO", "TOTAL", "COMISION"], 
-                      rows_buys)
-
-        # 2. VENTAS.csv
-        rows_sales = []
-        for s in data['sales']:
-            rows_sales.append([
-                s['date'], s['product'], s['isin'],
-                fmt_num(s['qty']), fmt_num(s['sale_net']), fmt_num(s['cost_basis']), 
-                fmt_num(s['pnl']), s['note']
-            ])
-        add_csv_to_zip(f"ventas_opas_{year}.csv", 
-                      ["FECHA", "PRODUCTO", "ISIN", "CANTIDAD", "VALOR TRANSMISION", "VALOR ADQUISICION", "P&L NETO", "NOTAS"], 
-                      rows_sales)
-
-        # 3. DIVIDENDOS.csv
-        rows_divs = []
-        for d in data['dividends']:
-            rows_divs.append([
-                d['date'], d['product'], d['isin'], d['currency'],
-                fmt_num(d['gross']), fmt_num(d['wht']), fmt_num(d['net'])
-            ])
-        add_csv_to_zip(f"dividendos_{year}.csv", 
-                      ["FECHA", "PRODUCTO", "ISIN", "DIVISA", "BRUTO", "RETENCION", "NETO"], 
-                      rows_divs)
-
-        # 4. CARTERA.csv
-        rows_port = []
-        for p in data['portfolio']:
-            rows_port.append([
-                p['name'], p['isin'], fmt_num(p['qty']), 
-                fmt_num(p['avg_price']), fmt_num(p['total_cost'])
-            ])
-        add_csv_to_zip(f"cartera_fin_{year}.csv", 
-                      ["PRODUCTO", "ISIN", "CANTIDAD", "PRECIO MEDIO", "TOTAL INVERTIDO"], 
-                      rows_port)
-
-    # Preparar respuesta
-    zip_buffer.seek(0)
+@app.route('/api/years/<int:year>')
+def get_year(year):
+    """Un año completo (?as_of= como en /api/data)."""
+    entry = session_entry()
+    if entry is None or year not in entry['data']['years']:
+        return jsonify({'error': "Datos no encontrados para este año"}), 404
+    try:
+        as_of = as_of_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return conditional_json(entry, lambda: entry['data']['years'].as_of(year, as_of))
+
+@app.route('/api/years/<int:year>/<kind>')
+def get_year_page(year, kind):
+    """
+    Ventas, compras o dividendos de un año paginados y ordenados en el servidor:
+    ?page=1&per_page=50&sort=<campo>&dir=asc|desc[&as_of=dd-mm-aaaa]
+    """
+    entry = session_entry()
+    if entry is None or year not in entry['data']['years'] or kind not in PAGED_KINDS:
+        return jsonify({'error': "Datos no encontrados para este año"}), 404
+    try:
+        as_of = as_of_arg()
+        page = int(request.args.get('page', 1))
+        per_page = min(int(request.args.get('per_page', 50)), 1000)
+        descending = request.args.get('dir', 'asc') == 'desc'
+        # Solo se ordena y pagina si el cliente no tiene ya la respuesta
+        return conditional_json(entry, lambda: page_items(
+            entry['data']['years'].as_of(year, as_of)[kind], request.args.get('sort'), descending, page, per_page))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/simulate')
+def simulate_sale():
+    """Venta hipotética: /api/simulate?isin=X&qty=N&price=P[&date=dd-mm-aaaa][&as_of=dd-mm-aaaa]"""
+    entry = session_entry()
+    if entry is None:
+        return jsonify({'error': "No hay datos cargados"}), 404
+    engine = entry['engine']
+
+    isin = request.args.get('isin', '').strip()
+    qty = clean_number(request.args.get('qty', ''))
+    price = clean_number(request.args.get('price', ''))
+    if not isin or qty <= 0 or price < 0:
+        return jsonify({'error': "Parámetros obligatorios: isin, qty > 0 y price >= 0"}), 400
+    if isin not in engine.portfolio:
+        return jsonify({'error': f"Sin operaciones para el ISIN {isin}"}), 404
+
+    date_obj = None
+    if request.args.get('date'):
+        date_obj = parse_date_arg(request.args['date'])
+        if date_obj is None:
+            return jsonify({'error': "Fecha no válida (dd-mm-aaaa o aaaa-mm-dd)"}), 400
+    try:
+        as_of = as_of_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(engine.simulate_sale(isin, qty, price, date_obj, as_of=as_of))
+
+@app.route('/api/harvest', methods=['POST'])
+def harvest():
+    """
+    Ventas propuestas para compensar la ganancia del año con pérdidas latentes.
+    JSON: {"prices": {isin: precio}, "target": ganancia (por defecto, la del año), "date": "dd-mm-aaaa"}
+    """
+    entry = session_entry()
+    if entry is None:
+        return jsonify({'error': "No hay datos cargados"}), 404
+    engine = entry['engine']
+
+    body = request.get_json(silent=True) or {}
+    prices = body.get('prices')
+    if not isinstance(prices, dict) or not prices:
+        return jsonify({'error': "Falta la tabla de precios {isin: precio}"}), 400
+    try:
+        prices = {isin: float(price) for isin, price in prices.items()}
+        date_obj = parse_date_arg(body['date']) if body.get('date') else \
+            datetime.combine(datetime.now().date(), datetime.min.time())
+        if date_obj is None: raise ValueError("fecha")
+        if body.get('target') is not None:
+            target = float(body['target'])
+        else:
+            # Ganancia fiscal ya realizada en el año de la fecha
+            stats = engine.years_data.get(date_obj.year)
+            target = max(stats.total_pnl_fiscal, 0.0) if stats else 0.0
+    except (TypeError, ValueError):
+        return jsonify({'error': "Precios, objetivo o fecha no válidos"}), 400
+
+    return jsonify(plan_harvest(engine, target, prices, date_obj))
+
+@app.route('/api/holdings')
+def holdings():
+    """Posiciones y lotes abiertos a una fecha: /api/holdings?date=dd-mm-aaaa (por defecto, hoy)"""
+    entry = session_entry()
+    if entry is None:
+        return jsonify({'error': "No hay datos cargados"}), 404
+    date_obj = datetime.combine(datetime.now().date(), datetime.min.time())
+    if request.args.get('date'):
+        date_obj = parse_date_arg(request.args['date'])
+        if date_obj is None:
+            return jsonify({'error': "Fecha no válida (dd-mm-aaaa o aaaa-mm-dd)"}), 400
+
+    # Los checkpoints mensuales se construyen en la primera consulta
+    if 'holdings' not in entry:
+        entry['holdings'] = HoldingsIndex(entry['engine'].df_trans)
+        DB_CACHE.put(current_dataset(), entry) # Actualiza el tamaño de la entrada
+    return jsonify(entry['holdings'].holdings_at(date_obj))
+
+def parse_date_arg(value):
+    for fmt in ('%d-%m-%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+# --- DESCARGA DE INFORMES ZIP ---
+def cached_report(entry, key, build):
+    """
+    Bytes del ZIP `key` (año o 'todos') del conjunto de datos: se genera una vez por
+    versión de los datos y se guarda en la entrada del cache de resultados.
+    """
+    reports = entry.setdefault('reports', {}) # {(versión, año | 'todos'): bytes}
+    cache_key = (entry['version'], key)
+    content = reports.get(cache_key)
+    if content is None:
+        content = reports[cache_key] = zip_report(build())
+        DB_CACHE.resize(current_dataset(), len(content))
+    return content
+
+def send_report(entry, key, content):
     return send_file(
-        zip_buffer,
+        io.BytesIO(content),
         mimetype='application/zip',
         as_attachment=True,
-        download_name=f'Informe_Fiscal_DEGIRO_{year}.zip'
+        download_name=f'Informe_Fiscal_DEGIRO_{key}.zip',
+        etag=f"{entry['version'][:32]}-{key}",
     )
 
-def fmt_num(val):
-    """Convierte float a string formato europeo (coma decimal)"""
-    if val is None: return "0,00"
-    return f"{val:.2f}".replace('.', ',')
+@app.route('/download/<int:year>')
+def download_report(year):
+    entry = session_entry()
+    if entry is None or year not in entry['data']['years']:
+        return "Datos no encontrados para este año", 404
+    years = entry['data']['years']
+    return send_report(entry, year, cached_report(entry, year, lambda: year_report_files(year, years[year])))
+
+@app.route('/download/all')
+def download_all_reports():
+    """Informe de todos los años en un solo ZIP, una carpeta por año."""
+    entry = session_entry()
+    if entry is None:
+        return "Datos no encontrados", 404
+    years = entry['data']['years']
+    content = cached_report(entry, 'todos', lambda: all_years_report_files(years, REPORT_WORKERS))
+    return send_report(entry, 'todos', content)
 
 if __name__ == '__main__':
     app.run(debug=app.config['DEBUG'])
@@ -0,0 +1,133 @@
+"""
+Procesado por lotes de las carteras de muchos clientes, sin la aplicación web.
+
+Uso:
+    python -m degiro_app.batch ENTRADA SALIDA [-j 4]
+
+ENTRADA contiene un subdirectorio por cliente con Transactions.csv y Account.csv,
+o pares <cliente>_Transactions.csv / <cliente>_Account.csv. Para cada cliente se
+escribe SALIDA/<cliente>/analisis.json y los CSV de cada año en SALIDA/<cliente>/<año>/;
+SALIDA/resumen.json recoge el resultado y la duración de cada uno.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Tuple
+import numpy as np
+from .logic import load_data_frames, analyze_frames
+from .reports import year_report_files
+
+TRANS_FILE = 'Transactions.csv'
+ACC_FILE = 'Account.csv'
+
+def find_clients(input_dir: str) -> Dict[str, Tuple[str, str]]:
+    """{cliente: (ruta Transactions.csv, ruta Account.csv)}; Account.csv puede no existir."""
+    clients = {}
+    for entry in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, entry)
+        if os.path.isdir(path):
+            if os.path.exists(os.path.join(path, TRANS_FILE)):
+                clients[entry] = (os.path.join(path, TRANS_FILE), os.path.join(path, ACC_FILE))
+        elif entry.endswith('_' + TRANS_FILE):
+            client = entry[:-len('_' + TRANS_FILE)]
+            clients[client] = (path, os.path.join(input_dir, f'{client}_{ACC_FILE}'))
+    return clients
+
+def _json_default(obj):
+    if isinstance(obj, datetime): return obj.isoformat()
+    if isinstance(obj, np.generic): return obj.item()
+    if hasattr(obj, 'to_dict'): return obj.to_dict()
+    if isinstance(obj, Mapping): return dict(obj) # LazyYears
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+def write_client_reports(client_dir: str, data: dict):
+    os.makedirs(client_dir, exist_ok=True)
+    with open(os.path.join(client_dir, 'analisis.json'), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=_json_default)
+    for year, year_data in data['years'].items():
+        year_dir = os.path.join(client_dir, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        for filename, content in year_report_files(year, year_data):
+            with open(os.path.join(year_dir, filename), 'wb') as f:
+                f.write(content)
+
+def process_client(client: str, trans_path: str, acc_path: str, output_dir: str) -> dict:
+    """Analiza un cliente y escribe sus informes. Los errores se devuelven, no se propagan."""
+    start = time.perf_counter()
+    result = {'client': client, 'ok': False, 'rows': 0}
+    try:
+        with open(trans_path, 'rb') as trans_stream:
+            acc_stream = open(acc_path, 'rb') if os.path.exists(acc_path) else io.BytesIO(b'')
+            with acc_stream:
+                df_t, df_a = load_data_frames(trans_stream, acc_stream)
+        if df_t.empty:
+            raise ValueError(f"{TRANS_FILE} sin operaciones válidas")
+        data = analyze_frames(df_t, df_a)
+        write_client_reports(os.path.join(output_dir, client), data)
+        result.update(ok=True, rows=len(df_t), years=sorted(data['years']))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def run_batch(input_dir: str, output_dir: str, jobs: int = None) -> List[dict]:
+    """Procesa todos los clientes de input_dir con como máximo `jobs` procesos."""
+    clients = find_clients(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(process_client, client, trans, acc, output_dir): client
+                   for client, (trans, acc) in clients.items()}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # El proceso hijo murió (memoria, señal...): el resto del lote sigue
+                result = {'client': futures[future], 'ok': False, 'rows': 0, 'seconds': None,
+                          'error': f"{type(e).__name__}: {e}"}
+            if not result['ok']:
+                print(f"[ERROR] {result['client']}: {result['error']}", file=sys.stderr)
+            results.append(result)
+    results.sort(key=lambda r: r['client'])
+    return results
+
+def summarize(results: List[dict], wall_seconds: float) -> str:
+    ok = [r for r in results if r['ok']]
+    rows = sum(r['rows'] for r in ok)
+    wall = max(wall_seconds, 1e-9)
+    lines = [
+        f"Clientes: {len(results)} ({len(ok)} correctos, {len(results) - len(ok)} con error)",
+        f"Tiempo total: {wall_seconds:.2f} s | {len(results) / wall:.2f} clientes/s | {rows / wall:,.0f} filas/s",
+    ]
+    latencies = [r['seconds'] for r in results if r['seconds'] is not None]
+    if latencies:
+        p50, p95 = np.percentile(latencies, [50, 95])
+        lines.append(f"Latencia por cliente: p50 {p50:.2f} s | p95 {p95:.2f} s | máx {max(latencies):.2f} s")
+    return '\n'.join(lines)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m degiro_app.batch',
+                                     description="Análisis fiscal por lotes de varios clientes de DEGIRO.")
+    parser.add_argument('input_dir', help="Directorio con los CSV de cada cliente")
+    parser.add_argument('output_dir', help="Directorio donde escribir los informes")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help="Clientes procesados en paralelo (por defecto, nº de CPUs)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = run_batch(args.input_dir, args.output_dir, max(1, args.jobs))
+    wall = time.perf_counter() - start
+
+    with open(os.path.join(args.output_dir, 'resumen.json'), 'w', encoding='utf-8') as f:
+        json.dump({'seconds': wall, 'clients': results}, f, ensure_ascii=False, indent=2)
+    print(summarize(results, wall))
+    return 0 if all(r['ok'] for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Cache en memoria de resultados de análisis, uno por conjunto de datos (sesión).
+
+ResultCache es un LRU con presupuesto de memoria: cada entrada guarda su tamaño
+estimado al insertarla y, si el total supera el presupuesto, se descartan las menos
+usadas recientemente. Una entrada descartada no se pierde: la aplicación la reconstruye
+desde los CSV persistidos la próxima vez que se pide (ver app.session_entry).
+"""
+import sys
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Optional
+import numpy as np
+import pandas as pd
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+def estimate_size(obj: Any) -> int:
+    """
+    Bytes aproximados de obj y de todo lo que referencia: DataFrames y arrays por su
+    memoria real, contenedores y objetos del paquete recorriendo su contenido (cada
+    objeto cuenta una vez aunque esté referenciado desde varios sitios).
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen: continue
+        seen.add(id(o))
+        if isinstance(o, pd.DataFrame):
+            total += int(o.memory_usage(deep=True).sum())
+        elif isinstance(o, (pd.Series, pd.Index)):
+            total += int(o.memory_usage(deep=True))
+        elif isinstance(o, np.ndarray):
+            total += o.nbytes
+        else:
+            total += sys.getsizeof(o)
+            if isinstance(o, dict):
+                stack.extend(o.keys())
+                stack.extend(o.values())
+            elif isinstance(o, _CONTAINERS):
+                stack.extend(o)
+            elif type(o).__module__.startswith('degiro_app'):
+                # Objetos propios: atributos de instancia y slots
+                stack.extend(vars(o).values() if hasattr(o, '__dict__') else ())
+                for cls in type(o).__mro__:
+                    for name in getattr(cls, '__slots__', ()):
+                        if hasattr(o, name): stack.append(getattr(o, name))
+    return total
+
+class ResultCache:
+    """LRU de entradas {clave: valor} acotado por max_bytes, con contadores de uso."""
+
+    def __init__(self, max_bytes: int, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Valor de key (y lo marca como el más reciente), o None contando un fallo."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Como get, pero sin tocar el orden LRU ni los contadores."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Inserta o reemplaza key y descarta las entradas menos recientes hasta volver al
+        presupuesto. La entrada recién insertada se conserva aunque por sí sola lo supere.
+        Llamar de nuevo con el mismo valor actualiza su tamaño si ha crecido.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > 1 and self.size > self.max_bytes:
+            old, _ = self._entries.popitem(last=False)
+            del self._sizes[old]
+            self.evictions += 1
+
+    def resize(self, key: Hashable, delta: int):
+        """Suma delta bytes al tamaño de key (datos añadidos a la entrada tras insertarla)."""
+        with self._lock:
+            if key not in self._sizes: return
+            self._sizes[key] += delta
+            self._evict()
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._sizes.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file
@@ -9,4 +10,18 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     DEBUG = os.environ.get('DEBUG', 'False').lower() in ('true', '1', 't')
 
+    # JSON con reglas de eventos especiales (ver events.load_event_rules); vacío = por defecto
+    EVENT_RULES_FILE = os.environ.get('EVENT_RULES_FILE')
+
+    # Presupuesto de memoria del cache de resultados por sesión (MB)
+    RESULT_CACHE_MB = int(os.environ.get('RESULT_CACHE_MB', 512))
+
+    # Análisis de subidas en segundo plano: hilos y máximo de trabajos pendientes
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 2))
+    ANALYSIS_QUEUE = int(os.environ.get('ANALYSIS_QUEUE', 8))
+
+    # Días sin uso tras los que caduca la sesión y se borran sus archivos del disco
+    DATASET_RETENTION_DAYS = int(os.environ.get('DATASET_RETENTION_DAYS', 31))
+    PERMANENT_SESSION_LIFETIME = timedelta(days=DATASET_RETENTION_DAYS)
+
     # Add other configuration variables here
@@ -1,86 +1,405 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from itertools import islice, repeat
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from .models import (
-    Transaction, PortfolioBatch, SaleResult, DividendResult, 
-    PortfolioPosition, YearStats
+    Transaction, PortfolioBatch, LotLedger, SaleResult, DividendResult, 
+    PortfolioPosition, YearStats, EngineCheckpoint, Purchase
 )
+from .exact import ExactFifo, exact_fifo, to_fixed, CENTS, MICRO
+from .events import EventRule, DEFAULT_EVENT_RULES, classify_events
+
+# Incrementar si cambia la lógica del motor para invalidar checkpoints guardados
+ENGINE_VERSION = 4
+
+WASH_SALE_WINDOW = timedelta(days=62)
+BLOCKED_PREFIX = "⚠️ BLOQ (2 Meses)"
+WINDOW_NS = int(WASH_SALE_WINDOW.total_seconds()) * 10**9
+# Cada cuántas filas se informa del avance del bucle FIFO
+PROGRESS_EVERY = 2000
+
+# Tipos de movimiento del extracto de cuenta relevantes para el motor
+DESC_OTHER, DESC_CONNECTIVITY, DESC_DIVIDEND, DESC_WITHHOLDING = range(4)
+
+def classify_account_desc(desc: str) -> int:
+    """Clasifica la descripción de una línea de Account.csv."""
+    if 'conectividad' in desc.lower():
+        return DESC_CONNECTIVITY
+    if 'Dividendo' in desc or ('Retención' in desc and 'dividendo' in desc):
+        return DESC_WITHHOLDING if 'Retención' in desc else DESC_DIVIDEND
+    return DESC_OTHER
+
+def to_ns(date_obj) -> int:
+    """Fecha como entero de nanosegundos, comparable con las columnas datetime64[ns]."""
+    return int(np.datetime64(date_obj, 'ns').astype(np.int64))
+
+def date_column_ns(col: pd.Series) -> np.ndarray:
+    return pd.to_datetime(col).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+class IsinTradeIndex:
+    """
+    Operaciones de un ISIN ordenadas por (fecha, fila) con sumas acumuladas de
+    compras y ventas, para resolver ventanas temporales con búsqueda binaria y
+    diferencias de prefijos en lugar de máscaras sobre el DataFrame.
+    """
+    __slots__ = ('dates', 'rows', 'qty', 'cum_buy_qty', 'cum_sell_qty', 'cum_buy_count', 'rows_by_date')
+
+    def __init__(self, dates: np.ndarray, rows: np.ndarray, qty: np.ndarray):
+        self.dates = dates
+        self.rows = rows
+        self.qty = qty
+        buys = qty > 0
+        self.cum_buy_qty = np.concatenate(([0.0], np.cumsum(np.where(buys, qty, 0.0))))
+        self.cum_sell_qty = np.concatenate(([0.0], np.cumsum(np.where(qty < 0, qty, 0.0))))
+        self.cum_buy_count = np.concatenate(([0], np.cumsum(buys)))
+        # Si el orden por fecha coincide con el de filas, "fila <= venta" es un corte contiguo
+        self.rows_by_date = bool(np.all(np.diff(rows) >= 0))
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> Dict[str, 'IsinTradeIndex']:
+        """Construye el índice de todos los ISIN de df_trans de una sola pasada."""
+        if df.empty: return {}
+        codes, isins = pd.factorize(df['isin'])
+        dates = date_column_ns(df['date_obj'])
+        rows = df.index.to_numpy()
+        qty = df['qty'].to_numpy(dtype=float)
+
+        order = np.lexsort((rows, dates, codes))
+        order = order[codes[order] >= 0] # ISIN nulos no se indexan
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        index = {}
+        for chunk in np.split(order, bounds):
+            if len(chunk):
+                index[isins[codes[chunk[0]]]] = cls(dates[chunk], rows[chunk], qty[chunk])
+        return index
+
+    def window(self, start_ns: int, end_ns: int) -> Tuple[int, int]:
+        return (int(np.searchsorted(self.dates, start_ns, 'left')),
+                int(np.searchsorted(self.dates, end_ns, 'right')))
+
+class IsinCashIndex:
+    """
+    Movimientos positivos de la cuenta agrupados por ISIN y ordenados por fecha,
+    para localizar con búsqueda binaria el efectivo recibido en torno a una fecha
+    (OPA, fusiones...) sin filtrar todo df_acc en cada consulta.
+    """
+    __slots__ = ('dates', 'rows', 'amounts')
+
+    def __init__(self, dates: np.ndarray, rows: np.ndarray, amounts: np.ndarray):
+        self.dates = dates
+        self.rows = rows
+        self.amounts = amounts
+
+    @classmethod
+    def build(cls, df_acc: pd.DataFrame) -> Dict[str, 'IsinCashIndex']:
+        if df_acc.empty or not {'isin', 'date_obj', 'amount_fix'} <= set(df_acc.columns): return {}
+        amounts = df_acc['amount_fix'].to_numpy(dtype=float)
+        positive = np.flatnonzero(amounts > 0)
+        if not len(positive): return {}
+        codes, isins = pd.factorize(df_acc['isin'].iloc[positive])
+        dates = date_column_ns(df_acc['date_obj']).take(positive)
+
+        order = np.lexsort((positive, dates, codes))
+        order = order[codes[order] >= 0]
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        index = {}
+        for chunk in np.split(order, bounds):
+            if len(chunk):
+                index[isins[codes[chunk[0]]]] = cls(dates[chunk], positive[chunk], amounts[positive[chunk]])
+        return index
+
+    def amounts_between(self, start: datetime, end: datetime) -> np.ndarray:
+        """Importes con fecha en [start, end], en el orden original del extracto."""
+        lo = int(np.searchsorted(self.dates, to_ns(start), 'left'))
+        hi = int(np.searchsorted(self.dates, to_ns(end), 'right'))
+        if hi - lo <= 1: return self.amounts[lo:hi]
+        return self.amounts[lo:hi][np.argsort(self.rows[lo:hi], kind='stable')]
+
+def time_status(is_blocked: bool, safe_date: datetime, now: datetime):
+    """Campos que dependen de la fecha de referencia: (blocked_status, wash_risk, consolidated)."""
+    if is_blocked:
+        return ('active' if now < safe_date else 'released'), False, False
+    if now < safe_date:
+        return None, True, False
+    return None, False, True
+
+def reference_date(as_of: Optional[datetime] = None) -> datetime:
+    """Fecha de referencia del estado fiscal: as_of o, por defecto, hoy a medianoche."""
+    if as_of is None:
+        return datetime.combine(datetime.now().date(), datetime.min.time())
+    return as_of
+
+def sales_time_status(sales: List[SaleResult], as_of: datetime):
+    """
+    time_status de todas las ventas a la vez. El motor solo guarda los hechos que no
+    dependen de la fecha (pérdida, bloqueo y fecha de la venta); el estado se deriva
+    aquí al leer. Devuelve (índices de las ventas con pérdida, blocked_status,
+    wash_risk, consolidated), estos tres alineados con los índices.
+    """
+    n = len(sales)
+    pnl = np.fromiter((s.pnl for s in sales), dtype=float, count=n)
+    losing = np.flatnonzero(pnl < 0)
+    blocked = np.fromiter((sales[i].blocked for i in losing.tolist()), dtype=bool, count=len(losing))
+    sale_ns = np.array([sales[i].date for i in losing.tolist()], dtype='datetime64[ns]').astype(np.int64)
+    pending = to_ns(as_of) < sale_ns + WINDOW_NS
+    status = np.where(blocked, np.where(pending, 'active', 'released'), None)
+    return losing, status, pending & ~blocked, ~pending & ~blocked
+
+def iter_transactions(df: pd.DataFrame, start_row: int = 0, rows: Optional[np.ndarray] = None):
+    """
+    Genera los registros Transaction a partir de columnas extraídas una sola vez,
+    evitando construir un pd.Series por fila como hace iterrows. row_index es la
+    posición en df_trans ordenado (start_row + i, o rows[i] si se indica).
+    """
+    if df.empty: return
+    dates = pd.DatetimeIndex(df['date_obj']).to_pydatetime()
+    events = df['event'].tolist() if 'event' in df.columns else repeat("", len(df))
+    columns = zip(
+        range(start_row, start_row + len(df)) if rows is None else rows.tolist(),
+        dates,
+        df['product'].tolist(),
+        df['isin'].tolist(),
+        df['qty'].to_numpy(dtype=float).tolist(),
+        df['total_eur'].to_numpy(dtype=float).tolist(),
+        df['fee_eur'].to_numpy(dtype=float).tolist(),
+        df['date'].tolist(),
+        events,
+    )
+    for idx, date_obj, prod, isin, qty, total_eur, fee_eur, date_str, event in columns:
+        yield Transaction(date=date_obj, product=str(prod), isin=isin, qty=qty,
+                          total_eur=total_eur, fee_eur=fee_eur, row_index=idx, date_str=date_str, event=event)
 
 class PortfolioEngine:
-    def __init__(self, df_trans: pd.DataFrame, df_acc: pd.DataFrame):
+    def __init__(self, df_trans: pd.DataFrame, df_acc: pd.DataFrame,
+                 checkpoints: Optional[List[EngineCheckpoint]] = None, exact: bool = False,
+                 event_rules: Sequence[EventRule] = DEFAULT_EVENT_RULES, report_divergences: bool = False):
         self.df_trans = df_trans
         self.df_acc = df_acc
+
+        # Reglas de eventos especiales por palabra clave (events.py); la primera de cada tipo manda
+        self.event_rules = tuple(event_rules)
+        self._event_flags: Dict[str, EventRule] = {}
+        for rule in self.event_rules:
+            self._event_flags.setdefault(rule.event, rule)
+
+        # Modo exacto: costes y carteras en coma fija (exact.py), sin LotLedger. Con
+        # report_divergences se repite además el cálculo en float y divergences recoge
+        # las ventas y posiciones en que ambos difieren
+        self.exact = exact
+        self.report_divergences = report_divergences
+        self.divergences: List[dict] = []
         
         # Estado Global
-        self.portfolio: Dict[str, Dict] = {} # {isin: {'batches': [], 'name': str}}
+        self.portfolio: Dict[str, LotLedger] = {} # {isin: cola FIFO de lotes}
         self.years_data: Dict[int, YearStats] = {}
+
+        # Checkpoints por cambio de año (None = desactivados). Tras process() contiene
+        # los reutilizados más los nuevos; resumed_from indica el año cerrado reutilizado.
+        self.checkpoints: Optional[List[EngineCheckpoint]] = checkpoints
+        self.resumed_from: Optional[int] = None
         
-        # Indexación para Wash Sales (optimización)
-        self.trans_by_isin = self.df_trans.groupby('isin')
+        # Indexación para Wash Sales: fechas ordenadas y sumas acumuladas por ISIN
+        self.trade_index: Dict[str, IsinTradeIndex] = IsinTradeIndex.build(self.df_trans)
+        # Efectivo entrante por ISIN y fecha (OPAs y otras búsquedas en el extracto)
+        self.cash_index: Dict[str, IsinCashIndex] = IsinCashIndex.build(self.df_acc)
 
     def get_year_stats(self, year: int) -> YearStats:
         if year not in self.years_data:
             self.years_data[year] = YearStats(year=year)
         return self.years_data[year]
 
-    def process(self):
+    def process(self, workers: int = 1, progress: Optional[Callable[[str, int, int], None]] = None):
         """
         Ejecuta el procesamiento cronológico de todas las transacciones (Single Pass).
+        Con workers > 1 reparte los ISIN entre procesos (mismo resultado); los
+        checkpoints solo se usan en modo secuencial (el modo exacto no los usa).
+        progress(etapa, filas hechas, total) se llama al avanzar ('fifo' cada
+        PROGRESS_EVERY filas, 'dividends').
         """
+        progress = progress or _no_progress
         # Asegurar columna time
         if 'time' not in self.df_trans.columns:
             self.df_trans['time'] = '00:00'
             
         # Asegurar orden cronológico absoluto
         self.df_trans = self.df_trans.sort_values(by=['date_obj', 'time']).reset_index(drop=True)
+        # Eventos especiales de todas las filas de una vez, antes del bucle
+        self.df_trans['event'] = classify_events(self.df_trans, self.event_rules)
+
+        n_rows = len(self.df_trans)
+        progress('fifo', 0, n_rows)
+        if self.exact:
+            self._process_exact()
+        elif workers > 1 and self.checkpoints is None:
+            self._process_parallel(workers, progress)
+        else:
+            self._process_sequential(progress)
+        progress('fifo', n_rows, n_rows)
+
+        # Procesar dividendos
+        n_acc = len(self.df_acc)
+        progress('dividends', 0, n_acc)
+        self._process_dividends()
+        progress('dividends', n_acc, n_acc)
+
+        if self.exact and self.report_divergences:
+            self._report_divergences(workers)
 
+    def _process_sequential(self, progress=None):
+        progress = progress or _no_progress
+        n_rows = len(self.df_trans)
         current_year = None
+        start_row = 0
+        if self.checkpoints is not None:
+            self._prepare_checkpoint_hashes()
+            start_row, current_year = self._restore_checkpoint()
 
-        for idx, row in self.df_trans.iterrows():
-            row_year = row['date_obj'].year
+        for tx in self._iter_transactions(start_row):
+            if tx.row_index % PROGRESS_EVERY == 0:
+                progress('fifo', tx.row_index, n_rows)
+            row_year = tx.date.year
             
             # Detectar cambio de año para snapshot
             if current_year is not None and row_year > current_year:
                 # Rellenar snapshots para todos los años intermedios (ej: gap 2022 -> 2024, rellenar 2022 y 2023)
                 for y in range(current_year, row_year):
                     self._snapshot_portfolio(y)
+                if self.checkpoints is not None:
+                    self._record_checkpoint(tx.row_index, current_year, row_year - 1)
             
             current_year = row_year
-            self._process_row(idx, row)
+            self._process_transaction(tx)
 
         # Snapshot final para el último año (y posteriores si queremos proyectar, pero basta con el último con datos)
         if current_year is not None:
             self._snapshot_portfolio(current_year)
-            
-        # Procesar dividendos
-        self._process_dividends()
 
-    def _process_row(self, idx: int, row: pd.Series):
-        date_obj = row['date_obj']
-        year = date_obj.year
-        stats = self.get_year_stats(year)
+    # --- MODO PARALELO POR ISIN ---
+    def _process_parallel(self, workers: int, progress=None):
+        """
+        Reparte los ISIN entre procesos: lotes FIFO, eventos especiales y anti-aplicación
+        no dependen de otros ISIN. Cada proceso devuelve el resultado de cada fila y su
+        cartera al cierre de cada año; aquí se agregan en el orden global de filas para
+        que sumas y listas coincidan exactamente con el modo secuencial.
+        """
+        df = self.df_trans
+        if df.empty: return
+        row_years = pd.DatetimeIndex(df['date_obj']).year.to_numpy()
+        snapshot_years = list(range(int(row_years[0]), int(row_years[-1]) + 1))
+        for year in snapshot_years:
+            self.get_year_stats(year)
+
+        # Reparto equilibrado por número de filas (ISIN más grandes primero)
+        codes, isins = pd.factorize(df['isin'], use_na_sentinel=False)
+        sizes = np.bincount(codes, minlength=len(isins))
+        loads = [0] * min(workers, len(isins))
+        shard_of = np.empty(len(isins), dtype=np.int64)
+        for code in np.argsort(-sizes, kind='stable').tolist():
+            shard = loads.index(min(loads))
+            shard_of[code] = shard
+            loads[shard] += int(sizes[code])
+
+        columns = ['date_obj', 'date', 'product', 'isin', 'qty', 'total_eur', 'fee_eur', 'event']
+        row_shard = shard_of[codes]
+        payloads = []
+        for shard in range(len(loads)):
+            rows = np.flatnonzero(row_shard == shard)
+            shard_isins = isins[shard_of == shard]
+            payloads.append((
+                df[columns].iloc[rows], rows,
+                {i: self.trade_index[i] for i in shard_isins if i in self.trade_index},
+                {i: self.cash_index[i] for i in shard_isins if i in self.cash_index},
+                snapshot_years, self.event_rules,
+            ))
+        progress = progress or _no_progress
+        results, done = [], 0
+        with ProcessPoolExecutor(max_workers=len(payloads)) as pool:
+            for payload, result in zip(payloads, pool.map(_process_shard, payloads)):
+                results.append(result)
+                done += len(payload[1])
+                progress('fifo', done, len(df))
+
+        # Ventas, compras y comisiones en el orden global de filas
+        sales = [SaleResult(*s) for _, shard_sales, *_ in results for s in shard_sales]
+        purchases = [Purchase(*p) for _, _, _, shard_purchases, *_ in results for p in shard_purchases]
+        out_rows = np.concatenate([r[0] for r in results] + [r[2] for r in results])
+        outputs = sales + purchases
+        fees = df['fee_eur'].to_numpy(dtype=float).tolist()
+        years = row_years.tolist()
+        for i in np.argsort(out_rows, kind='stable').tolist():
+            row = int(out_rows[i])
+            stats = self.years_data[years[row]]
+            if i < len(sales):
+                self._add_sale(stats, outputs[i])
+            else:
+                stats.purchases.append(outputs[i])
+            stats.fees_trading += abs(fees[row])
+
+        # Cartera y lotes en el orden de aparición de cada ISIN, como el dict del modo secuencial
+        order = dict.fromkeys(isin for isin, qty in zip(df['isin'].tolist(), df['qty'].tolist()) if isin and qty != 0)
+        for year in snapshot_years:
+            positions = {pos.isin: pos for *_, snapshots, _ in results for pos in snapshots[year]}
+            self._set_portfolio(self.years_data[year], [positions[i] for i in order if i in positions])
+        ledgers = {isin: ledger for *_, portfolio in results for isin, ledger in portfolio.items()}
+        self.portfolio = {isin: ledgers[isin] for isin in order}
+
+    def _run_shard(self, df: pd.DataFrame, rows: np.ndarray, snapshot_years: List[int]):
+        """
+        Procesa las filas de un grupo de ISIN (ver _process_parallel). Ventas y compras
+        se devuelven como tuplas con su fila: se serializan mucho más rápido que los objetos.
+        También devuelve los lotes abiertos al final de cada ISIN del grupo.
+        """
+        sale_rows, sales, purchase_rows, purchases, snapshots = [], [], [], [], {}
+        bounds = np.searchsorted(pd.DatetimeIndex(df['date_obj']).year.to_numpy(), snapshot_years, 'right')
+        txs = iter_transactions(df, rows=rows)
+        done = 0
+        for year, end in zip(snapshot_years, bounds.tolist()):
+            for tx in islice(txs, end - done):
+                record = self._process_transaction(tx)
+                if isinstance(record, SaleResult):
+                    sale_rows.append(tx.row_index)
+                    sales.append(record.to_row())
+                elif record is not None:
+                    purchase_rows.append(tx.row_index)
+                    purchases.append(record.to_row())
+            done = end
+            snapshots[year] = self._open_positions()
+        return (np.array(sale_rows, dtype=np.int64), sales, np.array(purchase_rows, dtype=np.int64),
+                purchases, snapshots, self.portfolio)
+
+    def _iter_transactions(self, start_row: int = 0):
+        return iter_transactions(self.df_trans.iloc[start_row:], start_row)
+
+    def _process_transaction(self, tx: Transaction):
+        """Aplica una fila; devuelve la compra o venta registrada (None si se ignora)."""
+        date_obj = tx.date
+        stats = self.get_year_stats(date_obj.year)
         
-        isin = row['isin']
-        qty = row['qty']
-        total_eur = row['total_eur']
-        fee_eur = row['fee_eur']
-        prod_name = str(row['product'])
+        isin = tx.isin
+        qty = tx.qty
+        prod_name = tx.product
 
         if not isin or qty == 0: return
 
         # Inicializar cartera para este ISIN
         if isin not in self.portfolio:
-            self.portfolio[isin] = {'batches': [], 'name': prod_name}
+            self.portfolio[isin] = LotLedger(prod_name)
         else:
-            self.portfolio[isin]['name'] = prod_name # Actualizar nombre si cambia
+            self.portfolio[isin].name = prod_name # Actualizar nombre si cambia
 
         if qty > 0:
-            self._handle_buy(stats, isin, qty, total_eur, fee_eur, date_obj, row['date'], prod_name)
+            record = self._handle_buy(stats, isin, qty, tx.total_eur, tx.fee_eur, date_obj, tx.date_str, prod_name)
         else:
-            self._handle_sell(stats, idx, isin, qty, total_eur, date_obj, row['date'], prod_name)
+            record = self._handle_sell(stats, tx.row_index, isin, qty, tx.total_eur, date_obj, tx.date_str, prod_name,
+                                       tx.event)
             
         # Acumular fees de trading
-        stats.fees_trading += abs(fee_eur)
+        stats.fees_trading += abs(tx.fee_eur)
+        return record
 
     def _handle_buy(self, stats: YearStats, isin: str, qty: float, total_eur: float, fee_eur: float, 
                    date_obj: datetime, date_str: str, prod_name: str):
@@ -89,47 +408,49 @@ class PortfolioEngine:
         
         # FIFO Logic: Add batch
         batch = PortfolioBatch(quantity=qty, unit_cost=unit_cost, date=date_obj)
-        self.portfolio[isin]['batches'].append(batch)
+        self.portfolio[isin].add(batch)
         
         # Report
-        stats.purchases.append({
-            'date': date_str,
-            'product': prod_name,
-            'isin': isin,
-            'qty': qty,
-            'price': unit_cost,
-            'total': cost,
-            'fee': fee_eur
-        })
+        purchase = Purchase(
+            date=date_str,
+            product=prod_name,
+            isin=isin,
+            qty=qty,
+            price=unit_cost,
+            total=cost,
+            fee=fee_eur
+        )
+        stats.purchases.append(purchase)
+        return purchase
 
     def _handle_sell(self, stats: YearStats, row_idx: int, isin: str, qty: float, total_eur: float, 
-                    date_obj: datetime, date_str: str, prod_name: str):
+                    date_obj: datetime, date_str: str, prod_name: str, event_type: str = ""):
         qty_sold = abs(qty)
         sale_proceeds = total_eur
         
-        # Detectar eventos especiales
-        event_type, sale_proceeds = self._detect_special_event(prod_name, isin, date_obj, sale_proceeds)
+        # Eventos especiales (ya clasificados en la columna 'event')
+        rule = self._event_flags.get(event_type)
+        if rule is not None and rule.account_cash:
+            # Buscar cash OPA en Account
+            found_cash = self._find_opa_cash(isin, date_obj)
+            if found_cash > 0: sale_proceeds = found_cash
         
         # Lógica FIFO
         cost_basis, warning, min_batch_date = self._consume_fifo_batches(isin, qty_sold)
         
         # Si es DERECHOS, coste es 0 (norma general simplificada)
-        if event_type == "DERECHOS":
+        if rule is not None and rule.zero_cost:
             cost_basis = 0.0
             warning = False
 
         pnl = sale_proceeds - cost_basis
         
         # Analizar Wash Sale (Anti-aplicación)
-        is_blocked, blocked_status, unlock_date_str, wash_risk, consolidated, safe_date_str = \
+        is_blocked, unlock_date_str, safe_date_str = \
             self._analyze_tax_status(isin, row_idx, pnl, date_obj, min_batch_date)
 
         if is_blocked:
-            event_type = f"⚠️ BLOQ (2 Meses) {event_type}".strip()
-            stats.stats_blocked += abs(pnl)
-        
-        if pnl > 0: stats.stats_wins += 1
-        elif pnl < 0: stats.stats_losses += 1
+            event_type = f"{BLOCKED_PREFIX} {event_type}".strip()
 
         # Registrar Venta
         sale_result = SaleResult(
@@ -143,204 +464,528 @@ class PortfolioEngine:
             warning=warning,
             note=event_type,
             blocked=is_blocked,
-            blocked_status=blocked_status,
             unlock_date=unlock_date_str,
-            wash_sale_risk=wash_risk,
-            loss_consolidated=consolidated,
             repurchase_safe_date=safe_date_str
         )
-        stats.sales.append(sale_result)
+        self._add_sale(stats, sale_result)
+        return sale_result
+
+    @staticmethod
+    def _add_sale(stats: YearStats, sale: SaleResult):
+        """Registra la venta y acumula P&L y contadores del año."""
+        pnl = sale.pnl
+        if sale.blocked:
+            stats.stats_blocked += abs(pnl)
+        
+        if pnl > 0: stats.stats_wins += 1
+        elif pnl < 0: stats.stats_losses += 1
+
+        stats.sales.append(sale)
         
         # Acumular P&L
         stats.total_pnl_real += pnl
-        if not is_blocked:
+        if not sale.blocked:
             stats.total_pnl_fiscal += pnl
 
     def _consume_fifo_batches(self, isin: str, shares_to_sell: float) -> Tuple[float, bool, datetime]:
-        cost_basis = 0.0
-        warning = False
-        min_date = None
-        batches = self.portfolio[isin]['batches']
-        
-        while shares_to_sell > 0.0001:
-            if not batches:
-                warning = True
-                break
-            
-            batch = batches[0]
-            if min_date is None: min_date = batch.date
-            
-            if batch.quantity > shares_to_sell:
-                cost_basis += shares_to_sell * batch.unit_cost
-                batch.quantity -= shares_to_sell
-                shares_to_sell = 0
-            else:
-                cost_basis += batch.quantity * batch.unit_cost
-                shares_to_sell -= batch.quantity
-                batches.pop(0)
-                
-        return cost_basis, warning, min_date
-
-    def _detect_special_event(self, prod_name: str, isin: str, date_obj: datetime, original_proceeds: float):
-        event_type = ""
-        proceeds = original_proceeds
-        
-        u_prod = prod_name.upper()
-        if "RTS" in u_prod or "DERECHO" in u_prod:
-            event_type = "DERECHOS"
-        elif "OPA" in u_prod or "FUSION" in u_prod:
-            # Buscar cash OPA en Account
-            found_cash = self._find_opa_cash(isin, date_obj)
-            if found_cash > 0: proceeds = found_cash
-            event_type = "OPA/FUSIÓN"
-        elif "CANJE" in u_prod or "SPLIT" in u_prod:
-            event_type = "CANJE/SPLIT"
-        elif abs(proceeds) < 0.1:
-             event_type = "CANJE/SPLIT"
-             
-        return event_type, proceeds
+        return self.portfolio[isin].consume(shares_to_sell)
 
     def _find_opa_cash(self, isin: str, date_ref: datetime) -> float:
-        if self.df_acc.empty: return 0.0
+        cash = self.cash_index.get(isin)
+        if cash is None: return 0.0
         start = date_ref - timedelta(days=10)
         end = date_ref + timedelta(days=10)
-        mask = (self.df_acc['isin'] == isin) & \
-               (self.df_acc['date_obj'] >= start) & \
-               (self.df_acc['date_obj'] <= end) & \
-               (self.df_acc['amount_fix'] > 0)
-        matches = self.df_acc[mask]
-        return matches['amount_fix'].sum() if not matches.empty else 0.0
-
-    def _analyze_tax_status(self, isin: str, row_idx: int, pnl: float, date_obj: datetime, min_batch_date: datetime):
+        matches = cash.amounts_between(start, end)
+        return matches.sum() if len(matches) else 0.0
+
+    def _analyze_tax_status(self, isin: str, row_idx: int, pnl: float, date_obj: datetime, min_batch_date: datetime,
+                            trades: Optional[IsinTradeIndex] = None):
+        """
+        Hechos de la venta que no dependen de la fecha actual: (bloqueada, fecha de
+        desbloqueo, fecha segura de recompra). El estado a una fecha lo da time_status.
+        """
         is_blocked = False
-        blocked_status = None
         unlock_date_str = None
-        wash_risk = False
-        consolidated = False
-        safe_date_str = None
         
         if pnl >= 0:
-            return False, None, None, False, False, None
+            return False, None, None
 
         # Check Anti-Aplicación
-        # Usamos self.trans_by_isin para acceso rápido vectorizado
-        if isin in self.trans_by_isin.groups:
-            # Obtenemos el sub-dataframe solo para este ISIN
-            df_isin = self.trans_by_isin.get_group(isin)
-            is_blocked = self._check_anti_aplicacion_optimized(df_isin, row_idx, date_obj, min_batch_date)
+        if trades is None: trades = self.trade_index.get(isin)
+        if trades is not None:
+            is_blocked = self._check_anti_aplicacion_optimized(trades, row_idx, date_obj, min_batch_date)
         
-        safe_date = date_obj + timedelta(days=62)
+        safe_date = date_obj + WASH_SALE_WINDOW
         safe_date_str = safe_date.strftime('%d-%m-%Y')
-        now = datetime.now()
-
         if is_blocked:
             unlock_date_str = safe_date_str
-            blocked_status = 'active' if now < safe_date else 'released'
-        else:
-            if now < safe_date:
-                wash_risk = True
-            else:
-                consolidated = True
                 
-        return is_blocked, blocked_status, unlock_date_str, wash_risk, consolidated, safe_date_str
+        return is_blocked, unlock_date_str, safe_date_str
 
-    def _check_anti_aplicacion_optimized(self, df_isin: pd.DataFrame, row_idx: int, sale_date: datetime, min_batch_date: datetime):
-        start = sale_date - timedelta(days=62)
-        end = sale_date + timedelta(days=62)
+    def _check_anti_aplicacion_optimized(self, trades: IsinTradeIndex, row_idx: int, sale_date: datetime, min_batch_date: datetime):
+        start = sale_date - WASH_SALE_WINDOW
+        end = sale_date + WASH_SALE_WINDOW
         
-        # Filtrar ventana temporal
-        mask_window = (df_isin['date_obj'] >= start) & (df_isin['date_obj'] <= end)
-        df_window = df_isin[mask_window]
-        
-        if df_window.empty: return False
+        # Filtrar ventana temporal (búsqueda binaria sobre fechas ordenadas)
+        lo, hi = trades.window(to_ns(start), to_ns(end))
+        if lo == hi: return False
 
-        # Future Purchases: Index > row_index (en df_trans global)
-        # Como df_window es un slice, usamos los índices originales
-        purchases_future = df_window[(df_window.index > row_idx) & (df_window['qty'] > 0)]['qty'].sum()
-        
-        if purchases_future > 0: return True
+        # Separar la ventana en filas <= row_idx (pasado) y > row_idx (futuro)
+        if trades.rows_by_date:
+            split = lo + int(np.searchsorted(trades.rows[lo:hi], row_idx, 'right'))
+            buys_future = trades.cum_buy_count[hi] - trades.cum_buy_count[split]
+            buys_past = trades.cum_buy_count[split] - trades.cum_buy_count[lo]
+            purchases_past = trades.cum_buy_qty[split] - trades.cum_buy_qty[lo]
+            sales_past = abs(trades.cum_sell_qty[split] - trades.cum_sell_qty[lo])
+        else:
+            # Filas desordenadas respecto a la fecha: recorrer solo la ventana
+            qty = trades.qty[lo:hi]
+            past = trades.rows[lo:hi] <= row_idx
+            buys = qty > 0
+            buys_future = np.count_nonzero(buys & ~past)
+            buys_past = np.count_nonzero(buys & past)
+            purchases_past = qty[buys & past].sum()
+            sales_past = abs(qty[(qty < 0) & past].sum())
+
+        # Future Purchases
+        if buys_future > 0: return True
         
         # Old Shares Sold scenario
-        if min_batch_date and min_batch_date < start:
-            purchases_in_window_before_sale = df_window[
-                (df_window.index <= row_idx) & (df_window['qty'] > 0)
-            ]['qty'].sum()
-            if purchases_in_window_before_sale > 0: return True
+        if min_batch_date and min_batch_date < start and buys_past > 0:
+            return True
 
         # Standard Net Flow Check
-        purchases_past = df_window[(df_window.index <= row_idx) & (df_window['qty'] > 0)]['qty'].sum()
-        sales_past = abs(df_window[(df_window.index <= row_idx) & (df_window['qty'] < 0)]['qty'].sum())
-        
         if purchases_past - sales_past > 0.001: return True
         
         return False
 
     def _process_dividends(self):
         if self.df_acc.empty: return
+        df = self.df_acc
         
+        # Clasificar cada descripción distinta una sola vez y propagar por códigos
+        codes, descs = pd.factorize(df['desc'].to_numpy(dtype=object).astype(str))
+        kind = np.array([classify_account_desc(d) for d in descs], dtype=np.int8)[codes]
+        amounts = df['amount_fix'].to_numpy(dtype=float)
+        years = pd.DatetimeIndex(df['date_obj']).year.to_numpy()
+
+        # Connectivity Fees logic
+        conn = np.flatnonzero(kind == DESC_CONNECTIVITY)
+        if len(conn):
+            conn_years, inverse = np.unique(years[conn], return_inverse=True)
+            totals = np.zeros(len(conn_years))
+            # np.add.at suma en el orden de las filas, igual que la acumulación fila a fila
+            np.add.at(totals, inverse, np.abs(amounts[conn]))
+            for year, total in zip(conn_years.tolist(), totals.tolist()):
+                self.get_year_stats(year).fees_connectivity += total
+
         # Agrupar dividendos por (Fecha, ISIN, Producto, Divisa)
         # Para sumar 'Retención' y 'Bruto' que vienen en líneas separadas
-        # Opcional: Vectorizar esto si es lento, pero suele ser rápido.
-        
-        raw_divs = {}
-        
-        for _, row in self.df_acc.iterrows():
-            date_obj = row['date_obj']
-            year = date_obj.year
-            desc = str(row['desc'])
-            amt = row['amount_fix']
-            curr = str(row['currency_fix'])
-            
-            # Connectivity Fees logic
-            if 'conectividad' in desc.lower():
-                stats = self.get_year_stats(year)
-                stats.fees_connectivity += abs(amt)
-                continue
-
-            # Dividend logic
-            if 'Dividendo' in desc or ('Retención' in desc and 'dividendo' in desc):
-                key = (year, date_obj, row['isin'], row['product'], curr)
-                if key not in raw_divs:
-                    raw_divs[key] = {'gross': 0.0, 'wht': 0.0}
-                
-                if 'Retención' in desc:
-                    raw_divs[key]['wht'] += abs(amt)
-                else:
-                    raw_divs[key]['gross'] += amt
+        div = np.flatnonzero((kind == DESC_DIVIDEND) | (kind == DESC_WITHHOLDING))
+        if not len(div): return
+        sub = df.iloc[div]
+        currencies = sub['currency_fix'].to_numpy(dtype=object).astype(str)
+        group_ids = sub.groupby(
+            [sub['date_obj'], sub['isin'], sub['product'], currencies], sort=False, dropna=False
+        ).ngroup().to_numpy()
+        _, first_rows = np.unique(group_ids, return_index=True)
         
+        div_amounts = amounts[div]
+        is_wht = kind[div] == DESC_WITHHOLDING
+        gross = np.zeros(len(first_rows))
+        wht = np.zeros(len(first_rows))
+        np.add.at(gross, group_ids[~is_wht], div_amounts[~is_wht])
+        np.add.at(wht, group_ids[is_wht], np.abs(div_amounts[is_wht]))
+
         # Distribuir resultados a los años correspondientes
-        for (year, date_obj, isin, prod, curr), val in raw_divs.items():
-            if val['gross'] > 0.01:
-                net_val = max(0.0, val['gross'] - val['wht'])
+        dates = pd.DatetimeIndex(sub['date_obj'].iloc[first_rows]).to_pydatetime()
+        isins = sub['isin'].iloc[first_rows].tolist()
+        products = sub['product'].iloc[first_rows].tolist()
+        for date_obj, isin, prod, curr, g, w in zip(dates, isins, products, currencies[first_rows].tolist(),
+                                                   gross.tolist(), wht.tolist()):
+            if g > 0.01:
                 div_result = DividendResult(
                     date=date_obj,
                     product=prod,
                     isin=isin,
                     currency=curr,
-                    gross=val['gross'],
-                    wht=val['wht'],
-                    net=net_val,
+                    gross=g,
+                    wht=w,
+                    net=max(0.0, g - w),
                     desc="Dividendo"
                 )
-                self.get_year_stats(year).dividends.append(div_result)
+                self.get_year_stats(date_obj.year).dividends.append(div_result)
+
+    # --- MODO EXACTO ---
+    def _process_exact(self):
+        """
+        Ventas, compras, totales y carteras anuales a partir de exact_fifo, por columnas
+        y sin LotLedger; solo se recorren una a una las ventas con pérdidas (regla de los
+        2 meses) y las de eventos con efectivo en cuenta. Los importes se acumulan en
+        céntimos. Al terminar, self.portfolio tiene los lotes abiertos para simulate_sale.
+        """
+        df = self.df_trans
+        if df.empty: return
+        n_rows = len(df)
+        fifo = exact_fifo(df)
+        position = np.full(n_rows, -1, dtype=np.int64)
+        position[fifo.rows] = np.arange(len(fifo.rows))
+        row_years = pd.DatetimeIndex(df['date_obj']).year.to_numpy()
+        years = np.arange(row_years[0], row_years[-1] + 1)
+        year_idx = row_years - years[0]
+        for year in years.tolist():
+            self.get_year_stats(year)
+
+        # Filas válidas: con ISIN y cantidad no nula (mismo criterio que exact_fifo)
+        valid = np.flatnonzero(position >= 0)
+        qty = df['qty'].to_numpy(dtype=float)
+        totals = df['total_eur'].to_numpy(dtype=float)
+        fees = df['fee_eur'].to_numpy(dtype=float)
+        products = df['product'].astype(str).to_numpy(dtype=object)
+        isins = df['isin'].to_numpy(dtype=object)
+        dates = df['date_obj'].to_numpy()
+
+        # Comisiones: np.add.at suma en el orden de las filas, como el bucle float
+        fees_by_year = np.zeros(len(years))
+        np.add.at(fees_by_year, year_idx[valid], np.abs(fees[valid]))
+
+        buys = valid[qty[valid] > 0]
+        buy_cost = np.abs(totals[buys])
+        purchases = [
+            Purchase(date=d, product=p, isin=i, qty=q, price=c / q, total=c, fee=f)
+            for d, p, i, q, c, f in zip(df['date'].to_numpy(dtype=object)[buys].tolist(), products[buys].tolist(),
+                                        isins[buys].tolist(), qty[buys].tolist(), buy_cost.tolist(),
+                                        fees[buys].tolist())
+        ]
+
+        # Ventas: coste FIFO exacto salvo eventos de coste cero
+        sells = valid[qty[valid] < 0]
+        k = position[sells]
+        events = df['event'].cat
+        rules = [self._event_flags.get(e) for e in events.categories]
+        codes = events.codes.to_numpy()[sells]
+        zero_cost = np.array([r is not None and r.zero_cost for r in rules], dtype=bool)[codes]
+        account_cash = np.array([r is not None and r.account_cash for r in rules], dtype=bool)[codes]
+        sale_isins = isins[sells].tolist()
+        sale_dates = pd.DatetimeIndex(dates[sells]).to_pydatetime()
+        proceeds = to_fixed(totals[sells], CENTS)
+        for i in np.flatnonzero(account_cash).tolist():
+            found_cash = self._find_opa_cash(sale_isins[i], sale_dates[i])
+            if found_cash > 0: proceeds[i] = round(found_cash * CENTS)
+        cost = np.where(zero_cost, 0, fifo.cost[k])
+        warning = ~zero_cost & (fifo.unmatched[k] > 0)
+        pnl = proceeds - cost
+
+        # Regla de los 2 meses: solo afecta a las ventas con pérdidas
+        blocked = np.zeros(len(sells), dtype=bool)
+        unlock_dates, safe_dates = [None] * len(sells), [None] * len(sells)
+        losing = np.flatnonzero(pnl < 0)
+        first_rows = fifo.first_lot_row[k[losing]]
+        lot_dates = pd.DatetimeIndex(dates[np.maximum(first_rows, 0)]).to_pydatetime()
+        for i, first_row, lot_date in zip(losing.tolist(), first_rows.tolist(), lot_dates):
+            blocked[i], unlock_dates[i], safe_dates[i] = self._analyze_tax_status(
+                sale_isins[i], int(sells[i]), pnl[i] / CENTS, sale_dates[i], lot_date if first_row >= 0 else None)
+
+        notes = np.array(events.categories, dtype=object)[codes].tolist()
+        sales = [
+            SaleResult(d, p, i, q, s / CENTS, c / CENTS, v / CENTS, w,
+                       f"{BLOCKED_PREFIX} {note}".strip() if b else note, b, u, r)
+            for d, p, i, q, s, c, v, w, note, b, u, r in zip(
+                sale_dates, products[sells].tolist(), sale_isins, (-qty[sells]).tolist(), proceeds.tolist(),
+                cost.tolist(), pnl.tolist(), warning.tolist(), notes, blocked.tolist(), unlock_dates, safe_dates)
+        ]
+
+        # Totales de cada año, sumados en céntimos
+        sale_year = year_idx[sells]
+        def by_year(values):
+            out = np.zeros(len(years), dtype=np.int64)
+            np.add.at(out, sale_year, values)
+            return out
+        real, fiscal = by_year(pnl), by_year(np.where(blocked, 0, pnl))
+        blocked_total = by_year(np.where(blocked, np.abs(pnl), 0))
+        wins, losses = by_year(pnl > 0), by_year(pnl < 0)
+        sale_bounds = np.searchsorted(sale_year, np.arange(len(years) + 1)).tolist()
+        buy_bounds = np.searchsorted(year_idx[buys], np.arange(len(years) + 1)).tolist()
+        fees_by_year = fees_by_year.tolist()
+        for y, year in enumerate(years.tolist()):
+            stats = self.years_data[year]
+            stats.sales.extend(sales[sale_bounds[y]:sale_bounds[y + 1]])
+            stats.purchases.extend(purchases[buy_bounds[y]:buy_bounds[y + 1]])
+            stats.fees_trading += fees_by_year[y]
+            stats.total_pnl_real = int(real[y]) / CENTS
+            stats.total_pnl_fiscal = int(fiscal[y]) / CENTS
+            stats.stats_blocked = int(blocked_total[y]) / CENTS
+            stats.stats_wins, stats.stats_losses = int(wins[y]), int(losses[y])
+
+        self._set_exact_portfolios(fifo, row_years, years, products)
+        self._set_exact_ledgers(fifo, products)
+
+    def _set_exact_portfolios(self, fifo: ExactFifo, row_years: np.ndarray, years: np.ndarray, products: np.ndarray):
+        """Cartera al cierre de cada año: última fila de cada ISIN antes del cierre, buscada para todos a la vez."""
+        n_isins = len(fifo.isins)
+        group = np.repeat(np.arange(n_isins), np.diff(fifo.offsets))
+        # Filas de exact_fifo agrupadas por ISIN y ordenadas dentro del grupo: la clave es creciente
+        stride = len(row_years) + 1
+        keys = group * stride + fifo.rows
+        ends = np.searchsorted(row_years, years, 'right')
+        last = np.searchsorted(keys, np.arange(n_isins)[:, None] * stride + ends, 'left') - 1
+        seen = last >= fifo.offsets[:-1, None]
+        last = np.where(seen, last, 0)
+        open_qty = np.where(seen, fifo.open_qty[last], 0)
+        open_cost = fifo.open_cost[last]
+        names = products[fifo.rows[last]]
+
+        for y, year in enumerate(years.tolist()):
+            held = np.flatnonzero(open_qty[:, y] > 0)
+            qty_micro, cost_cents = open_qty[held, y], open_cost[held, y]
+            stats = self.years_data[year]
+            stats.portfolio = [
+                PortfolioPosition(str(name), fifo.isins[i], q / MICRO, c / q * (MICRO / CENTS), c / CENTS)
+                for name, i, q, c in zip(names[held, y].tolist(), held.tolist(),
+                                         qty_micro.tolist(), cost_cents.tolist())
+            ]
+            stats.portfolio_value = int(cost_cents.sum()) / CENTS
+
+    def _set_exact_ledgers(self, fifo: ExactFifo, products: np.ndarray):
+        """self.portfolio con los lotes abiertos al final; el primero puede estar consumido en parte."""
+        qty = to_fixed(self.df_trans['qty'], MICRO)
+        cost = np.abs(to_fixed(self.df_trans['total_eur'], CENTS))
+        open_lots = []
+        for i, isin in enumerate(fifo.isins):
+            lo, hi = fifo.offsets[i], fifo.offsets[i + 1]
+            rows = fifo.rows[lo:hi]
+            ledger = self.portfolio[isin] = LotLedger(str(products[rows[-1]]))
+            open_qty, open_cost = int(fifo.open_qty[hi - 1]), int(fifo.open_cost[hi - 1])
+            if open_qty <= 0: continue
+
+            # Lotes abiertos: las últimas compras hasta cubrir la cantidad abierta
+            buys = rows[qty[rows] > 0]
+            remaining = np.cumsum(qty[buys][::-1])[::-1] # Acciones desde cada compra hasta el final
+            buys = buys[np.count_nonzero(remaining >= open_qty) - 1:]
+            lot_qty, lot_cost = qty[buys], cost[buys]
+            lot_qty[0] -= lot_qty.sum() - open_qty
+            lot_cost[0] -= lot_cost.sum() - open_cost
+            open_lots.append((ledger, buys, lot_qty / MICRO, lot_cost / CENTS * MICRO / lot_qty))
+
+        if not open_lots: return
+        rows = np.concatenate([buys for _, buys, _, _ in open_lots])
+        dates = iter(pd.DatetimeIndex(self.df_trans['date_obj'].to_numpy()[rows]).to_pydatetime())
+        for ledger, _, lot_qty, unit_cost in open_lots:
+            for q, unit in zip(lot_qty.tolist(), unit_cost.tolist()):
+                ledger.add(PortfolioBatch(quantity=q, unit_cost=unit, date=next(dates)))
+
+    def _report_divergences(self, workers: int = 1):
+        """
+        Repite el FIFO en float (LotLedger) sobre las mismas filas y añade a
+        self.divergences las ventas y posiciones anuales en que no coincide con el modo
+        exacto: el float redondeado al céntimo (o a la micro-acción) difiere, o cambian
+        el aviso, el bloqueo o el signo del P&L. Las diferencias se dan en esas unidades.
+        """
+        reference = PortfolioEngine(self.df_trans, self.df_acc, event_rules=self.event_rules)
+        if workers > 1:
+            reference._process_parallel(workers)
+        else:
+            reference._process_sequential()
+
+        # Ventas de ambos modos emparejadas por fila (las dos listas van en orden de filas)
+        df = self.df_trans
+        qty = df['qty'].to_numpy(dtype=float)
+        float_rows = np.flatnonzero(df['isin'].astype(bool).to_numpy() & (qty < 0))
+        exact_rows = np.flatnonzero((to_fixed(qty, MICRO) < 0) & df['isin'].astype(bool).to_numpy())
+        float_sales = [sale for year in sorted(reference.years_data) for sale in reference.years_data[year].sales]
+        exact_sales = [sale for year in sorted(self.years_data) for sale in self.years_data[year].sales]
+        float_of = dict(zip(float_rows.tolist(), float_sales))
+        for row, exact_sale in zip(exact_rows.tolist(), exact_sales):
+            sale = float_of.get(row)
+            if sale is None: continue # Cantidad por debajo de la micro-acción: el modo exacto no la vende
+            cost_diff = round(sale.cost_basis * CENTS) - round(exact_sale.cost_basis * CENTS)
+            pnl_diff = round(sale.pnl * CENTS) - round(exact_sale.pnl * CENTS)
+            if cost_diff or pnl_diff or sale.warning != exact_sale.warning or sale.blocked != exact_sale.blocked \
+                    or (sale.pnl < 0) != (exact_sale.pnl < 0):
+                self.divergences.append({
+                    'kind': 'sale', 'year': exact_sale.date.year, 'date': exact_sale.date, 'isin': exact_sale.isin,
+                    'product': exact_sale.product,
+                    'float_cost': sale.cost_basis, 'exact_cost': exact_sale.cost_basis, 'cost_diff_cents': cost_diff,
+                    'float_pnl': sale.pnl, 'exact_pnl': exact_sale.pnl, 'pnl_diff_cents': pnl_diff,
+                    'float_warning': sale.warning, 'exact_warning': exact_sale.warning,
+                    'float_blocked': sale.blocked, 'exact_blocked': exact_sale.blocked,
+                })
+
+        for year, stats in self.years_data.items():
+            exact_positions = {pos.isin: pos for pos in stats.portfolio}
+            float_positions = {pos.isin: pos for pos in reference.years_data[year].portfolio}
+            for isin in dict.fromkeys([*exact_positions, *float_positions]):
+                exact_pos, float_pos = exact_positions.get(isin), float_positions.get(isin)
+                exact_qty, exact_cost = (exact_pos.qty, exact_pos.total_cost) if exact_pos else (0.0, 0.0)
+                float_qty, float_cost = (float_pos.qty, float_pos.total_cost) if float_pos else (0.0, 0.0)
+                qty_diff = round(float_qty * MICRO) - round(exact_qty * MICRO)
+                cost_diff = round(float_cost * CENTS) - round(exact_cost * CENTS)
+                if qty_diff or cost_diff:
+                    self.divergences.append({
+                        'kind': 'position', 'year': year, 'isin': isin, 'product': (exact_pos or float_pos).name,
+                        'float_qty': float_qty, 'exact_qty': exact_qty, 'qty_diff_micro': qty_diff,
+                        'float_cost': float_cost, 'exact_cost': exact_cost, 'cost_diff_cents': cost_diff,
+                    })
+
+    # --- SIMULACIÓN ---
+    def simulate_sale(self, isin: str, qty: float, price: float, date_obj: Optional[datetime] = None,
+                      as_of: Optional[datetime] = None) -> dict:
+        """
+        Venta hipotética de qty acciones de isin a price (por defecto hoy) sobre el estado
+        ya procesado: FIFO y regla de los 2 meses con la misma lógica que una venta real.
+        Solo se copia la cola de lotes de ese ISIN; el motor no se modifica. El estado
+        fiscal se evalúa a fecha as_of (por defecto hoy).
+        """
+        if date_obj is None:
+            date_obj = reference_date()
+        ledger = self.portfolio.get(isin)
+        clone = ledger.copy() if ledger is not None else LotLedger(isin)
+        available = clone.quantity
+
+        cost_basis, warning, min_batch_date = clone.consume(qty)
+        sale_net = qty * price
+        pnl = sale_net - cost_basis
+
+        is_blocked, unlock_date_str, safe_date_str = \
+            self.hypothetical_tax_status(isin, pnl, date_obj, min_batch_date)
+        blocked_status, wash_risk, consolidated = None, False, False
+        if pnl < 0:
+            blocked_status, wash_risk, consolidated = \
+                time_status(is_blocked, date_obj + WASH_SALE_WINDOW, reference_date(as_of))
+
+        sale = SaleResult(
+            date=date_obj,
+            product=clone.name,
+            isin=isin,
+            qty=qty,
+            sale_net=sale_net,
+            cost_basis=cost_basis,
+            pnl=pnl,
+            warning=warning,
+            note=BLOCKED_PREFIX if is_blocked else "",
+            blocked=is_blocked,
+            unlock_date=unlock_date_str,
+            repurchase_safe_date=safe_date_str
+        )
+        result = sale.to_dict()
+        result.update(blocked_status=blocked_status, wash_sale_risk=wash_risk, loss_consolidated=consolidated,
+                      available_qty=available, remaining_qty=clone.quantity, remaining_cost=clone.cost)
+        return result
+
+    def hypothetical_tax_status(self, isin: str, pnl: float, date_obj: datetime, min_batch_date: Optional[datetime]):
+        """
+        _analyze_tax_status para una venta que no está en el CSV. Las operaciones hasta
+        date_obj cuentan como pasadas y las posteriores como futuras: se numeran por
+        fecha en lugar de por fila del CSV.
+        """
+        row_idx = -1
+        trades = self.trade_index.get(isin)
+        if trades is not None:
+            trades = IsinTradeIndex(trades.dates, np.arange(len(trades.dates)), trades.qty)
+            row_idx = int(np.searchsorted(trades.dates, to_ns(date_obj), 'right')) - 1
+        return self._analyze_tax_status(isin, row_idx, pnl, date_obj, min_batch_date, trades)
+
+    # --- CHECKPOINTS INCREMENTALES ---
+    def _prepare_checkpoint_hashes(self):
+        """Hashes por fila de las transacciones y de los cobros de la cuenta (vectorizado)."""
+        df = self.df_trans
+        # 'event' incluido: un cambio en las reglas de eventos invalida los checkpoints
+        cols = [c for c in ('date_obj', 'time', 'date', 'isin', 'product', 'qty', 'total_eur', 'fee_eur', 'event')
+                if c in df.columns]
+        self._trans_row_hashes = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+        self._trans_dates = date_column_ns(df['date_obj']) if not df.empty else np.zeros(0, dtype=np.int64)
+
+        # Cobros de la cuenta: multiconjunto ordenado por fecha (el orden del extracto puede variar)
+        acc = self.df_acc
+        if acc.empty or not {'isin', 'date_obj', 'amount_fix'} <= set(acc.columns):
+            self._acc_dates = np.zeros(0, dtype=np.int64)
+            self._acc_cum_hash = np.zeros(1, dtype=np.uint64)
+            return
+        acc = acc[acc['amount_fix'] > 0]
+        dates = date_column_ns(acc['date_obj'])
+        hashes = pd.util.hash_pandas_object(acc[['date_obj', 'isin', 'amount_fix']], index=False).to_numpy()
+        order = np.argsort(dates, kind='stable')
+        self._acc_dates = dates[order]
+        # Suma con desbordamiento: independiente del orden dentro de cada fecha
+        self._acc_cum_hash = np.concatenate(([0], np.cumsum(hashes[order], dtype=np.uint64))).astype(np.uint64)
+
+    def _checkpoint_hashes(self, closed_year: int) -> Tuple[str, str]:
+        """Hashes de todo lo que puede influir en los años <= closed_year."""
+        horizon = to_ns(datetime(closed_year + 1, 1, 1) + WASH_SALE_WINDOW)
+        n_trans = int(np.searchsorted(self._trans_dates, horizon, 'left'))
+        trans_hash = hashlib.sha256(self._trans_row_hashes[:n_trans].tobytes()).hexdigest()
+        n_acc = int(np.searchsorted(self._acc_dates, horizon, 'left'))
+        acc_hash = f'{n_acc}:{int(self._acc_cum_hash[n_acc])}'
+        return trans_hash, acc_hash
+
+    def _record_checkpoint(self, rows_consumed: int, first_closed: int, last_closed: int):
+        trans_hash, acc_hash = self._checkpoint_hashes(last_closed)
+        self.checkpoints.append(EngineCheckpoint(
+            closed_year=last_closed,
+            rows_consumed=rows_consumed,
+            trans_hash=trans_hash,
+            acc_hash=acc_hash,
+            portfolio={isin: ledger.copy() for isin, ledger in self.portfolio.items()},
+            closed_years={y: self.years_data[y].copy() for y in range(first_closed, last_closed + 1)},
+        ))
+
+    def _restore_checkpoint(self) -> Tuple[int, Optional[int]]:
+        """
+        Restaura el checkpoint válido más reciente. Devuelve (fila inicial, año en curso);
+        (0, None) si hay que reprocesar desde el principio.
+        """
+        valid = 0
+        for i, cp in enumerate(self.checkpoints):
+            if cp.rows_consumed >= len(self.df_trans) or \
+               (cp.trans_hash, cp.acc_hash) != self._checkpoint_hashes(cp.closed_year):
+                break
+            valid = i + 1
+        self.checkpoints = self.checkpoints[:valid]
+        if not valid: return 0, None
+
+        cp = self.checkpoints[-1]
+        self.portfolio = {isin: ledger.copy() for isin, ledger in cp.portfolio.items()}
+        # Las ventas guardadas no dependen de la fecha actual: se reutilizan tal cual
+        for saved in self.checkpoints:
+            for year, stats in saved.closed_years.items():
+                self.years_data[year] = stats.copy()
+        self.resumed_from = cp.closed_year
+        return cp.rows_consumed, cp.closed_year + 1
 
     def _snapshot_portfolio(self, year: int):
         # Crear snapshot para el año indicado (normalmente el último)
-        stats = self.get_year_stats(year)
-        port_val = 0.0
-        
-        for isin, data in self.portfolio.items():
-            qty = sum(b.quantity for b in data['batches'])
+        self._set_portfolio(self.get_year_stats(year), self._open_positions())
+
+    def _open_positions(self) -> List[PortfolioPosition]:
+        positions = []
+        for isin, ledger in self.portfolio.items():
+            qty = ledger.quantity
             if qty > 0.001:
-                cost = sum(b.quantity * b.unit_cost for b in data['batches'])
-                port_val += cost
-                pos = PortfolioPosition(
-                    name=data['name'],
+                cost = ledger.cost
+                positions.append(PortfolioPosition(
+                    name=ledger.name,
                     isin=isin,
                     qty=qty,
                     avg_price=cost/qty,
                     total_cost=cost
-                )
-                stats.portfolio.append(pos)
-        
+                ))
+        return positions
+
+    @staticmethod
+    def _set_portfolio(stats: YearStats, positions: List[PortfolioPosition]):
+        port_val = 0.0
+        for pos in positions:
+            port_val += pos.total_cost
+            stats.portfolio.append(pos)
         stats.portfolio_value = port_val
+
+def _no_progress(stage: str, done: int, total: int):
+    pass
+
+def _process_shard(payload):
+    """Proceso hijo del modo paralelo: lotes y estado fiscal de un grupo de ISIN."""
+    df, rows, trade_index, cash_index, snapshot_years, event_rules = payload
+    engine = PortfolioEngine(df.iloc[:0], pd.DataFrame(), event_rules=event_rules)
+    engine.trade_index = trade_index
+    engine.cash_index = cash_index
+    return engine._run_shard(df, rows, snapshot_years)
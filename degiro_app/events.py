@@ -0,0 +1,76 @@
+"""
+Clasificación de operaciones especiales (venta de derechos, OPA, canjes...) a partir
+del nombre del producto.
+
+Las reglas se prueban por orden de prioridad con un único patrón compilado, una vez
+por nombre de producto distinto, y el resultado se propaga a todas las filas como una
+columna categórica que el motor lee directamente. Para añadir palabras clave o tipos
+de evento basta con otra tabla de reglas (ver load_event_rules), sin tocar engine.py.
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+@dataclass(frozen=True)
+class EventRule:
+    """Tipo de evento y palabras clave (en mayúsculas) que lo identifican en el producto."""
+    event: str
+    keywords: Tuple[str, ...]
+    zero_cost: bool = False # Coste de adquisición 0 (venta de derechos)
+    account_cash: bool = False # El importe es el efectivo recibido en la cuenta (OPA, fusión)
+
+DEFAULT_EVENT_RULES: Tuple[EventRule, ...] = (
+    EventRule("DERECHOS", ("RTS", "DERECHO"), zero_cost=True),
+    EventRule("OPA/FUSIÓN", ("OPA", "FUSION"), account_cash=True),
+    EventRule("CANJE/SPLIT", ("CANJE", "SPLIT")),
+)
+
+# Sin palabra clave pero con importe casi nulo: salida de acciones sin flujo de efectivo
+SMALL_PROCEEDS_EVENT = "CANJE/SPLIT"
+SMALL_PROCEEDS = 0.1
+
+def load_event_rules(path: Optional[str]) -> Tuple[EventRule, ...]:
+    """
+    Reglas desde un JSON [{"event", "keywords", "zero_cost", "account_cash"}, ...], en
+    orden de prioridad. Sin ruta se usan las reglas por defecto.
+    """
+    if not path: return DEFAULT_EVENT_RULES
+    with open(path, encoding='utf-8') as f:
+        return tuple(EventRule(event=r['event'], keywords=tuple(k.upper() for k in r['keywords']),
+                               zero_cost=bool(r.get('zero_cost')), account_cash=bool(r.get('account_cash')))
+                     for r in json.load(f))
+
+def compile_rules(rules: Sequence[EventRule]) -> re.Pattern:
+    """
+    Un grupo por regla, cada uno con una búsqueda anticipada de sus palabras clave. Las
+    alternativas se prueban en orden desde el inicio, así que gana la regla de mayor
+    prioridad aunque otra palabra aparezca antes en el nombre.
+    """
+    branches = [f"(?=.*?(?:{'|'.join(map(re.escape, rule.keywords))}))()" for rule in rules if rule.keywords]
+    return re.compile('|'.join(branches) or r'(?!)', re.DOTALL)
+
+def event_categories(rules: Iterable[EventRule]) -> list:
+    return list(dict.fromkeys(["", *(rule.event for rule in rules), SMALL_PROCEEDS_EVENT]))
+
+def classify_events(df_trans: pd.DataFrame, rules: Sequence[EventRule] = DEFAULT_EVENT_RULES) -> pd.Categorical:
+    """Tipo de evento de cada fila ("" si ninguno), como categórica alineada con df_trans."""
+    categories = event_categories(rules)
+    if df_trans.empty:
+        return pd.Categorical([], categories=categories)
+    active = [rule for rule in rules if rule.keywords]
+    rule_code = np.array([categories.index(rule.event) for rule in active] + [0], dtype=np.int64)
+    pattern = compile_rules(active)
+
+    # Cada nombre de producto distinto se evalúa una sola vez
+    codes, names = pd.factorize(df_trans['product'].astype(str))
+    matches = (pattern.match(name.upper()) for name in names)
+    name_event = rule_code[np.fromiter((m.lastindex - 1 if m else -1 for m in matches),
+                                       dtype=np.int64, count=len(names))]
+    events = name_event[codes]
+
+    small = (events == 0) & (np.abs(df_trans['total_eur'].to_numpy(dtype=float)) < SMALL_PROCEEDS)
+    events[small] = categories.index(SMALL_PROCEEDS_EVENT)
+    return pd.Categorical.from_codes(events, categories=categories)
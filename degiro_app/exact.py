@@ -0,0 +1,113 @@
+"""
+FIFO exacto en coma fija: importes en céntimos y cantidades en micro-acciones (int64).
+
+El coste FIFO de las primeras x acciones compradas de un ISIN es una función lineal a
+trozos de las compras acumuladas; con enteros se evalúa exactamente (redondeando al
+céntimo dentro del lote) y el coste de cada venta es la diferencia entre el antes y el
+después, de modo que compras = ventas + cartera al céntimo, sin tolerancias.
+
+PortfolioEngine(exact=True) calcula ventas y carteras solo con estos valores; con
+report_divergences=True deja además en engine.divergences las ventas y posiciones en
+que el FIFO en float de LotLedger no coincide.
+"""
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+import pandas as pd
+
+CENTS = 100
+MICRO = 1_000_000
+
+def to_fixed(values, scale: int) -> np.ndarray:
+    return np.rint(np.asarray(values, dtype=float) * scale).astype(np.int64)
+
+def _mul_div(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    """round(a * b / c) exacto en enteros; los productos que no caben en int64 van por int de Python."""
+    out = np.empty(len(a), dtype=np.int64)
+    big = np.abs(a.astype(float) * b) >= 2.0**62
+    small = ~big
+    out[small] = (a[small] * b[small] + c[small] // 2) // c[small]
+    for i in np.flatnonzero(big).tolist():
+        out[i] = (int(a[i]) * int(b[i]) + int(c[i]) // 2) // int(c[i])
+    return out
+
+@dataclass(slots=True)
+class ExactFifo:
+    """
+    Resultado por fila válida (con ISIN y cantidad != 0) de df_trans ordenado, agrupado
+    por ISIN: las filas del ISIN i ocupan [offsets[i], offsets[i + 1]).
+    """
+    isins: List[str]
+    offsets: np.ndarray
+    rows: np.ndarray # Fila de df_trans
+    cost: np.ndarray # Céntimos de coste consumidos (0 en compras)
+    unmatched: np.ndarray # Micro-acciones vendidas sin lotes disponibles
+    first_lot_row: np.ndarray # Fila de la compra del primer lote consumido (-1 si ninguno)
+    open_qty: np.ndarray # Micro-acciones abiertas tras la fila
+    open_cost: np.ndarray # Céntimos abiertos tras la fila
+
+    def open_at(self, end_row: int):
+        """{isin: (micro-acciones, céntimos, fila)} abiertos tras las filas < end_row."""
+        positions = {}
+        for i, isin in enumerate(self.isins):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            k = lo + int(np.searchsorted(self.rows[lo:hi], end_row, 'left')) - 1
+            if k >= lo:
+                positions[isin] = (int(self.open_qty[k]), int(self.open_cost[k]), int(self.rows[k]))
+        return positions
+
+def _isin_fifo(qty: np.ndarray, cost: np.ndarray, rows: np.ndarray):
+    """Columnas de ExactFifo para las filas de un ISIN."""
+    is_buy = qty > 0
+    sell_qty = np.where(is_buy, 0, -qty)
+    bought = np.cumsum(np.where(is_buy, qty, 0))
+    bought_cost = np.cumsum(np.where(is_buy, cost, 0))
+    sold = np.cumsum(sell_qty)
+    # Lo vendido sin lotes no consume compras posteriores (el motor lo descarta con aviso)
+    unmatched_total = np.maximum.accumulate(np.maximum(sold - bought, 0))
+    consumed = sold - unmatched_total
+    before = np.concatenate(([0], consumed[:-1]))
+
+    # Lotes: final acumulado, coste acumulado, tamaño, coste y fila de la compra
+    lot_end, lot_cost_end = bought[is_buy], bought_cost[is_buy]
+    lot_qty, lot_cost, lot_row = qty[is_buy], cost[is_buy], rows[is_buy]
+    if not len(lot_end):
+        zeros = np.zeros(len(qty), dtype=np.int64)
+        return zeros, np.where(is_buy, 0, sell_qty), zeros - 1, zeros, zeros
+
+    def cost_of(x):
+        # Lote que contiene la acción x y parte consumida de ese lote
+        j = np.minimum(np.searchsorted(lot_end, x, 'left'), len(lot_end) - 1)
+        prev_end = np.where(j > 0, lot_end[j - 1], 0)
+        prev_cost = np.where(j > 0, lot_cost_end[j - 1], 0)
+        return np.where(x > 0, prev_cost + _mul_div(lot_cost[j], x - prev_end, lot_qty[j]), 0)
+
+    consumed_cost = cost_of(consumed)
+    sale_cost = np.where(is_buy, 0, consumed_cost - cost_of(before))
+    first = np.minimum(np.searchsorted(lot_end, before, 'right'), len(lot_end) - 1)
+    first_lot_row = np.where(~is_buy & (consumed > before), lot_row[first], -1)
+    unmatched = np.diff(unmatched_total, prepend=0)
+    return sale_cost, unmatched, first_lot_row, bought - consumed, bought_cost - consumed_cost
+
+def exact_fifo(df_trans: pd.DataFrame) -> ExactFifo:
+    """FIFO exacto de df_trans ordenado cronológicamente (tras PortfolioEngine.process)."""
+    if df_trans.empty:
+        empty = np.zeros(0, dtype=np.int64)
+        return ExactFifo([], np.zeros(1, dtype=np.int64), empty, empty, empty, empty, empty, empty)
+    qty = to_fixed(df_trans['qty'], MICRO)
+    # Mismo criterio que PortfolioEngine._process_transaction (`not isin`)
+    valid = df_trans['isin'].astype(bool).to_numpy() & (qty != 0)
+    rows = np.flatnonzero(valid)
+    codes, isins = pd.factorize(df_trans['isin'].to_numpy()[valid], use_na_sentinel=False)
+    order = np.argsort(codes, kind='stable')
+    rows = rows[order]
+    qty = qty[rows]
+    cost = np.abs(to_fixed(df_trans['total_eur'], CENTS))[rows]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(isins)))))
+
+    columns = [np.empty(len(rows), dtype=np.int64) for _ in range(5)]
+    for i in range(len(isins)):
+        lo, hi = offsets[i], offsets[i + 1]
+        for column, values in zip(columns, _isin_fifo(qty[lo:hi], cost[lo:hi], rows[lo:hi])):
+            column[lo:hi] = values
+    return ExactFifo(list(isins), offsets, rows, *columns)
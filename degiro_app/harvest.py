@@ -0,0 +1,108 @@
+"""
+Compensación de plusvalías con minusvalías latentes (tax-loss harvesting).
+
+A partir de los lotes FIFO abiertos de un PortfolioEngine ya procesado y de una tabla
+de precios, propone qué ventas realizar para compensar una ganancia realizada del año.
+Solo se puede vender desde el lote más antiguo (FIFO), y se apartan las ventas cuya
+pérdida quedaría bloqueada por la regla de los 2 meses.
+"""
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from .engine import PortfolioEngine
+
+def harvest_candidates(engine: PortfolioEngine, prices: Dict[str, float], date_obj: datetime) -> List[dict]:
+    """
+    Máxima pérdida realizable en cada ISIN vendiendo un prefijo FIFO de sus lotes, con
+    su estado fiscal. Todos los lotes se evalúan a la vez sobre arrays planos.
+    """
+    isins = [isin for isin, ledger in engine.portfolio.items() if ledger.quantity > 0.001 and isin in prices]
+    if not isins: return []
+
+    counts = np.array([len(engine.portfolio[isin]) for isin in isins])
+    lots = [batch for isin in isins for batch in engine.portfolio[isin].lots]
+    qty = np.fromiter((b.quantity for b in lots), dtype=float, count=len(lots))
+    unit_cost = np.fromiter((b.unit_cost for b in lots), dtype=float, count=len(lots))
+    isin_price = np.array([float(prices[isin]) for isin in isins])
+    group = np.repeat(np.arange(len(isins)), counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # P&L y acciones acumulados vendiendo lote a lote, reiniciados en cada ISIN
+    lot_pnl = qty * (isin_price[group] - unit_cost)
+    cum_pnl = np.cumsum(lot_pnl)
+    cum_pnl -= np.repeat(cum_pnl[starts] - lot_pnl[starts], counts)
+    cum_qty = np.cumsum(qty)
+    cum_qty -= np.repeat(cum_qty[starts] - qty[starts], counts)
+
+    # El mínimo de una función lineal a trozos está en un final de lote
+    best_pnl = np.minimum.reduceat(cum_pnl, starts)
+    at_best = np.flatnonzero(cum_pnl == best_pnl[group])
+    _, first = np.unique(group[at_best], return_index=True)
+    best_qty = cum_qty[at_best[first]]
+
+    candidates = []
+    for g in np.flatnonzero(best_pnl < -0.005).tolist():
+        isin = isins[g]
+        ledger = engine.portfolio[isin]
+        loss = float(best_pnl[g])
+        is_blocked, unlock_date, safe_date = engine.hypothetical_tax_status(
+            isin, loss, date_obj, ledger.lots[0].date)
+        lo, hi = starts[g], starts[g] + counts[g]
+        candidates.append({
+            'isin': isin,
+            'product': ledger.name,
+            'price': float(isin_price[g]),
+            'max_loss': loss,
+            'qty': float(best_qty[g]),
+            'blocked': is_blocked,
+            'unlock_date': unlock_date,
+            'repurchase_safe_date': safe_date,
+            # Curva FIFO para vender solo parte (ver _shares_for_loss)
+            '_cum_pnl': cum_pnl[lo:hi], '_cum_qty': cum_qty[lo:hi],
+        })
+    candidates.sort(key=lambda c: c['max_loss'])
+    return candidates
+
+def _shares_for_loss(candidate: dict, loss: float) -> float:
+    """Acciones (enteras, redondeando hacia arriba) para realizar al menos `loss` de pérdida."""
+    cum_pnl, cum_qty = candidate['_cum_pnl'], candidate['_cum_qty']
+    j = int(np.argmax(cum_pnl <= -loss))
+    prev_pnl = cum_pnl[j - 1] if j else 0.0
+    prev_qty = cum_qty[j - 1] if j else 0.0
+    lot_qty = cum_qty[j] - prev_qty
+    slope = (cum_pnl[j] - prev_pnl) / lot_qty # P&L por acción dentro del lote j
+    shares = prev_qty + (-loss - prev_pnl) / slope
+    return min(float(math.ceil(shares - 1e-9)), candidate['qty'])
+
+def plan_harvest(engine: PortfolioEngine, target_gain: float, prices: Dict[str, float],
+                 date_obj: Optional[datetime] = None) -> dict:
+    """
+    Ventas que compensan target_gain con las mayores pérdidas disponibles primero; la
+    última puede ser parcial. Cada venta propuesta se valora con simulate_sale.
+    """
+    if date_obj is None:
+        date_obj = datetime.combine(datetime.now().date(), datetime.min.time())
+    candidates = harvest_candidates(engine, prices, date_obj)
+
+    plan = []
+    remaining = target_gain
+    for cand in candidates:
+        if remaining <= 0.005: break
+        if cand['blocked']: continue
+        shares = cand['qty'] if -cand['max_loss'] <= remaining else _shares_for_loss(cand, remaining)
+        sale = engine.simulate_sale(cand['isin'], shares, cand['price'], date_obj)
+        plan.append(sale)
+        remaining += sale['pnl']
+
+    open_isins = [isin for isin, ledger in engine.portfolio.items() if ledger.quantity > 0.001]
+    total_offset = sum(sale['pnl'] for sale in plan)
+    return {
+        'date': date_obj,
+        'target': target_gain,
+        'plan': plan,
+        'total_offset': total_offset,
+        'remaining_gain': target_gain + total_offset,
+        'candidates': [{k: v for k, v in c.items() if not k.startswith('_')} for c in candidates],
+        'missing_prices': [isin for isin in open_isins if isin not in prices],
+    }
@@ -0,0 +1,113 @@
+"""
+Cartera (lotes FIFO abiertos y posiciones) a cualquier fecha.
+
+HoldingsIndex guarda el estado de los lotes al inicio de cada periodo (mensual por
+defecto) y responde una consulta restaurando el checkpoint anterior más cercano
+(búsqueda binaria) y repitiendo solo las operaciones posteriores hasta la fecha.
+
+Como los lotes solo se añaden al final y se consumen desde el principio, el estado de
+un ISIN en un checkpoint se reduce a (nombre, lotes abiertos, cantidad restante del
+primero): los lotes se reconstruyen a partir del historial de compras de ese ISIN.
+"""
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from .engine import iter_transactions, date_column_ns, to_ns
+from .models import LotLedger, PortfolioBatch, PortfolioPosition
+
+class HoldingsIndex:
+    def __init__(self, df_trans: pd.DataFrame, freq: str = 'M'):
+        """df_trans ordenado cronológicamente, como queda tras PortfolioEngine.process()."""
+        self.df = df_trans
+        self.dates = date_column_ns(df_trans['date_obj']) if not df_trans.empty else np.zeros(0, dtype=np.int64)
+        # Historial de compras por ISIN: filas, cantidades originales, coste unitario y fecha
+        self._buys: Dict[str, Tuple[np.ndarray, list]] = {}
+        self._cp_rows: List[int] = [0]
+        self._cp_states: List[Dict[str, Tuple[str, int, float]]] = [{}]
+        self._build(freq)
+
+    def _build(self, freq: str):
+        if self.df.empty: return
+        periods = pd.DatetimeIndex(self.df['date_obj']).to_period(freq).asi8
+        boundaries = set((np.flatnonzero(np.diff(periods)) + 1).tolist())
+        ledgers: Dict[str, LotLedger] = {}
+        buy_rows: Dict[str, list] = {}
+        buy_lots: Dict[str, list] = {}
+        for tx in iter_transactions(self.df):
+            if tx.row_index in boundaries:
+                self._cp_rows.append(tx.row_index)
+                self._cp_states.append({
+                    isin: (ledger.name, len(ledger.lots), ledger.lots[0].quantity if ledger.lots else 0.0)
+                    for isin, ledger in ledgers.items()
+                })
+            lot = self._apply(ledgers, tx)
+            if lot is not None:
+                buy_rows.setdefault(tx.isin, []).append(tx.row_index)
+                buy_lots.setdefault(tx.isin, []).append(lot)
+        self._buys = {isin: (np.array(rows), buy_lots[isin]) for isin, rows in buy_rows.items()}
+
+    @staticmethod
+    def _apply(ledgers: Dict[str, LotLedger], tx):
+        """
+        Efecto de una fila sobre los lotes, como PortfolioEngine._process_transaction.
+        Devuelve (cantidad, coste unitario, fecha) del lote comprado, o None.
+        """
+        if not tx.isin or tx.qty == 0: return None
+        ledger = ledgers.get(tx.isin)
+        if ledger is None:
+            ledger = ledgers[tx.isin] = LotLedger(tx.product)
+        else:
+            ledger.name = tx.product
+        if tx.qty > 0:
+            lot = (tx.qty, abs(tx.total_eur) / tx.qty, tx.date)
+            ledger.add(PortfolioBatch(*lot))
+            return lot
+        ledger.consume(abs(tx.qty))
+        return None
+
+    def _restore(self, k: int) -> Dict[str, LotLedger]:
+        row = self._cp_rows[k]
+        ledgers = {}
+        for isin, (name, n_open, front_qty) in self._cp_states[k].items():
+            ledger = ledgers[isin] = LotLedger(name)
+            if not n_open: continue
+            rows, lots = self._buys[isin]
+            n_added = int(np.searchsorted(rows, row, 'left'))
+            for i in range(n_added - n_open, n_added):
+                quantity, unit_cost, date_obj = lots[i]
+                ledger.add(PortfolioBatch(quantity, unit_cost, date_obj))
+            # El lote más antiguo puede estar parcialmente vendido
+            first = ledger.lots[0]
+            ledger.quantity -= first.quantity - front_qty
+            ledger.cost -= (first.quantity - front_qty) * first.unit_cost
+            first.quantity = front_qty
+        return ledgers
+
+    def ledgers_at(self, date_obj: datetime) -> Dict[str, LotLedger]:
+        """Lotes abiertos tras aplicar todas las operaciones con fecha <= date_obj."""
+        end = int(np.searchsorted(self.dates, to_ns(date_obj), 'right'))
+        k = bisect_right(self._cp_rows, end) - 1
+        ledgers = self._restore(k)
+        start = self._cp_rows[k]
+        for tx in iter_transactions(self.df.iloc[start:end], start):
+            self._apply(ledgers, tx)
+        return ledgers
+
+    def holdings_at(self, date_obj: datetime) -> dict:
+        """Posiciones y lotes abiertos a una fecha, con el formato de la cartera anual."""
+        positions, lots = [], {}
+        for isin, ledger in self.ledgers_at(date_obj).items():
+            qty = ledger.quantity
+            if qty > 0.001:
+                cost = ledger.cost
+                positions.append(PortfolioPosition(name=ledger.name, isin=isin, qty=qty,
+                                                   avg_price=cost/qty, total_cost=cost).to_dict())
+                lots[isin] = [{'qty': b.quantity, 'unit_cost': b.unit_cost, 'date': b.date} for b in ledger.lots]
+        return {
+            'date': date_obj,
+            'portfolio': positions,
+            'portfolio_value': sum(p['total_cost'] for p in positions),
+            'lots': lots,
+        }
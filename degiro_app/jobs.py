@@ -0,0 +1,97 @@
+"""
+Análisis en segundo plano: la subida de archivos encola un trabajo y responde al
+momento con su id; el navegador consulta el progreso (etapa y filas) hasta que termina.
+
+JobQueue ejecuta los trabajos en un pool de hilos acotado y rechaza nuevos trabajos
+cuando ya hay demasiados pendientes. Los trabajos terminados se conservan un tiempo
+para que se pueda consultar su resultado y después se descartan.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, Optional
+
+# Etapas en el orden en que se recorren
+STAGES = ('queued', 'parsing', 'fifo', 'dividends', 'serialization')
+
+class QueueFull(Exception):
+    pass
+
+@dataclass
+class Job:
+    id: str
+    dataset: str
+    state: str = 'queued' # queued | running | done | error
+    stage: str = 'queued'
+    done: int = 0 # Filas procesadas en la etapa
+    total: Optional[int] = None # Filas de la etapa (None si aún no se conocen)
+    error: str = ''
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('queued', 'running')
+
+    def progress(self, stage: str, done: int = 0, total: Optional[int] = None):
+        """Callback para el motor: etapa actual y filas procesadas de esa etapa."""
+        self.stage, self.done, self.total = stage, done, total
+
+    def to_dict(self) -> dict:
+        # step/steps: posición de la etapa, para la barra de progreso
+        return {**asdict(self), 'step': STAGES.index(self.stage), 'steps': len(STAGES)}
+
+class JobQueue:
+    def __init__(self, workers: int = 1, max_pending: int = 8, keep: int = 100):
+        self.max_pending = max_pending
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='analysis')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, dataset: str, fn: Callable[[Callable], bool], message: str = "") -> Job:
+        """
+        Encola fn(progress) para el conjunto de datos. fn devuelve False (o lanza una
+        excepción) si el análisis falla; message es el error que se muestra entonces.
+        """
+        job = Job(id=uuid.uuid4().hex, dataset=dataset)
+        with self._lock:
+            if sum(j.active for j in self._jobs.values()) >= self.max_pending:
+                raise QueueFull("Demasiados análisis en curso, inténtalo en unos minutos")
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._run, job, fn, message)
+        return job
+
+    def _run(self, job: Job, fn: Callable, message: str):
+        job.state = 'running'
+        try:
+            ok = fn(job.progress)
+            job.error = "" if ok else message
+        except Exception as e:
+            job.error = message or str(e)
+        job.finished = time.time()
+        job.state = 'error' if job.error else 'done'
+
+    def _prune(self):
+        finished = sorted((j for j in self._jobs.values() if not j.active), key=lambda j: j.finished)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def active(self, dataset: str) -> Optional[Job]:
+        """Trabajo pendiente o en curso del conjunto de datos, si lo hay."""
+        with self._lock:
+            return next((j for j in self._jobs.values() if j.dataset == dataset and j.active), None)
+
+    def wait(self, job_id: str, timeout: float = 60.0) -> Optional[Job]:
+        """Espera a que termine el trabajo (pruebas y uso sin navegador)."""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return job
@@ -1,8 +1,27 @@
+import csv
+import glob
+import hashlib
+import io
+import os
+import pickle
+import numpy as np
 import pandas as pd
 import re
+import threading
 from datetime import datetime
-from dataclasses import asdict
-from .engine import PortfolioEngine
+from collections.abc import Mapping
+from .engine import PortfolioEngine, ENGINE_VERSION, reference_date, sales_time_status
+from .events import DEFAULT_EVENT_RULES
+from .models import YearStats
+
+# pyarrow está en requirements.txt (lectura rápida de CSV y cache Parquet); sin él la
+# app sigue funcionando, pero parsea siempre con pandas y sin cache
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 # --- PARSEO Y CARGA (Mantenemos estas utilidades aquí) ---
 def clean_number(x):
@@ -31,10 +50,158 @@ def clean_number(x):
     try: return float(s)
     except (ValueError, TypeError): return 0.0
 
+_CHUNK_ROWS = 65536
+_MAX_FAST_DIGITS = 15 # 10**15 < 2**53: la mantisa entera es exacta en float64
+_POW10 = 10.0 ** np.arange(23)
+
+def _clean_number_block(strs):
+    """
+    Aplica las reglas de clean_number a un array 'U' tratándolo como una matriz
+    de códigos (filas x caracteres). Devuelve los valores y una máscara de filas
+    que deben resolverse con clean_number (no ASCII o demasiados dígitos).
+    """
+    n = len(strs)
+    width = strs.dtype.itemsize // 4
+    out = np.zeros(n, dtype=np.float64)
+    if n == 0 or width == 0: return out, np.zeros(n, dtype=bool)
+
+    m = strs.view(np.uint32).reshape(n, width)
+    fallback = (m > 127).any(axis=1)
+    is_digit = (m >= 48) & (m <= 57)
+    is_dot = m == 46
+    is_comma = m == 44
+    is_minus = m == 45
+
+    has_dot = is_dot.any(axis=1)
+    has_comma = is_comma.any(axis=1)
+    last_dot = width - 1 - np.argmax(is_dot[:, ::-1], axis=1)
+    last_comma = width - 1 - np.argmax(is_comma[:, ::-1], axis=1)
+
+    # Ambos separadores: el último es el decimal
+    both = has_dot & has_comma
+    dot_decimal = both & (last_dot > last_comma)
+    comma_decimal = (both & ~dot_decimal) | (has_comma & ~has_dot)
+    # Solo puntos: varios puntos o un punto seguido de 3 caracteres útiles -> miles
+    n_dots = is_dot.sum(axis=1)
+    kept = np.cumsum(is_digit | is_dot | is_comma | is_minus, axis=1)
+    tail_len = kept[:, -1] - kept[np.arange(n), last_dot]
+    dot_thousands = has_dot & ~has_comma & ((n_dots > 1) | (tail_len == 3))
+
+    # Separador decimal resultante (como máximo uno para ser un float válido)
+    decimal = (is_dot & ~((both & ~dot_decimal) | dot_thousands)[:, None]) | \
+              (is_comma & comma_decimal[:, None])
+    n_decimal = decimal.sum(axis=1)
+    n_digits = is_digit.sum(axis=1)
+    n_minus = is_minus.sum(axis=1)
+    # El '-' solo es válido como primer carácter útil
+    first_useful = np.argmax(is_digit | decimal | is_minus, axis=1)
+    minus_first = is_minus[np.arange(n), first_useful]
+    valid = (n_digits > 0) & (n_decimal <= 1) & ((n_minus == 0) | ((n_minus == 1) & minus_first))
+
+    # Mantisa entera y número de decimales
+    after_decimal = np.cumsum(decimal, axis=1) > 0
+    frac_digits = (is_digit & after_decimal).sum(axis=1)
+    fallback |= valid & ((n_digits > _MAX_FAST_DIGITS) | (frac_digits >= len(_POW10)))
+    exp = n_digits[:, None] - np.cumsum(is_digit, axis=1)
+    exp = np.where(is_digit, np.minimum(exp, _MAX_FAST_DIGITS), 0)
+    digits = np.where(is_digit, m.astype(np.int64) - 48, 0)
+    mantissa = (digits * (10 ** exp)).sum(axis=1)
+
+    fast = valid & ~fallback
+    value = mantissa[fast].astype(np.float64) / _POW10[frac_digits[fast]]
+    out[fast] = np.where(n_minus[fast] == 1, -value, value)
+    return out, fallback
+
+def clean_number_series(col):
+    """
+    Versión vectorizada de clean_number para una columna entera.
+    Devuelve un array float64 con exactamente los mismos valores que
+    aplicar clean_number celda a celda.
+    """
+    values = pd.Series(col).to_numpy(dtype=object)
+    n = len(values)
+    out = np.zeros(n, dtype=np.float64)
+    if n == 0: return out
+
+    na = pd.isna(values)
+    strs = np.where(na, '', values).astype(str)
+    for start in range(0, n, _CHUNK_ROWS):
+        block = slice(start, start + _CHUNK_ROWS)
+        out[block], fallback = _clean_number_block(strs[block])
+        for i in np.flatnonzero(fallback):
+            out[start + i] = clean_number(values[start + i])
+    return out
+
+_SNIFF_CHARS = 64 * 1024
+_SNIFF_DELIMITERS = ',;\t|'
+
+def _sniff_delimiter(sample):
+    """Detecta el separador a partir de las primeras líneas completas del fichero."""
+    cut = sample.rfind('\n')
+    if cut > 0: sample = sample[:cut + 1]
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=_SNIFF_DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+def _header_names(header):
+    """Nombres de columna con la misma normalización que pandas (vacías y duplicadas)."""
+    names, seen = [], {}
+    for i, name in enumerate(header):
+        name = name or f'Unnamed: {i}'
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f'{name}.{count}')
+    return names
+
+def _read_csv_pyarrow(stream, sep, header):
+    names = _header_names(header)
+    # Fecha/Hora como texto: pyarrow convertiría '10:00' en un datetime.time
+    text_cols = {c: pa.string() for c in names if 'Fecha' in c or 'Hora' in c}
+    data = stream.read()
+    if isinstance(data, str): data = data.encode('utf-8')
+    table = pa_csv.read_csv(
+        io.BytesIO(data),
+        read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(delimiter=sep, quote_char='"'),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=text_cols, null_values=[], strings_can_be_null=False,
+            quoted_strings_can_be_null=False, timestamp_parsers=[]
+        ),
+    )
+    return table.to_pandas()
+
+def read_degiro_csv(stream):
+    """
+    Lee un CSV de DEGIRO detectando el separador solo sobre un prefijo del stream
+    y parseando con pyarrow (si está instalado) o con el motor C, en lugar del
+    tokenizador Python de sep=None.
+    """
+    if not stream.seekable():
+        stream = io.StringIO(stream.read())
+    pos = stream.tell()
+    sample = stream.read(_SNIFF_CHARS)
+    stream.seek(pos)
+    if isinstance(sample, bytes):
+        sample = sample.decode('utf-8', errors='ignore')
+    sep = _sniff_delimiter(sample)
+
+    if HAS_PYARROW:
+        header = next(csv.reader(io.StringIO(sample), delimiter=sep, quotechar='"'), None)
+        if header:
+            try:
+                return _read_csv_pyarrow(stream, sep, header)
+            except Exception:
+                # pyarrow no tolera filas con menos columnas: reintentar con el motor C
+                stream.seek(pos)
+
+    # round_trip: mismo redondeo que float(), como hacía el motor python
+    return pd.read_csv(stream, sep=sep, engine='c', keep_default_na=False, quotechar='"',
+                       float_precision='round_trip')
+
 def load_data_frames(trans_stream, acc_stream):
     try:
-        # Auto-detect separator using python engine
-        df_t = pd.read_csv(trans_stream, sep=None, engine='python', keep_default_na=False, quotechar='"')
+        df_t = read_degiro_csv(trans_stream)
     except Exception as e: 
         print(f"Error reading Transactions CSV: {e}")
         return pd.DataFrame(), pd.DataFrame()
@@ -60,9 +227,9 @@ def load_data_frames(trans_stream, acc_stream):
 
     if 'fee_eur' not in df_t.columns: df_t['fee_eur'] = 0.0
     
-    df_t['qty'] = df_t['qty'].apply(clean_number)
-    df_t['total_eur'] = df_t['total_eur'].apply(clean_number)
-    df_t['fee_eur'] = df_t['fee_eur'].apply(clean_number)
+    df_t['qty'] = clean_number_series(df_t['qty'])
+    df_t['total_eur'] = clean_number_series(df_t['total_eur'])
+    df_t['fee_eur'] = clean_number_series(df_t['fee_eur'])
     df_t['date_obj'] = pd.to_datetime(df_t['date'], format='%d-%m-%Y', errors='coerce')
     # Try alternate date format if all NaT
     if df_t['date_obj'].isna().all() and not df_t.empty:
@@ -71,7 +238,7 @@ def load_data_frames(trans_stream, acc_stream):
     df_t = df_t.dropna(subset=['date_obj']).sort_values(by=['date_obj', 'time']).reset_index(drop=True)
 
     try:
-        df_a = pd.read_csv(acc_stream, sep=None, engine='python', keep_default_na=False)
+        df_a = read_degiro_csv(acc_stream)
     except Exception as e: 
         print(f"Error reading Account CSV: {e}")
         return df_t, pd.DataFrame()
@@ -82,9 +249,9 @@ def load_data_frames(trans_stream, acc_stream):
     if 'Variación' in df_a.columns:
         loc_idx = df_a.columns.get_loc('Variación')
         df_a[curr_col] = df_a.iloc[:, loc_idx]
-        df_a[amt_col] = df_a.iloc[:, loc_idx + 1].apply(clean_number)
+        df_a[amt_col] = clean_number_series(df_a.iloc[:, loc_idx + 1])
     elif 'Importe' in df_a.columns:
-        df_a[amt_col] = df_a['Importe'].apply(clean_number)
+        df_a[amt_col] = clean_number_series(df_a['Importe'])
         df_a[curr_col] = 'EUR'
     else: 
         print(f"Account CSV missing amount columns ('Variación' or 'Importe'). Found: {df_a.columns.tolist()}")
@@ -100,12 +267,99 @@ def load_data_frames(trans_stream, acc_stream):
 
     return df_t, df_a
 
+# --- CACHE EN DISCO DE DATAFRAMES NORMALIZADOS ---
+# Incrementar si cambia la normalización de load_data_frames para invalidar la cache
+PARSER_VERSION = 1
+_CACHE_PREFIX = 'frames_'
+
+def frames_cache_key(trans_bytes, acc_bytes):
+    """Hash del contenido bruto de ambos ficheros más la versión del parser."""
+    h = hashlib.sha256(f'v{PARSER_VERSION}'.encode())
+    for data in (trans_bytes, acc_bytes):
+        h.update(len(data).to_bytes(8, 'little'))
+        h.update(data)
+    return h.hexdigest()
+
+def _cache_paths(cache_dir, key):
+    base = os.path.join(cache_dir, f'{_CACHE_PREFIX}{key}')
+    return f'{base}_trans.parquet', f'{base}_acc.parquet'
+
+def clear_frames_cache(cache_dir, keep=None):
+    """Elimina las entradas de la cache de DataFrames de cache_dir (salvo la de clave keep)."""
+    kept = set(_cache_paths(cache_dir, keep)) if keep else set()
+    for path in glob.glob(os.path.join(cache_dir, f'{_CACHE_PREFIX}*')):
+        if path in kept: continue
+        try: os.remove(path)
+        except OSError: pass
+
+def _write_parquet(df, path):
+    tmp = f'{path}.tmp'
+    df.to_parquet(tmp)
+    os.replace(tmp, path)
+
+def load_data_frames_cached(trans_path, acc_path, cache_dir):
+    """
+    Igual que load_data_frames pero leyendo de rutas y guardando el resultado
+    normalizado en Parquet bajo cache_dir, indexado por el hash de los ficheros.
+    cache_dir guarda solo la última versión de un conjunto de datos (la app usa el
+    directorio de cada sesión): al escribir una entrada nueva se borran las anteriores.
+    """
+    with open(trans_path, 'rb') as ft, open(acc_path, 'rb') as fa:
+        trans_bytes, acc_bytes = ft.read(), fa.read()
+
+    key = frames_cache_key(trans_bytes, acc_bytes)
+    path_t, path_a = _cache_paths(cache_dir, key)
+    if HAS_PYARROW and os.path.exists(path_t) and os.path.exists(path_a):
+        try:
+            return pd.read_parquet(path_t), pd.read_parquet(path_a)
+        except Exception as e:
+            print(f"Cache de DataFrames corrupta, se regenera: {e}")
+
+    df_t, df_a = load_data_frames(io.StringIO(trans_bytes.decode('utf-8')),
+                                  io.StringIO(acc_bytes.decode('utf-8')))
+    if HAS_PYARROW and not df_t.empty:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            _write_parquet(df_t, path_t)
+            _write_parquet(df_a, path_a)
+            # Las versiones anteriores se borran después, nunca la que se acaba de escribir
+            clear_frames_cache(cache_dir, keep=key)
+        except Exception as e:
+            print(f"No se pudo guardar la cache de DataFrames: {e}")
+            clear_frames_cache(cache_dir)
+    return df_t, df_a
+
+# --- CHECKPOINTS DEL MOTOR ---
+def load_checkpoints(path):
+    """Checkpoints guardados por save_checkpoints, o [] si no hay o son de otra versión."""
+    if not path or not os.path.exists(path): return []
+    try:
+        with open(path, 'rb') as f:
+            version, checkpoints = pickle.load(f)
+        return checkpoints if version == (ENGINE_VERSION, PARSER_VERSION) else []
+    except Exception as e:
+        print(f"Checkpoints ilegibles, se reprocesa todo: {e}")
+        return []
+
+def save_checkpoints(path, checkpoints):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(((ENGINE_VERSION, PARSER_VERSION), checkpoints), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"No se pudieron guardar los checkpoints: {e}")
+
+def clear_checkpoints(path):
+    if path and os.path.exists(path): os.remove(path)
+
 # --- WRAPPER DE COMPATIBILIDAD ---
 # Mantenemos process_year expuesto por si algún test lo llama directamente, 
 # pero idealmente deberíamos migrar los tests.
 # Por ahora, implementamos analyze_full_history usando el nuevo motor.
 
-def process_year(df_trans, df_acc, target_year):
+def process_year(df_trans, df_acc, target_year, as_of=None):
     """
     Función legacy para mantener compatibilidad con tests unitarios antiguos.
     Crea un motor efímero y procesa todo hasta llegar al año target.
@@ -113,35 +367,158 @@ def process_year(df_trans, df_acc, target_year):
     engine = PortfolioEngine(df_trans, df_acc)
     engine.process()
     
-    if target_year in engine.years_data:
-        stats = engine.years_data[target_year]
-        # Convertir Dataclass a Dict para compatibilidad con tests viejos
-        return {
-            'sales': [asdict(s) for s in stats.sales],
-            'purchases': stats.purchases,
-            'dividends': [asdict(d) for d in stats.dividends],
-            'portfolio': [asdict(p) for p in stats.portfolio],
-            'portfolio_value': stats.portfolio_value,
-            'total_pnl': stats.total_pnl_fiscal,
-            'total_pnl_real': stats.total_pnl_real,
-            'fees': {'trading': stats.fees_trading, 'connectivity': stats.fees_connectivity},
-            'stats': {'wins': stats.stats_wins, 'losses': stats.stats_losses, 'blocked': stats.stats_blocked}
-        }
-    else:
+    return year_to_dict(engine.years_data.get(target_year), as_of)
+
+def year_to_dict(stats, as_of=None):
+    """
+    Convierte un YearStats (o None si no hubo actividad) al dict de la API, con el
+    estado fiscal de las ventas a fecha as_of (por defecto hoy).
+    """
+    if stats is None:
         return {
             'sales': [], 'purchases': [], 'dividends': [], 'portfolio': [],
             'portfolio_value': 0, 'total_pnl': 0, 'total_pnl_real': 0,
             'fees': {'trading': 0, 'connectivity': 0}, 'stats': {'wins': 0, 'losses': 0, 'blocked': 0}
         }
+    # Convertir a Dict para JSON; el estado a fecha as_of no se guarda en SaleResult
+    sales = [{**s.to_dict(), 'blocked_status': None, 'wash_sale_risk': False, 'loss_consolidated': False}
+             for s in stats.sales]
+    losing, status, wash_risk, consolidated = sales_time_status(stats.sales, reference_date(as_of))
+    for i, st, risk, cons in zip(losing.tolist(), status.tolist(), wash_risk.tolist(), consolidated.tolist()):
+        sale = sales[i]
+        sale['blocked_status'] = st
+        sale['wash_sale_risk'] = risk
+        sale['loss_consolidated'] = cons
+    return {
+        'sales': sales,
+        'purchases': [p.to_dict() for p in stats.purchases],
+        'dividends': [d.to_dict() for d in stats.dividends],
+        'portfolio': [p.to_dict() for p in stats.portfolio],
+        'portfolio_value': stats.portfolio_value,
+        'total_pnl': stats.total_pnl_fiscal,
+        'total_pnl_real': stats.total_pnl_real,
+        'fees': {'trading': stats.fees_trading, 'connectivity': stats.fees_connectivity},
+        'stats': {'wins': stats.stats_wins, 'losses': stats.stats_losses, 'blocked': stats.stats_blocked}
+    }
+
+class LazyYears(Mapping):
+    """
+    {año: dict} de analyze_frames. Guarda los YearStats del motor tal cual y solo
+    convierte un año (una vez por fecha de referencia) cuando alguien lo pide: el
+    dashboard o una descarga. Los YearStats no dependen de la fecha, así que la caché
+    sigue siendo válida al cambiar de día. Se puede usar desde varios hilos: cada año
+    se convierte una sola vez aunque lo pidan a la vez (ver all_years_report_files).
+    """
+    def __init__(self, stats_by_year):
+        self._stats = stats_by_year # {año: YearStats o None}, en orden
+        self._dicts = {}
+        self._lock = threading.Lock() # Protege _dicts
+        self._year_locks = {year: threading.Lock() for year in stats_by_year}
+
+    def __getitem__(self, year):
+        return self.as_of(year)
+
+    def as_of(self, year, as_of=None):
+        """dict del año con el estado fiscal de las ventas a fecha as_of (por defecto hoy)."""
+        key = (year, reference_date(as_of))
+        # Un lock por año: años distintos se convierten en paralelo, el mismo una vez
+        with self._year_locks[year]:
+            data = self._dicts.get(key)
+            if data is None:
+                data = year_to_dict(self._stats[year], key[1])
+                with self._lock:
+                    if len(self._dicts) >= 4 * len(self._stats):
+                        self._dicts.clear() # Fechas de referencia antiguas
+                    self._dicts[key] = data
+        return data
+
+    def __iter__(self):
+        return iter(self._stats)
+
+    def __len__(self):
+        return len(self._stats)
+
+    def __contains__(self, year):
+        return year in self._stats
+
+    def stats(self, year):
+        """YearStats del motor sin convertir (None si el año no tuvo actividad)."""
+        return self._stats[year]
+
+# Listados de un año que se pueden paginar
+PAGED_KINDS = ('sales', 'purchases', 'dividends')
+
+def _date_value(v):
+    """Fecha comparable: ventas y dividendos guardan datetime, las compras dd-mm-aaaa."""
+    if isinstance(v, str):
+        try:
+            return datetime.strptime(v, '%d-%m-%Y')
+        except ValueError:
+            return None
+    return v
+
+def _sort_value(key):
+    if key == 'date':
+        def date_value(item):
+            v = _date_value(item.get(key))
+            return (v is None, v or datetime.min)
+        return date_value
+    def value(item):
+        v = item.get(key)
+        return (v is None, v.lower() if isinstance(v, str) else (v if v is not None else 0))
+    return value
+
+def page_items(items, sort=None, descending=False, page=1, per_page=50):
+    """
+    Página de un listado de dicts (ventas, compras o dividendos de un año), ordenado en
+    el servidor por sort (cualquier campo; las fechas, datetime o dd-mm-aaaa, cronológicas).
+    ValueError si el campo o la página no son válidos.
+    """
+    if page < 1 or per_page < 1: raise ValueError("page y per_page deben ser >= 1")
+    if sort:
+        if items and sort not in items[0]: raise ValueError(f"Campo de orden desconocido: {sort}")
+        items = sorted(items, key=_sort_value(sort), reverse=descending)
+    start = (page - 1) * per_page
+    return {
+        'items': items[start:start + per_page],
+        'page': page, 'per_page': per_page, 'total': len(items),
+        'pages': max(1, -(-len(items) // per_page)),
+        'sort': sort, 'dir': 'desc' if descending else 'asc',
+    }
 
 def analyze_full_history(trans_stream, acc_stream):
     df_t, df_a = load_data_frames(trans_stream, acc_stream)
+    return analyze_frames(df_t, df_a)
+
+def analyze_frames(df_t, df_a, checkpoint_path=None, workers=1, exact=False, event_rules=DEFAULT_EVENT_RULES):
+    """
+    Ejecuta el motor sobre DataFrames ya normalizados por load_data_frames.
+    Con checkpoint_path se reanuda desde el último año cerrado que siga siendo válido;
+    con workers > 1 (y sin checkpoints) los ISIN se procesan en paralelo; con exact,
+    costes y carteras se calculan en coma fija (ver exact.py); event_rules sustituye a
+    las reglas de eventos especiales por defecto (ver events.py).
+    """
     if df_t.empty: return {}
+    return build_analysis(run_engine(df_t, df_a, checkpoint_path, workers, exact, event_rules))
 
-    # Instanciar y ejecutar el nuevo Motor
-    engine = PortfolioEngine(df_t, df_a)
-    engine.process()
+def run_engine(df_t, df_a, checkpoint_path=None, workers=1, exact=False, event_rules=DEFAULT_EVENT_RULES,
+               progress=None):
+    """
+    Instancia y ejecuta el motor (ver analyze_frames); devuelve el PortfolioEngine procesado.
+    progress(etapa, filas hechas, total) recibe el avance (ver PortfolioEngine.process).
+    """
+    checkpoints = load_checkpoints(checkpoint_path) if checkpoint_path else None
+    engine = PortfolioEngine(df_t, df_a, checkpoints=checkpoints, exact=exact, event_rules=event_rules)
+    engine.process(workers=workers, progress=progress)
+    # Solo reescribir si se invalidó alguno o se cerró un año nuevo
+    if checkpoint_path and list(map(id, engine.checkpoints)) != list(map(id, checkpoints)):
+        save_checkpoints(checkpoint_path, engine.checkpoints)
+    return engine
 
+def build_analysis(engine):
+    """Resultado {'years', 'global'} para la API a partir de un motor ya procesado."""
+    df_t = engine.df_trans
+    if df_t.empty: return {}
     start_year = df_t['date_obj'].min().year
     max_data_year = df_t['date_obj'].max().year
     current_year = datetime.now().year
@@ -155,62 +532,41 @@ def analyze_full_history(trans_stream, acc_stream):
     }
 
     # Recopilar resultados del motor
-    # El motor ya tiene los datos agrupados por año en engine.years_data
+    # El motor ya tiene los datos agrupados por año en engine.years_data;
+    # los totales se leen de los YearStats y la conversión a dict se aplaza (LazyYears)
     
     processed_years = range(start_year, end_year + 1)
     
     for year in processed_years:
-        # Recuperar stats del motor o crear vacío si no hubo actividad ese año
-        if year in engine.years_data:
-            stats = engine.years_data[year]
-            
-            # Convertir a Dict para JSON
-            data_dict = {
-                'sales': [asdict(s) for s in stats.sales],
-                'purchases': stats.purchases,
-                'dividends': [asdict(d) for d in stats.dividends],
-                'portfolio': [asdict(p) for p in stats.portfolio],
-                'portfolio_value': stats.portfolio_value,
-                'total_pnl': stats.total_pnl_fiscal,
-                'total_pnl_real': stats.total_pnl_real,
-                'fees': {'trading': stats.fees_trading, 'connectivity': stats.fees_connectivity},
-                'stats': {'wins': stats.stats_wins, 'losses': stats.stats_losses, 'blocked': stats.stats_blocked}
-            }
-        else:
-            # Año vacío
-            data_dict = {
-                'sales': [], 'purchases': [], 'dividends': [], 'portfolio': [],
-                'portfolio_value': 0, 'total_pnl': 0, 'total_pnl_real': 0,
-                'fees': {'trading': 0, 'connectivity': 0},
-                'stats': {'wins': 0, 'losses': 0, 'blocked': 0}
-            }
+        # None si no hubo actividad ese año
+        stats = engine.years_data.get(year)
 
         # Guardar si hay actividad o es el último año
-        # Check simple de actividad en el dict generado
-        has_activity = (data_dict['sales'] or data_dict['purchases'] or data_dict['dividends'] or 
-                        data_dict['portfolio'] or data_dict['fees']['connectivity'] > 0)
+        has_activity = stats is not None and (stats.sales or stats.purchases or stats.dividends or
+                                              stats.portfolio or stats.fees_connectivity > 0)
         
         if has_activity or year == end_year:
-            years_data[year] = data_dict
+            years_data[year] = stats
+            if stats is None: stats = YearStats(year=year) # Año vacío
             
-            divs_net = sum(d['net'] for d in data_dict['dividends'])
-            total_fees = data_dict['fees']['trading'] + data_dict['fees']['connectivity']
+            divs_net = sum(d.net for d in stats.dividends)
+            total_fees = stats.fees_trading + stats.fees_connectivity
             
-            global_stats['total_pnl'] += data_dict['total_pnl']
-            global_stats['total_pnl_real'] += data_dict['total_pnl_real']
+            global_stats['total_pnl'] += stats.total_pnl_fiscal
+            global_stats['total_pnl_real'] += stats.total_pnl_real
             global_stats['total_divs_net'] += divs_net
             global_stats['total_fees'] += total_fees
             
             global_stats['years_list'].append(year)
-            global_stats['chart_pnl'].append(round(data_dict['total_pnl'], 2))
+            global_stats['chart_pnl'].append(round(stats.total_pnl_fiscal, 2))
             global_stats['chart_divs'].append(round(divs_net, 2))
             global_stats['chart_fees'].append(round(total_fees, 2))
 
     if global_stats['years_list']:
         last_year = global_stats['years_list'][-1]
-        # Usar el dict ya convertido
-        if last_year in years_data:
-            global_stats['current_portfolio'] = years_data[last_year]['portfolio']
-            global_stats['current_portfolio_value'] = years_data[last_year]['portfolio_value']
+        stats = years_data[last_year]
+        if stats is not None:
+            global_stats['current_portfolio'] = [p.to_dict() for p in stats.portfolio]
+            global_stats['current_portfolio_value'] = stats.portfolio_value
 
-    return {'years': years_data, 'global': global_stats}
\ No newline at end of file
+    return {'years': LazyYears(years_data), 'global': global_stats}
@@ -1,8 +1,23 @@
-from dataclasses import dataclass, field
+from collections import deque
+from dataclasses import dataclass, field, fields, replace
 from datetime import datetime
-from typing import List, Optional
+from typing import Deque, Dict, List, Optional, Tuple
 
-@dataclass
+def serializable(cls):
+    """
+    Añade a un dataclass to_dict() y to_row() generados para sus campos: a diferencia
+    de dataclasses.asdict no recorren ni copian recursivamente (los campos son escalares).
+    """
+    names = [f.name for f in fields(cls)]
+    namespace = {}
+    exec(f"def to_dict(self): return {{{', '.join(f'{n!r}: self.{n}' for n in names)}}}\n"
+         f"def to_row(self): return ({''.join(f'self.{n}, ' for n in names)})", namespace)
+    cls.FIELDS = tuple(names)
+    cls.to_dict = namespace['to_dict']
+    cls.to_row = namespace['to_row']
+    return cls
+
+@dataclass(slots=True)
 class Transaction:
     """Representa una fila cruda del CSV de transacciones."""
     date: datetime
@@ -12,17 +27,103 @@ class Transaction:
     total_eur: float
     fee_eur: float
     row_index: int # Para trazabilidad con el CSV original
+    date_str: str = "" # Fecha tal cual viene en el CSV (para los informes)
+    event: str = "" # Evento especial (columna 'event', ver events.py)
 
-@dataclass
+@dataclass(slots=True)
 class PortfolioBatch:
     """Un lote de acciones en cartera (FIFO bucket)."""
     quantity: float
     unit_cost: float
     date: datetime # Fecha de adquisición
 
-@dataclass
+class LotLedger:
+    """
+    Cola FIFO de lotes de un ISIN. Consumir desde el principio es O(1) por lote
+    (deque) y se mantienen los totales de cantidad y coste abiertos, de modo que
+    el snapshot anual no necesita recorrer todos los lotes.
+    """
+    __slots__ = ('name', 'lots', 'quantity', 'cost')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lots: Deque[PortfolioBatch] = deque()
+        self.quantity = 0.0
+        self.cost = 0.0
+
+    def __len__(self) -> int:
+        return len(self.lots)
+
+    def copy(self) -> 'LotLedger':
+        """Copia independiente (los lotes se modifican al consumirlos)."""
+        clone = LotLedger(self.name)
+        clone.lots = deque(PortfolioBatch(b.quantity, b.unit_cost, b.date) for b in self.lots)
+        clone.quantity = self.quantity
+        clone.cost = self.cost
+        return clone
+
+    def add(self, batch: PortfolioBatch):
+        self.lots.append(batch)
+        self.quantity += batch.quantity
+        self.cost += batch.quantity * batch.unit_cost
+
+    def consume(self, shares_to_sell: float) -> Tuple[float, bool, Optional[datetime]]:
+        """
+        Retira shares_to_sell acciones en orden FIFO.
+        Devuelve (coste de adquisición, aviso de lotes insuficientes, fecha del lote más antiguo).
+        """
+        cost_basis = 0.0
+        warning = False
+        min_date = None
+        lots = self.lots
+
+        while shares_to_sell > 0.0001:
+            if not lots:
+                warning = True
+                break
+
+            batch = lots[0]
+            if min_date is None: min_date = batch.date
+
+            if batch.quantity > shares_to_sell:
+                consumed_cost = shares_to_sell * batch.unit_cost
+                batch.quantity -= shares_to_sell
+                self.quantity -= shares_to_sell
+                shares_to_sell = 0
+            else:
+                consumed_cost = batch.quantity * batch.unit_cost
+                shares_to_sell -= batch.quantity
+                self.quantity -= batch.quantity
+                lots.popleft()
+            cost_basis += consumed_cost
+            self.cost -= consumed_cost
+
+        # Evitar arrastrar residuos de redondeo cuando la posición queda cerrada
+        if not lots:
+            self.quantity = 0.0
+            self.cost = 0.0
+        return cost_basis, warning, min_date
+
+@serializable
+@dataclass(slots=True)
+class Purchase:
+    """Compra reportada en el año."""
+    date: str # Fecha tal cual viene en el CSV
+    product: str
+    isin: str
+    qty: float
+    price: float
+    total: float
+    fee: float
+
+@serializable
+@dataclass(slots=True)
 class SaleResult:
-    """Resultado fiscal de una venta."""
+    """
+    Resultado fiscal de una venta. Solo guarda hechos que no dependen de la fecha
+    actual; blocked_status, wash_sale_risk y loss_consolidated se calculan al leer a
+    una fecha de referencia (ver engine.sales_time_status y logic.year_to_dict).
+    """
     date: datetime
     product: str
     isin: str
@@ -34,13 +135,11 @@ class SaleResult:
     note: str = ""
     # Estado Fiscal
     blocked: bool = False
-    blocked_status: Optional[str] = None # 'active', 'released'
     unlock_date: Optional[str] = None
-    wash_sale_risk: bool = False
     repurchase_safe_date: Optional[str] = None
-    loss_consolidated: bool = False
 
-@dataclass
+@serializable
+@dataclass(slots=True)
 class DividendResult:
     """Resultado de un dividendo."""
     date: datetime
@@ -52,7 +151,8 @@ class DividendResult:
     net: float
     desc: str
 
-@dataclass
+@serializable
+@dataclass(slots=True)
 class PortfolioPosition:
     """Resumen de una posición abierta en cartera."""
     name: str
@@ -61,12 +161,12 @@ class PortfolioPosition:
     avg_price: float
     total_cost: float
 
-@dataclass
+@dataclass(slots=True)
 class YearStats:
     """Contenedor de todos los datos calculados para un año fiscal."""
     year: int
     sales: List[SaleResult] = field(default_factory=list)
-    purchases: List[dict] = field(default_factory=list) # Mantenemos dict simple para compras reportadas
+    purchases: List[Purchase] = field(default_factory=list)
     dividends: List[DividendResult] = field(default_factory=list)
     portfolio: List[PortfolioPosition] = field(default_factory=list)
     portfolio_value: float = 0.0
@@ -77,3 +177,60 @@ class YearStats:
     stats_wins: int = 0
     stats_losses: int = 0
     stats_blocked: float = 0.0
+
+    def copy(self) -> 'YearStats':
+        """Copia con listas propias (los resultados individuales se comparten)."""
+        return replace(self, sales=list(self.sales), purchases=list(self.purchases),
+                       dividends=list(self.dividends), portfolio=list(self.portfolio))
+
+@dataclass(slots=True)
+class EngineCheckpoint:
+    """
+    Estado del motor al cruzar un cambio de año: lotes abiertos y años cerrados.
+    Solo es reutilizable si las filas de las que dependen esos años no han cambiado.
+    """
+    closed_year: int # Último año cerrado en este checkpoint
+    rows_consumed: int # Filas de df_trans (ordenado) ya procesadas
+    trans_hash: str # Hash de las filas con fecha < horizon (ventana de 2 meses incluida)
+    acc_hash: str # Hash de los cobros de Account.csv con fecha < horizon (OPAs)
+    portfolio: Dict[str, LotLedger]
+    closed_years: Dict[int, YearStats] # Años cerrados nuevos respecto al checkpoint anterior
+
+    # Serialización compacta: tuplas en vez de un objeto por venta/compra, que
+    # en pickle repite nombres de campo y hace la carga varias veces más lenta.
+    def __getstate__(self):
+        years = {}
+        for year, stats in self.closed_years.items():
+            years[year] = (
+                tuple(getattr(stats, n) for n in _YEAR_SCALARS),
+                [s.to_row() for s in stats.sales],
+                [p.to_row() for p in stats.purchases],
+                [d.to_row() for d in stats.dividends],
+                [p.to_row() for p in stats.portfolio],
+            )
+        portfolio = {
+            isin: (ledger.name, ledger.quantity, ledger.cost,
+                   [(b.quantity, b.unit_cost, b.date) for b in ledger.lots])
+            for isin, ledger in self.portfolio.items()
+        }
+        return (self.closed_year, self.rows_consumed, self.trans_hash, self.acc_hash, portfolio, years)
+
+    def __setstate__(self, state):
+        self.closed_year, self.rows_consumed, self.trans_hash, self.acc_hash, portfolio, years = state
+        self.portfolio = {}
+        for isin, (name, quantity, cost, lots) in portfolio.items():
+            ledger = LotLedger(name)
+            ledger.lots = deque(PortfolioBatch(*lot) for lot in lots)
+            ledger.quantity = quantity
+            ledger.cost = cost
+            self.portfolio[isin] = ledger
+        self.closed_years = {}
+        for year, (scalars, sales, purchases, dividends, positions) in years.items():
+            stats = YearStats(**dict(zip(_YEAR_SCALARS, scalars)))
+            stats.sales = [SaleResult(*s) for s in sales]
+            stats.purchases = [Purchase(*p) for p in purchases]
+            stats.dividends = [DividendResult(*d) for d in dividends]
+            stats.portfolio = [PortfolioPosition(*p) for p in positions]
+            self.closed_years[year] = stats
+
+_YEAR_SCALARS = tuple(f.name for f in fields(YearStats) if f.name not in ('sales', 'purchases', 'dividends', 'portfolio'))
@@ -0,0 +1,91 @@
+import csv
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+def fmt_num(val):
+    """Convierte float a string formato europeo (coma decimal)"""
+    if val is None: return "0,00"
+    return f"{val:.2f}".replace('.', ',')
+
+def csv_bytes(headers, rows) -> bytes:
+    """CSV para Excel europeo: ; como separador y codificación utf-8-sig."""
+    si = io.StringIO()
+    cw = csv.writer(si, delimiter=';')
+    cw.writerow(headers)
+    cw.writerows(rows)
+    return si.getvalue().encode('utf-8-sig')
+
+def year_report_files(year, data):
+    """
+    Ficheros CSV del informe fiscal de un año (datos de analyze_frames()['years'][year]).
+    Devuelve una lista de (nombre, contenido en bytes).
+    """
+    files = []
+
+    # 1. COMPRAS.csv
+    rows_buys = []
+    for b in data['purchases']:
+        rows_buys.append([
+            b['date'], b['product'], b['isin'],
+            fmt_num(b['qty']), fmt_num(b['price']), fmt_num(b['total']), fmt_num(b['fee'])
+        ])
+    files.append((f"compras_{year}.csv", csv_bytes(
+        ["FECHA", "PRODUCTO", "ISIN", "CANTIDAD", "PRECIO", "TOTAL", "COMISION"],
+        rows_buys)))
+
+    # 2. VENTAS.csv
+    rows_sales = []
+    for s in data['sales']:
+        rows_sales.append([
+            s['date'], s['product'], s['isin'],
+            fmt_num(s['qty']), fmt_num(s['sale_net']), fmt_num(s['cost_basis']),
+            fmt_num(s['pnl']), s['note']
+        ])
+    files.append((f"ventas_opas_{year}.csv", csv_bytes(
+        ["FECHA", "PRODUCTO", "ISIN", "CANTIDAD", "VALOR TRANSMISION", "VALOR ADQUISICION", "P&L NETO", "NOTAS"],
+        rows_sales)))
+
+    # 3. DIVIDENDOS.csv
+    rows_divs = []
+    for d in data['dividends']:
+        rows_divs.append([
+            d['date'], d['product'], d['isin'], d['currency'],
+            fmt_num(d['gross']), fmt_num(d['wht']), fmt_num(d['net'])
+        ])
+    files.append((f"dividendos_{year}.csv", csv_bytes(
+        ["FECHA", "PRODUCTO", "ISIN", "DIVISA", "BRUTO", "RETENCION", "NETO"],
+        rows_divs)))
+
+    # 4. CARTERA.csv
+    rows_port = []
+    for p in data['portfolio']:
+        rows_port.append([
+            p['name'], p['isin'], fmt_num(p['qty']),
+            fmt_num(p['avg_price']), fmt_num(p['total_cost'])
+        ])
+    files.append((f"cartera_fin_{year}.csv", csv_bytes(
+        ["PRODUCTO", "ISIN", "CANTIDAD", "PRECIO MEDIO", "TOTAL INVERTIDO"],
+        rows_port)))
+
+    return files
+
+def all_years_report_files(years, workers=4):
+    """
+    Ficheros de todos los años (years: {año: datos}, p. ej. analyze_frames()['years']),
+    cada uno bajo su carpeta <año>/. Los años se convierten y se escriben en paralelo.
+    """
+    def build(year):
+        return [(f"{year}/{name}", content) for name, content in year_report_files(year, years[year])]
+    year_list = list(years)
+    if not year_list: return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(year_list)))) as pool:
+        return [f for files in pool.map(build, year_list) for f in files]
+
+def zip_report(files) -> bytes:
+    """ZIP (deflate) con los ficheros [(nombre, contenido)]."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, content in files:
+            zip_file.writestr(filename, content)
+    return buffer.getvalue()
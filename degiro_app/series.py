@@ -0,0 +1,130 @@
+"""
+Serie diaria del capital invertido (coste de adquisición abierto) y de las acciones en
+cartera, por ISIN y total.
+
+Se calcula sin recorrer los lotes: por ISIN, el coste FIFO de las primeras x acciones
+compradas es una función lineal a trozos de las compras acumuladas, y las acciones ya
+consumidas son las ventas acumuladas menos las vendidas sin lotes (que el motor descarta
+con aviso). El coste abierto tras cada fila es la diferencia de ambas curvas.
+"""
+from dataclasses import dataclass
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+
+NS_PER_DAY = 86_400 * 10**9
+
+@dataclass(slots=True)
+class CostBasisSeries:
+    """
+    Series diarias desde `start`. Las totales son densas (un valor por día); las de cada
+    ISIN solo guardan los días en que cambian, en arrays planos: el ISIN i ocupa
+    [offsets[i], offsets[i + 1]) de day/qty/cost.
+    """
+    start: np.datetime64
+    total_cost: np.ndarray
+    total_qty: np.ndarray
+    isins: List[str]
+    offsets: np.ndarray
+    day: np.ndarray
+    qty: np.ndarray
+    cost: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.total_cost)
+
+    @property
+    def days(self) -> np.ndarray:
+        return self.start + np.arange(len(self), dtype='timedelta64[D]')
+
+    def isin_series(self, isin: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(acciones, coste) diarios de un ISIN, rellenando hacia delante los cambios."""
+        i = self.isins.index(isin)
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        idx = np.searchsorted(self.day[lo:hi], np.arange(len(self)), 'right') - 1
+        valid = idx >= 0
+        qty = np.where(valid, self.qty[lo:hi][idx], 0.0)
+        cost = np.where(valid, self.cost[lo:hi][idx], 0.0)
+        return qty, cost
+
+    def downsample(self, max_points: int = 500) -> dict:
+        """Serie total reducida a como mucho max_points días (siempre incluye el último)."""
+        if not len(self):
+            return {'dates': [], 'cost': [], 'qty': []}
+        idx = np.unique(np.linspace(0, len(self) - 1, min(max_points, len(self))).round().astype(np.int64))
+        return {
+            'dates': np.datetime_as_string(self.days[idx], unit='D').tolist(),
+            'cost': np.round(self.total_cost[idx], 2).tolist(),
+            'qty': np.round(self.total_qty[idx], 4).tolist(),
+        }
+
+def _open_position(buy_qty: np.ndarray, buy_cost: np.ndarray, sell_qty: np.ndarray):
+    """Acciones y coste abiertos tras cada fila de un ISIN (FIFO)."""
+    bought = np.cumsum(buy_qty)
+    bought_cost = np.cumsum(buy_cost)
+    sold = np.cumsum(sell_qty)
+    # Acciones vendidas sin lotes disponibles: no consumen compras posteriores
+    unmatched = np.maximum.accumulate(np.maximum(sold - bought, 0.0))
+    consumed = sold - unmatched
+    is_buy = buy_qty > 0
+    consumed_cost = np.interp(consumed, np.concatenate(([0.0], bought[is_buy])),
+                              np.concatenate(([0.0], bought_cost[is_buy])))
+    qty = bought - consumed
+    cost = bought_cost - consumed_cost
+    closed = qty < 1e-6 # Sin residuos de redondeo en posiciones cerradas, como LotLedger
+    return np.where(closed, 0.0, qty), np.where(closed, 0.0, cost)
+
+def cost_basis_series(df_trans: pd.DataFrame) -> CostBasisSeries:
+    """Series a partir de df_trans ordenado cronológicamente (tras PortfolioEngine.process)."""
+    isin_col = df_trans['isin'] if not df_trans.empty else pd.Series([], dtype=object)
+    qty = df_trans['qty'].to_numpy(dtype=float) if not df_trans.empty else np.zeros(0)
+    valid = isin_col.fillna('').astype(bool).to_numpy() & (qty != 0)
+    if not valid.any():
+        empty = np.zeros(0)
+        return CostBasisSeries(np.datetime64('NaT', 'D'), empty, empty, [], np.zeros(1, dtype=np.int64),
+                               np.zeros(0, dtype=np.int32), empty, empty)
+
+    qty = qty[valid]
+    total = np.abs(df_trans['total_eur'].to_numpy(dtype=float)[valid])
+    dates = df_trans['date_obj'].to_numpy(dtype='datetime64[ns]')[valid]
+    start = dates[0].astype('datetime64[D]')
+    row_day = ((dates - start.astype('datetime64[ns]')).astype(np.int64) // NS_PER_DAY).astype(np.int32)
+    codes, isins = pd.factorize(isin_col.to_numpy()[valid])
+
+    is_buy = qty > 0
+    buy_qty = np.where(is_buy, qty, 0.0)
+    buy_cost = np.where(is_buy, total, 0.0)
+    sell_qty = np.where(is_buy, 0.0, -qty)
+
+    order = np.argsort(codes, kind='stable') # Filas de cada ISIN, en orden cronológico
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(isins)))))
+    open_qty = np.empty(len(qty))
+    open_cost = np.empty(len(qty))
+    for i in range(len(isins)):
+        rows = order[offsets[i]:offsets[i + 1]]
+        open_qty[rows], open_cost[rows] = _open_position(buy_qty[rows], buy_cost[rows], sell_qty[rows])
+
+    # Totales: suma acumulada de las variaciones de cada fila sobre su ISIN
+    delta_qty = np.empty(len(qty))
+    delta_cost = np.empty(len(qty))
+    grouped_qty, grouped_cost = open_qty[order], open_cost[order]
+    delta_qty[order] = np.diff(grouped_qty, prepend=0.0)
+    delta_cost[order] = np.diff(grouped_cost, prepend=0.0)
+    first = order[offsets[:-1]]
+    delta_qty[first] = open_qty[first]
+    delta_cost[first] = open_cost[first]
+    last_row = np.searchsorted(row_day, np.arange(row_day[-1] + 1), 'right') - 1
+    total_qty = np.cumsum(delta_qty)[last_row]
+    total_cost = np.cumsum(delta_cost)[last_row]
+
+    # Por ISIN, solo el último valor de cada día con operaciones
+    grouped_day = row_day[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = grouped_day[:-1] != grouped_day[1:]
+    keep[offsets[1:-1] - 1] = True # Último de cada ISIN
+    kept_offsets = np.concatenate(([0], np.cumsum(np.add.reduceat(keep.astype(np.int64), offsets[:-1]))))
+
+    return CostBasisSeries(
+        start=start, total_cost=total_cost, total_qty=total_qty, isins=list(isins),
+        offsets=kept_offsets, day=grouped_day[keep], qty=grouped_qty[keep], cost=grouped_cost[keep],
+    )
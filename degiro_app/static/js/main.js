@@ -5,9 +5,11 @@ console.log("main.js loaded");
 // --- GLOBAL CONFIG ---
 Apex.chart = { foreColor: '#e2e8f0', fontFamily: 'Inter, sans-serif' };
 
-let rawData = {};
+// Resumen global al cargar; cada año se pide a /api/years/<año> al abrirlo
+let rawData = { years: {} };
 let globalChart = null;
 let globalPortChart = null;
+let globalInvestedChart = null;
 let currentViewYear = null;
 
 let sortConfig = {
@@ -18,8 +20,8 @@ let sortConfig = {
     'global-port': { key: 'total_cost', dir: 'desc' }
 };
 
-fetch('/api/data').then(res => res.json()).then(data => {
-    rawData = data;
+fetch('/api/summary').then(res => res.json()).then(data => {
+    rawData = { ...data, years: {} };
     fillYearSelect();
     initGlobal();
 });
@@ -139,6 +141,28 @@ function initGlobal() {
 
     renderGlobalPortfolioTable();
     renderGlobalPortChart(g.current_portfolio);
+    renderInvestedChart(rawData.series);
+}
+
+function renderInvestedChart(series) {
+    if(globalInvestedChart) globalInvestedChart.destroy();
+    if(!series || series.dates.length === 0) {
+        document.querySelector("#chartGlobalInvested").innerHTML = '<div class="text-center text-muted py-5">Sin operaciones</div>';
+        return;
+    }
+    // Serie diaria (reducida en el servidor) en columnas: fechas y coste abierto
+    const data = series.dates.map((d, i) => [new Date(d).getTime(), series.cost[i]]);
+    globalInvestedChart = new ApexCharts(document.querySelector("#chartGlobalInvested"), {
+        series: [{ name: 'Capital invertido', data: data }],
+        chart: { type: 'area', height: 300, toolbar: {show: false}, zoom: {enabled: true}, background: 'transparent' },
+        stroke: { width: 2, curve: 'stepline' }, dataLabels: { enabled: false },
+        fill: { type: 'gradient', gradient: { opacityFrom: 0.4, opacityTo: 0.05 } },
+        xaxis: { type: 'datetime' },
+        yaxis: { labels: { formatter: (val) => val.toFixed(0) } },
+        tooltip: { x: { format: 'dd/MM/yyyy' }, y: { formatter: (val) => fmt(val) } },
+        colors: ['#8b5cf6'], theme: { mode: 'dark' }
+    });
+    globalInvestedChart.render();
 }
 
 function renderGlobalPortfolioTable() {
@@ -168,10 +192,18 @@ function renderGlobalPortChart(portfolioData) {
 }
 
 // --- YEAR VIEW ---
+function loadYear(year) {
+    if (rawData.years[year]) return Promise.resolve(rawData.years[year]);
+    return fetch(`/api/years/${year}`).then(res => res.json()).then(d => (rawData.years[year] = d));
+}
+
 function renderYearView(year) {
     if(!year) return;
     currentViewYear = year;
-    const d = rawData.years[year];
+    loadYear(year).then(d => { if (currentViewYear === year) showYear(year, d); });
+}
+
+function showYear(year, d) {
     document.getElementById('globalView').classList.add('d-none');
     document.getElementById('yearView').classList.remove('d-none');
     document.getElementById('lblYear').innerText = year;
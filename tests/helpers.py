@@ -0,0 +1,35 @@
+"""Datos de prueba compartidos por los tests del motor."""
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from degiro_app.engine import PortfolioEngine
+
+def make_df(rows):
+    """rows: (fecha, isin, cantidad, total_eur)"""
+    return pd.DataFrame({
+        'date': [r[0] for r in rows], 'time': ['10:00'] * len(rows),
+        'product': ['P_' + r[1] for r in rows], 'isin': [r[1] for r in rows],
+        'qty': [float(r[2]) for r in rows], 'total_eur': [float(r[3]) for r in rows],
+        'fee_eur': [-1.0] * len(rows),
+        'date_obj': pd.to_datetime([r[0] for r in rows], format='%d-%m-%Y'),
+    })
+
+def make_engine(rows, **kwargs):
+    """PortfolioEngine ya procesado sobre make_df(rows), sin extracto de cuenta."""
+    engine = PortfolioEngine(make_df(rows), pd.DataFrame(), **kwargs)
+    engine.process()
+    return engine
+
+def random_rows(seed, n=400):
+    rng = np.random.default_rng(seed)
+    held = {}
+    rows = []
+    for _ in range(n):
+        day = datetime(2020, 1, 1) + timedelta(days=int(rng.integers(0, 3 * 365)))
+        isin = f'ISIN_{rng.integers(0, 8)}'
+        qty = int(rng.integers(1, 30))
+        if held.get(isin, 0) > 0 and rng.random() < 0.4:
+            qty = -min(qty, held[isin]) # Ventas parciales que atraviesan lotes
+        held[isin] = held.get(isin, 0) + qty
+        rows.append((day.strftime('%d-%m-%Y'), isin, qty, -qty * rng.uniform(5, 15)))
+    return rows
@@ -1,12 +1,15 @@
 import pytest
 import os
+import shutil
 import pandas as pd
 from degiro_app.app import app as flask_app
-from degiro_app.app import DB_CACHE, PATH_ACC, PATH_TRANS
+from degiro_app.app import DB_CACHE, JOBS, DATASETS_DIR
+import degiro_app.app
+import degiro_app.reports
 from io import BytesIO
 
 @pytest.fixture
-def app():
+def app(tmp_path, monkeypatch):
     """Create and configure a new app instance for each test."""
     # Seteamos la app en modo testing
     flask_app.config.update({
@@ -15,16 +18,46 @@ def app():
 
     # Limpiamos el cache y los archivos persistentes antes de cada test
     DB_CACHE.clear()
-    if os.path.exists(PATH_ACC): os.remove(PATH_ACC)
-    if os.path.exists(PATH_TRANS): os.remove(PATH_TRANS)
+    shutil.rmtree(DATASETS_DIR, ignore_errors=True)
+    # Los datos del formato anterior se buscan en un directorio temporal, no en data/
+    monkeypatch.setattr(degiro_app.app, 'LEGACY_DIR', str(tmp_path))
 
     yield flask_app
 
+    DB_CACHE.max_bytes = flask_app.config['RESULT_CACHE_MB'] * 2**20
+
 @pytest.fixture
 def client(app):
     """A test client for the app."""
     return app.test_client()
 
+def finish_job(response):
+    """Espera al análisis en segundo plano lanzado por la subida y devuelve el trabajo."""
+    assert response.status_code == 302
+    return JOBS.wait(response.headers['Location'].rsplit('/', 1)[-1])
+
+def session_cache(client):
+    """Entrada del cache de resultados de la sesión del cliente (sin tocar contadores)."""
+    with client.session_transaction() as sess:
+        return DB_CACHE.peek(sess.get('dataset'))
+
+TRANS_HEADER = '"Fecha","Hora","Producto","ISIN","Número","Total (EUR)","Costes de transacción (EUR)"\n'
+ACC_HEADER = '"Fecha","Producto","ISIN","Descripción","Variación"\n'
+
+def buy_csv(qty=10.0):
+    """Extracto de transacciones con una sola compra de ISIN_A por 100 EUR."""
+    return TRANS_HEADER + f'"05-01-2023","10:00","PRODUCT_A","ISIN_A","{qty}","-100.0","-1.0"\n'
+
+def upload(client, trans_csv=buy_csv(), acc_csv=ACC_HEADER, wait=True, **kwargs):
+    """
+    Sube los dos CSV (str o bytes) a /. Con wait espera al análisis y devuelve el
+    trabajo; si no, devuelve la respuesta tal cual.
+    """
+    files = {name: (BytesIO(csv.encode() if isinstance(csv, str) else csv), name + '.csv')
+             for name, csv in (('transactions', trans_csv), ('account', acc_csv))}
+    response = client.post('/', data=files, content_type='multipart/form-data', **kwargs)
+    return finish_job(response) if wait else response
+
 def test_index_get(client):
     """Test GET / returns 200 and the upload form."""
     response = client.get('/')
@@ -33,21 +66,18 @@ def test_index_get(client):
 
 def test_index_post_success(client):
     """Test POST / with valid files redirects and populates cache."""
-    trans_csv = b'"Fecha","Hora","Producto","ISIN","N\xc3\xbamero","Total (EUR)","Costes de transacci\xc3\xb3n (EUR)"\n"05-01-2023","10:00","PRODUCT_A","ISIN_A","10.0","-100.0","-1.0"\n'
-    acc_csv = b'"Fecha","Producto","ISIN","Descripci\xc3\xb3n","Variaci\xc3\xb3n"\n"20-03-2023","PRODUCT_A","ISIN_A","Dividendo","EUR 10,00"\n'
-    
-    data = {
-        'transactions': (BytesIO(trans_csv), 'transactions.csv'),
-        'account': (BytesIO(acc_csv), 'account.csv')
-    }
-    
-    response = client.post('/', data=data, content_type='multipart/form-data')
-    
-    assert response.status_code == 302 # Redirect
-    assert response.headers['Location'] == '/dashboard'
-    assert 'data' in DB_CACHE
-    assert 'global' in DB_CACHE['data']
-    assert 'years' in DB_CACHE['data']
+    response = upload(client, acc_csv=ACC_HEADER + '"20-03-2023","PRODUCT_A","ISIN_A","Dividendo","EUR 10,00"\n', wait=False)
+
+    assert response.status_code == 302 # Redirect a la página de progreso
+    assert response.headers['Location'].startswith('/jobs/')
+    job = finish_job(response)
+    assert job.state == 'done'
+    assert client.get(response.headers['Location']).status_code == 200
+    assert client.get('/').headers['Location'] == '/dashboard'
+    entry = session_cache(client)
+    assert entry is not None
+    assert 'global' in entry['data']
+    assert 'years' in entry['data']
 
 def test_index_post_missing_files(client):
     """Test POST / with a missing file returns 400."""
@@ -74,14 +104,9 @@ def test_index_post_processing_error(client, mocker):
     # Mockear la función de procesamiento para que falle
     mocker.patch('degiro_app.app.process_files_from_disk', return_value=False)
     
-    data = {
-        'transactions': (BytesIO(b'corrupt'), 'transactions.csv'),
-        'account': (BytesIO(b'corrupt'), 'account.csv')
-    }
-    
-    response = client.post('/', data=data, content_type='multipart/form-data')
-    assert response.status_code == 400
-    assert b"Error procesando los archivos" in response.data
+    job = upload(client, b'corrupt', b'corrupt')
+    assert job.state == 'error'
+    assert "Error procesando los archivos" in job.error
 
 def test_dashboard_last_resort_redirect(client):
     """
@@ -95,13 +120,7 @@ def test_dashboard_last_resort_redirect(client):
 def test_download_report_invalid_year(client):
     """Test downloading a report for a year that does not exist."""
     # Subir datos válidos primero para que haya cache
-    trans_csv = b'"Fecha","Hora","Producto","ISIN","N\xc3\xbamero","Total (EUR)"\n"05-01-2023","10:00","A","B","1","-10"\n'
-    acc_csv = b''
-    data = {
-        'transactions': (BytesIO(trans_csv), 'transactions.csv'),
-        'account': (BytesIO(acc_csv), 'account.csv')
-    }
-    client.post('/', data=data)
+    upload(client, b'"Fecha","Hora","Producto","ISIN","N\xc3\xbamero","Total (EUR)"\n"05-01-2023","10:00","A","B","1","-10"\n', b'')
     
     # Pedir un año que no está en los datos
     response = client.get('/download/2099')
@@ -117,16 +136,9 @@ def test_index_post_empty_or_invalid_files(client, mocker):
     mocker.patch('degiro_app.logic.load_data_frames', return_value=(pd.DataFrame(), pd.DataFrame()))
     
     # Simulate uploading valid-looking but empty files
-    trans_csv = b'Header\n'
-    acc_csv = b'Header\n'
-    data = {
-        'transactions': (BytesIO(trans_csv), 'transactions.csv'),
-        'account': (BytesIO(acc_csv), 'account.csv')
-    }
-    
-    response = client.post('/', data=data, content_type='multipart/form-data')
-    assert response.status_code == 400
-    assert b"Error procesando los archivos" in response.data
+    job = upload(client, b'Header\n', b'Header\n')
+    assert job.state == 'error'
+    assert "Error procesando los archivos" in job.error
 
 
 def test_full_flow(client):
@@ -138,13 +150,7 @@ def test_full_flow(client):
     4. GET /download/<year>
     """
     # 1. Upload files
-    trans_csv = b'"Fecha","Hora","Producto","ISIN","N\xc3\xbamero","Total (EUR)","Costes de transacci\xc3\xb3n (EUR)"\n"05-01-2023","10:00","PRODUCT_A","ISIN_A","10.0","-100.0","-1.0"\n'
-    acc_csv = b'"Fecha","Producto","ISIN","Descripci\xc3\xb3n","Variaci\xc3\xb3n"\n"20-03-2023","PRODUCT_A","ISIN_A","Dividendo","EUR 10,00"\n'
-    data = {
-        'transactions': (BytesIO(trans_csv), 'transactions.csv'),
-        'account': (BytesIO(acc_csv), 'account.csv')
-    }
-    client.post('/', data=data, content_type='multipart/form-data')
+    upload(client, acc_csv=ACC_HEADER + '"20-03-2023","PRODUCT_A","ISIN_A","Dividendo","EUR 10,00"\n')
     
     # 2. Test Dashboard
     response_dash = client.get('/dashboard')
@@ -157,6 +163,7 @@ def test_full_flow(client):
     json_data = response_api.get_json()
     assert 'global' in json_data
     assert json_data['global']['total_divs_net'] == 10.0
+    assert json_data['series'] == {'dates': ['2023-01-05'], 'cost': [100.0], 'qty': [10.0]}
 
     # 4. Test Download
     response_download = client.get('/download/2023')
@@ -170,5 +177,318 @@ def test_full_flow(client):
         assert 'ventas_opas_2023.csv' in z.namelist()
         assert 'dividendos_2023.csv' in z.namelist()
 
+def test_simulate_sale(client):
+    """Test GET /api/simulate over the cached engine, without mutating it."""
+    upload(client)
+
+    response = client.get('/api/simulate?isin=ISIN_A&qty=4&price=12,5&date=01-06-2023')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['pnl'] == 10.0
+    assert result['remaining_qty'] == 6.0
+    assert result['blocked'] is False
+    assert session_cache(client)['engine'].portfolio['ISIN_A'].quantity == 10.0
+
+    # Estado de una venta con pérdidas a la fecha de referencia as_of
+    loss = '/api/simulate?isin=ISIN_A&qty=4&price=5&date=01-06-2023&as_of='
+    result = client.get(loss + '15-06-2023').get_json()
+    assert (result['wash_sale_risk'], result['loss_consolidated']) == (True, False)
+    result = client.get(loss + '01-09-2023').get_json()
+    assert (result['wash_sale_risk'], result['loss_consolidated']) == (False, True)
+    assert client.get(loss + 'ayer').status_code == 400
+
+    assert client.get('/api/simulate?isin=ISIN_A&qty=0&price=1').status_code == 400
+    assert client.get('/api/simulate?isin=ISIN_A&qty=1&price=1&date=ayer').status_code == 400
+    assert client.get('/api/simulate?isin=ISIN_X&qty=1&price=1').status_code == 404
+
+def test_harvest(client):
+    """Test POST /api/harvest proposes loss sales for the given target."""
+    upload(client)
+
+    response = client.post('/api/harvest', json={'prices': {'ISIN_A': 6.0}, 'target': 20, 'date': '01-09-2023'})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert [(s['isin'], s['qty'], s['pnl']) for s in result['plan']] == [('ISIN_A', 5.0, -20.0)]
+
+    assert client.post('/api/harvest', json={}).status_code == 400
+    assert client.post('/api/harvest', json={'prices': {'ISIN_A': 'x'}}).status_code == 400
+
+def test_holdings(client):
+    """Test GET /api/holdings returns the open lots at the requested date."""
+    upload(client, TRANS_HEADER + '"05-01-2023","10:00","PRODUCT_A","ISIN_A","10.0","-100.0","-1.0"\n'
+                           '"05-03-2023","10:00","PRODUCT_A","ISIN_A","-4.0","60.0","-1.0"\n')
+
+    before = client.get('/api/holdings?date=01-02-2023').get_json()
+    assert [(p['isin'], p['qty']) for p in before['portfolio']] == [('ISIN_A', 10.0)]
+    after = client.get('/api/holdings?date=2023-03-05').get_json()
+    assert after['lots']['ISIN_A'][0]['qty'] == 6.0
+    assert after['portfolio_value'] == 60.0
+    assert client.get('/api/holdings?date=01-01-2023').get_json()['portfolio'] == []
+    assert client.get('/api/holdings?date=ayer').status_code == 400
+
+def test_data_as_of(client):
+    """Test GET /api/data?as_of= derives the sale status at that date from the cached analysis."""
+    upload(client, TRANS_HEADER + '"05-01-2023","10:00","PRODUCT_A","ISIN_A","10.0","-100.0","-1.0"\n'
+                           '"05-03-2023","10:00","PRODUCT_A","ISIN_A","-10.0","60.0","-1.0"\n')
+
+    sale = client.get('/api/data?as_of=01-04-2023').get_json()['years']['2023']['sales'][0]
+    assert (sale['wash_sale_risk'], sale['loss_consolidated']) == (True, False)
+    sale = client.get('/api/data').get_json()['years']['2023']['sales'][0]
+    assert (sale['wash_sale_risk'], sale['loss_consolidated']) == (False, True)
+    assert client.get('/api/data?as_of=ayer').status_code == 400
+
+def test_result_cache_per_session(client, app):
+    """Each session keeps its own analysis; LRU evictions are rebuilt from the session's files."""
+    def portfolio_qty(c):
+        return c.get('/api/data').get_json()['years']['2023']['portfolio'][0]['qty']
+
+    other = app.test_client()
+    upload(client, buy_csv(10))
+    upload(other, buy_csv(4))
+    assert (portfolio_qty(client), portfolio_qty(other)) == (10.0, 4.0)
+    assert len(DB_CACHE) == 2
+
+    # Presupuesto mínimo: solo cabe la última entrada usada
+    DB_CACHE.max_bytes = 1
+    upload(other, buy_csv(4))
+    assert len(DB_CACHE) == 1
+    assert portfolio_qty(client) == 10.0 # Reconstruida desde disco
+    stats = client.get('/api/cache').get_json()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 2)
+    assert stats['entries'] == 1 and stats['bytes'] > 0
+
+    client.get('/reset')
+    assert client.get('/api/data').get_json() == {}
+    assert portfolio_qty(other) == 4.0
+
+def test_upload_job_progress(client):
+    """Test POST / answers at once with a job whose progress goes through every stage."""
+    rows = ''.join(f'"{d % 28 + 1:02d}-01-2023","10:00","PRODUCT_A","ISIN_A","1","-10.0","-1.0"\n' for d in range(50))
+    response = upload(client, TRANS_HEADER + rows, wait=False, headers={'Accept': 'application/json'})
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+
+    JOBS.wait(job_id)
+    status = client.get(f'/api/jobs/{job_id}').get_json()
+    assert (status['state'], status['stage'], status['done'], status['total']) == ('done', 'serialization', 50, 50)
+    assert status['step'] == status['steps'] - 1
+    assert client.get('/api/jobs/nope').status_code == 404
+    assert client.get('/jobs/nope').headers['Location'] == '/'
+
+    # Etapas que recorre el análisis, con sus filas
+    stages = []
+    from degiro_app.app import process_files_from_disk
+    with client.session_transaction() as sess:
+        assert process_files_from_disk(sess['dataset'], lambda stage, done=0, total=None: stages.append((stage, done, total)))
+    assert list(dict.fromkeys(s for s in stages if s[1] == s[2])) == [
+        ('parsing', 50, 50), ('fifo', 50, 50), ('dividends', 0, 0), ('serialization', 50, 50)]
+
+def test_year_api_and_etags(client):
+    """Test per-year and paginated endpoints, server-side sort and ETag / If-None-Match."""
+    rows = [('05-01-2023', '10.0', '-100.0'), ('10-02-2023', '5.0', '-60.0'), ('03-01-2023', '2.0', '-30.0'),
+            ('01-06-2023', '-4.0', '50.0'), ('01-03-2024', '1.0', '-10.0')]
+    trans_csv = TRANS_HEADER + ''.join(f'"{d}","10:00","PRODUCT_A","ISIN_A","{q}","{t}","-1.0"\n' for d, q, t in rows)
+    upload(client, trans_csv)
+
+    summary = client.get('/api/summary').get_json()
+    assert set(summary) == {'global', 'series'}
+    assert summary['global']['years_list'][:2] == [2023, 2024]
+    year = client.get('/api/years/2023').get_json()
+    assert len(year['purchases']) == 3 and len(year['sales']) == 1
+
+    page = client.get('/api/years/2023/purchases?sort=date&dir=desc&per_page=2').get_json()
+    assert [p['date'] for p in page['items']] == ['10-02-2023', '05-01-2023']
+    assert (page['total'], page['pages'], page['page']) == (3, 2, 1)
+    page = client.get('/api/years/2023/purchases?sort=date&dir=desc&per_page=2&page=2').get_json()
+    assert [p['date'] for p in page['items']] == ['03-01-2023']
+    assert [p['qty'] for p in client.get('/api/years/2023/purchases?sort=qty').get_json()['items']] == [2.0, 5.0, 10.0]
+
+    assert client.get('/api/years/2023/purchases?sort=nope').status_code == 400
+    assert client.get('/api/years/2023/purchases?page=0').status_code == 400
+    assert client.get('/api/years/2023/portfolio').status_code == 404
+    assert client.get('/api/years/1999').status_code == 404
+
+    # Misma versión: 304 sin cuerpo; otra consulta u otros datos: otro ETag
+    response = client.get('/api/years/2023')
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    again = client.get('/api/years/2023', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    assert client.get('/api/years/2024', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/api/data').headers['ETag'] != etag
+
+    upload(client, trans_csv.replace('"-1.0"', '"-2.0"'))
+    assert client.get('/api/years/2023', headers={'If-None-Match': etag}).status_code == 200
+
+def test_year_pages_sort_datetimes(client):
+    """Test sort=date on sales and dividends, whose dates are datetimes rather than dd-mm-aaaa strings."""
+    days = ['01-02-2023', '15-03-2023', '30-01-2023']
+    sales = ''.join(f'"{d}","10:00","PRODUCT_A","ISIN_A","-{n}.0","{20 * n}.0","-1.0"\n' for n, d in enumerate(days, 1))
+    dividends = ''.join(f'"{d}","PRODUCT_A","ISIN_A","Dividendo","EUR {n},00"\n' for n, d in enumerate(days, 1))
+    upload(client, buy_csv() + sales, ACC_HEADER + dividends)
+
+    sales = client.get('/api/years/2023/sales?sort=date').get_json()['items']
+    assert [s['qty'] for s in sales] == [3.0, 1.0, 2.0]
+    sales = client.get('/api/years/2023/sales?sort=date&dir=desc').get_json()['items']
+    assert [s['qty'] for s in sales] == [2.0, 1.0, 3.0]
+    dividends = client.get('/api/years/2023/dividends?sort=date').get_json()['items']
+    assert [d['gross'] for d in dividends] == [3.0, 1.0, 2.0]
+
+def test_encoded_response_cache(client, mocker):
+    """Test the JSON is encoded once per dataset version and served gzip/deflate from memory."""
+    import gzip, zlib
+    upload(client)
+    size = client.get('/api/cache').get_json()['bytes']
+    dumps = mocker.spy(flask_app.json, 'dumps')
+    # La cookie de sesión también pasa por dumps: contar solo el JSON de /api/data
+    encodes = lambda: sum(isinstance(c.args[0], dict) and 'global' in c.args[0] for c in dumps.call_args_list)
+
+    plain = client.get('/api/data')
+    zipped = client.get('/api/data', headers={'Accept-Encoding': 'gzip, deflate'})
+    deflated = client.get('/api/data', headers={'Accept-Encoding': 'deflate'})
+    assert encodes() == 1
+    assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == plain.data
+    assert deflated.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(deflated.data) == plain.data
+    assert plain.get_json()['global']['total_pnl'] == 0.0
+
+    # Cada representación tiene su ETag; los bytes guardados cuentan en el presupuesto
+    assert len({plain.headers['ETag'], zipped.headers['ETag'], deflated.headers['ETag']}) == 3
+    assert client.get('/api/data', headers={'Accept-Encoding': 'gzip',
+                                            'If-None-Match': zipped.headers['ETag']}).status_code == 304
+    assert encodes() == 1
+    assert client.get('/api/cache').get_json()['bytes'] >= size + len(plain.data) + len(zipped.data)
+
+def test_report_zips_are_cached(client, mocker):
+    """Test year and all-years ZIPs are built once per dataset version and then served from cache."""
+    import zipfile
+    upload(client, TRANS_HEADER + '"05-01-2022","10:00","PRODUCT_A","ISIN_A","10.0","-100.0","-1.0"\n'
+                           '"05-03-2023","10:00","PRODUCT_A","ISIN_A","-4.0","60.0","-1.0"\n')
+    year_files = mocker.spy(degiro_app.reports, 'year_report_files')
+    app_year_files = mocker.spy(degiro_app.app, 'year_report_files')
+
+    first = client.get('/download/2023')
+    again = client.get('/download/2023')
+    assert first.data == again.data and app_year_files.call_count == 1
+    assert client.get('/download/2023', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    archive = client.get('/download/all')
+    assert archive.status_code == 200
+    assert 'Informe_Fiscal_DEGIRO_todos.zip' in archive.headers['Content-Disposition']
+    years = client.get('/api/summary').get_json()['global']['years_list']
+    assert year_files.call_count == len(years)
+    with zipfile.ZipFile(BytesIO(archive.data)) as z:
+        assert 'ventas_opas_2023.csv' in {n.split('/')[1] for n in z.namelist()}
+        assert [n.split('/')[0] for n in z.namelist()][::4] == [str(y) for y in years]
+        with zipfile.ZipFile(BytesIO(first.data)) as year_zip:
+            assert z.read('2023/ventas_opas_2023.csv') == year_zip.read('ventas_opas_2023.csv')
+    assert client.get('/download/all').data == archive.data
+    assert year_files.call_count == len(years)
+
+def test_frames_cache_is_per_session(client, app):
+    """One session's upload or reset leaves the other session's parsed-frames cache intact."""
+    import glob
+    def frames_after_upload(c, qty):
+        upload(c, buy_csv(qty))
+        with c.session_transaction() as sess:
+            return glob.glob(os.path.join(DATASETS_DIR, sess['dataset'], 'frames_*'))
+
+    other = app.test_client()
+    frames = frames_after_upload(client, 10)
+    assert len(frames) == 2
+    other_frames = frames_after_upload(other, 4)
+    assert len(other_frames) == 2 and all(map(os.path.exists, frames))
+
+    # Nueva versión de una sesión: sustituye sus entradas, no las de la otra
+    new_frames = frames_after_upload(other, 5)
+    assert len(new_frames) == 2 and set(new_frames) != set(other_frames)
+    assert all(map(os.path.exists, frames))
+
+    client.get('/reset')
+    assert not any(map(os.path.exists, frames))
+    assert all(map(os.path.exists, new_frames))
+
+def test_reupload_while_job_running(client, mocker):
+    """A re-upload during the session's running job neither overwrites its files nor starts another job."""
+    import threading
+    release = threading.Event()
+    mocker.patch('degiro_app.app.process_files_from_disk', side_effect=lambda dataset, progress: release.wait(5))
+    trans_csv = b'"Fecha","Hora","Producto","ISIN","N\xc3\xbamero","Total (EUR)"\n"05-01-2023","10:00","A","B","1","-10"\n'
+    post = lambda content, **kwargs: upload(client, content, b'', wait=False, **kwargs)
+
+    first = post(trans_csv)
+    job_location = first.headers['Location']
+    with client.session_transaction() as sess:
+        path_trans = os.path.join(DATASETS_DIR, sess['dataset'], 'Transactions.csv')
+
+    conflict = post(b'otro', headers={'Accept': 'application/json'})
+    assert conflict.status_code == 409
+    assert conflict.get_json()['id'] == job_location.rsplit('/', 1)[-1]
+    assert post(b'otro').headers['Location'] == job_location
+    with open(path_trans, 'rb') as f:
+        assert f.read() == trans_csv
+
+    release.set()
+    assert finish_job(first).state == 'done'
+    second = post(trans_csv)
+    assert second.headers['Location'] != job_location
+    assert finish_job(second).state == 'done'
+
+def test_update_resumes_from_checkpoints(client):
+    """Test the documented update flow (/update + upload) keeps the checkpoints and resumes from them."""
+    rows = [('05-01-2022', '10.0', '-100.0'), ('05-06-2022', '-2.0', '30.0'), ('05-01-2023', '5.0', '-60.0')]
+    def upload_rows(rows):
+        upload(client, TRANS_HEADER + ''.join(f'"{d}","10:00","PRODUCT_A","ISIN_A","{q}","{t}","-1.0"\n' for d, q, t in rows))
+        return session_cache(client)['engine']
+
+    assert upload_rows(rows).resumed_from is None
+    with client.session_transaction() as sess:
+        checkpoints = degiro_app.app.dataset_paths(sess['dataset'])[2]
+    assert os.path.exists(checkpoints)
+
+    response = client.get('/update')
+    assert response.status_code == 200 and b'name="transactions"' in response.data
+    assert os.path.exists(checkpoints)
+    engine = upload_rows(rows + [('05-01-2024', '1.0', '-12.0')])
+    assert engine.resumed_from == 2022
+    assert engine.years_data[2024].portfolio[0].qty == 14.0
+
+    client.get('/reset')
+    assert not os.path.exists(checkpoints)
+
+def test_expired_datasets_are_removed(client, app):
+    """Test datasets unused for longer than DATASET_RETENTION_DAYS are deleted from disk and memory."""
+    clients = [client, app.test_client()]
+    for c in clients:
+        upload(c)
+    datasets = []
+    for c in clients:
+        with c.session_transaction() as sess:
+            datasets.append(sess['dataset'])
+
+    old = degiro_app.app.time.time() - (app.config['DATASET_RETENTION_DAYS'] + 1) * 86400
+    os.utime(os.path.join(DATASETS_DIR, datasets[0]), (old, old))
+    assert degiro_app.app.cleanup_datasets() == [datasets[0]]
+    assert os.listdir(DATASETS_DIR) == [datasets[1]]
+    assert datasets[0] not in DB_CACHE
+    assert client.get('/api/data').get_json() == {}
+    assert clients[1].get('/api/data').get_json()['years']
+
+def test_legacy_data_is_migrated(client, app, tmp_path):
+    """Test files from the old single data/ layout become the dataset of the first session without data."""
+    (tmp_path / 'Transactions.csv').write_text(buy_csv(), encoding='utf-8')
+    (tmp_path / 'Account.csv').write_text(ACC_HEADER, encoding='utf-8')
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / 'frames_old_trans.parquet').write_bytes(b'')
+
+    response = client.get('/')
+    assert response.status_code == 302 and response.headers['Location'].endswith('/dashboard')
+    assert client.get('/api/data').get_json()['years']['2023']['portfolio'][0]['qty'] == 10.0
+    assert os.listdir(tmp_path) == []
+    # Una sola vez: otra sesión empieza sin datos
+    assert app.test_client().get('/').status_code == 200
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from degiro_app.batch import find_clients, run_batch, main
+
+TRANS_CSV = (
+    '"Fecha","Hora","Producto","ISIN","Número","Total (EUR)","Costes"\n'
+    '"10-01-2022","10:00","PROD","ISIN1","10","-1000","-2"\n'
+    '"15-03-2023","10:00","PROD","ISIN1","-4","480","-2"\n'
+)
+ACC_CSV = (
+    '"Fecha","Producto","ISIN","Descripción","Variación"\n'
+    '"01-06-2023","PROD","ISIN1","Dividendo","EUR 5,00"\n'
+)
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp.name, 'in')
+        self.output_dir = os.path.join(self.tmp.name, 'out')
+        # Cliente en subdirectorio, cliente en pareja de ficheros y cliente con datos inválidos
+        os.makedirs(os.path.join(self.input_dir, 'ana'))
+        self._write('ana/Transactions.csv', TRANS_CSV)
+        self._write('ana/Account.csv', ACC_CSV)
+        self._write('luis_Transactions.csv', TRANS_CSV)
+        self._write('roto_Transactions.csv', 'esto no es un csv de degiro\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        with open(os.path.join(self.input_dir, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def test_find_clients(self):
+        clients = find_clients(self.input_dir)
+        self.assertEqual(sorted(clients), ['ana', 'luis', 'roto'])
+        self.assertTrue(clients['ana'][1].endswith(os.path.join('ana', 'Account.csv')))
+        self.assertFalse(os.path.exists(clients['luis'][1])) # Account.csv opcional
+
+    def test_failure_does_not_stop_batch(self):
+        with redirect_stderr(StringIO()):
+            results = run_batch(self.input_dir, self.output_dir, jobs=2)
+
+        by_client = {r['client']: r for r in results}
+        self.assertTrue(by_client['ana']['ok'])
+        self.assertTrue(by_client['luis']['ok'])
+        self.assertFalse(by_client['roto']['ok'])
+        self.assertIn('error', by_client['roto'])
+        self.assertEqual(by_client['ana']['rows'], 2)
+
+        with open(os.path.join(self.output_dir, 'ana', 'analisis.json'), encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual(data['years']['2023']['sales'][0]['pnl'], 80.0)
+        self.assertEqual(data['years']['2023']['dividends'][0]['gross'], 5.0)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'ana', '2023', 'ventas_opas_2023.csv')))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'roto')))
+
+    def test_main_writes_summary_and_exit_code(self):
+        out = StringIO()
+        with redirect_stdout(out), redirect_stderr(StringIO()):
+            code = main([self.input_dir, self.output_dir, '-j', '1'])
+        self.assertEqual(code, 1) # Hay un cliente con error
+        self.assertIn('3 (2 correctos, 1 con error)', out.getvalue())
+        with open(os.path.join(self.output_dir, 'resumen.json'), encoding='utf-8') as f:
+            summary = json.load(f)
+        self.assertEqual([c['client'] for c in summary['clients']], ['ana', 'luis', 'roto'])
+
+if __name__ == '__main__':
+    unittest.main()
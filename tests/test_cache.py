@@ -0,0 +1,28 @@
+import unittest
+import numpy as np
+from degiro_app.cache import ResultCache, estimate_size
+
+class TestResultCache(unittest.TestCase):
+
+    def test_lru_eviction_within_budget(self):
+        cache = ResultCache(max_bytes=25, sizeof=len)
+        cache.put('a', 'x' * 10)
+        cache.put('b', 'x' * 10)
+        self.assertIsNotNone(cache.get('a')) # 'b' pasa a ser la menos reciente
+        cache.put('c', 'x' * 10)
+
+        self.assertEqual(sorted(cache._entries), ['a', 'c'])
+        self.assertIsNone(cache.get('b'))
+        cache.put('big', 'x' * 100) # Se conserva aunque supere el presupuesto
+        self.assertEqual(list(cache._entries), ['big'])
+        self.assertEqual(cache.stats(), {'entries': 1, 'bytes': 100, 'max_bytes': 25,
+                                         'hits': 1, 'misses': 1, 'evictions': 3})
+
+    def test_estimate_counts_shared_objects_once(self):
+        array = np.zeros(1000)
+        single = estimate_size({'a': array})
+        self.assertGreater(single, array.nbytes)
+        self.assertLess(estimate_size({'a': array, 'b': [array, array]}), single + 200)
+
+if __name__ == '__main__':
+    unittest.main()
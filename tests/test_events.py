@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+from degiro_app.logic import analyze_frames
+from degiro_app.events import EventRule, DEFAULT_EVENT_RULES, classify_events, load_event_rules
+from tests.helpers import make_df, make_engine, random_rows
+
+def frame(products, totals=None):
+    totals = totals if totals is not None else [10.0] * len(products)
+    return pd.DataFrame({'product': products, 'total_eur': totals})
+
+class TestClassifyEvents(unittest.TestCase):
+
+    def test_priority_and_fallback(self):
+        events = classify_events(frame(
+            ['OPA DERECHOS X', 'x opa - fusion', 'CANJE Y', 'SPLIT RTS', 'NORMAL', 'NORMAL'],
+            [10.0, 10.0, 10.0, 10.0, 10.0, 0.05]))
+        self.assertEqual(list(events), ['DERECHOS', 'OPA/FUSIÓN', 'CANJE/SPLIT', 'DERECHOS', '', 'CANJE/SPLIT'])
+        self.assertEqual(list(classify_events(frame([]))), [])
+
+    def test_rules_from_file(self):
+        rules = [{'event': 'OPA/FUSIÓN', 'keywords': ['tender'], 'account_cash': True},
+                 {'event': 'ESCISIÓN', 'keywords': ['SPIN-OFF']}]
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+            json.dump(rules, f)
+        try:
+            loaded = load_event_rules(f.name)
+        finally:
+            os.unlink(f.name)
+
+        self.assertEqual(loaded[0], EventRule('OPA/FUSIÓN', ('TENDER',), account_cash=True))
+        self.assertIs(load_event_rules(None), DEFAULT_EVENT_RULES)
+        events = classify_events(frame(['X TENDER OFFER', 'Y SPIN-OFF', 'OPA Z']), loaded)
+        self.assertEqual(list(events), ['OPA/FUSIÓN', 'ESCISIÓN', ''])
+
+class TestEngineEvents(unittest.TestCase):
+
+    def test_custom_zero_cost_rule(self):
+        rows = [('01-02-2023', 'ISIN_A', 10, -100.0), ('01-03-2023', 'ISIN_A', -10, 5.0)]
+        rules = (EventRule('DERECHOS', ('P_ISIN_A',), zero_cost=True),)
+        for exact in (False, True):
+            sale = make_engine(rows, exact=exact, event_rules=rules).years_data[2023].sales[0]
+            self.assertEqual((sale.note, sale.cost_basis, sale.pnl), ('DERECHOS', 0.0, 5.0))
+
+    def test_custom_rules_reach_parallel_shards(self):
+        df = make_df(random_rows(9))
+        rules = (*DEFAULT_EVENT_RULES, EventRule('DERECHOS', ('P_ISIN_1',), zero_cost=True))
+        sequential = analyze_frames(df.copy(), pd.DataFrame(), event_rules=rules)
+        parallel = analyze_frames(df.copy(), pd.DataFrame(), workers=2, event_rules=rules)
+        self.assertEqual(parallel, sequential)
+        notes = {s['note'] for y in sequential['years'].values() for s in y['sales'] if s['isin'] == 'ISIN_1'}
+        self.assertTrue(notes and all(n.endswith('DERECHOS') for n in notes))
+
+if __name__ == '__main__':
+    unittest.main()
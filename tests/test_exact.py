@@ -0,0 +1,91 @@
+import unittest
+from unittest import mock
+import numpy as np
+from degiro_app.engine import PortfolioEngine
+from degiro_app.exact import exact_fifo, to_fixed, CENTS
+from tests.helpers import make_df, make_engine, random_rows
+
+class TestExactFifo(unittest.TestCase):
+
+    def test_costs_are_conserved_to_the_cent(self):
+        rows = [(d, i, q, round(t, 2)) for d, i, q, t in random_rows(21)]
+        df = make_df(rows).sort_values('date_obj', kind='stable').reset_index(drop=True)
+        fifo = exact_fifo(df)
+
+        bought = np.abs(to_fixed(df['total_eur'], CENTS))[df['qty'].to_numpy() > 0].sum()
+        last = fifo.offsets[1:] - 1
+        self.assertEqual(fifo.cost.sum() + fifo.open_cost[last].sum(), bought)
+
+    def test_partial_lot_is_split_in_whole_cents(self):
+        engine = make_engine([('01-02-2023', 'ISIN_A', 3, -10.00), ('01-03-2023', 'ISIN_A', -1, 4.00),
+                      ('02-03-2023', 'ISIN_A', -1, 4.00), ('03-03-2023', 'ISIN_A', -1, 4.00)], exact=True)
+        self.assertEqual([s.cost_basis for s in engine.years_data[2023].sales], [3.33, 3.34, 3.33])
+        self.assertEqual(engine.years_data[2023].total_pnl_real, 2.0)
+        self.assertEqual(engine.years_data[2023].portfolio, [])
+
+class TestExactMode(unittest.TestCase):
+
+    def test_matches_float_mode_on_cent_amounts(self):
+        rows = [(d, i, q, round(t, 2)) for d, i, q, t in random_rows(4)]
+        float_engine = make_engine(rows)
+        exact_engine = make_engine(rows, exact=True, report_divergences=True)
+
+        # Con importes al céntimo solo difiere el reparto de céntimos dentro de cada lote
+        self.assertTrue(all(d['cost_diff_cents'] or d['pnl_diff_cents'] for d in exact_engine.divergences
+                            if d['kind'] == 'sale'))
+        self.assertFalse([d for d in exact_engine.divergences if d['kind'] == 'sale'
+                          and (d['float_warning'], d['float_blocked']) != (d['exact_warning'], d['exact_blocked'])])
+        for year, stats in float_engine.years_data.items():
+            exact_stats = exact_engine.years_data[year]
+            self.assertEqual(len(exact_stats.sales), len(stats.sales))
+            for a, b in zip(stats.sales, exact_stats.sales):
+                self.assertAlmostEqual(a.cost_basis, b.cost_basis, delta=0.01)
+                self.assertEqual((a.blocked, a.note, a.warning), (b.blocked, b.note, b.warning))
+            self.assertAlmostEqual(stats.total_pnl_fiscal, exact_stats.total_pnl_fiscal, delta=0.01 * len(stats.sales))
+            self.assertEqual([p.isin for p in stats.portfolio], [p.isin for p in exact_stats.portfolio])
+
+    def test_no_divergences_on_exact_amounts(self):
+        # Precios representables en binario: el float no redondea nada
+        rows = [(d, i, q, -q * (5 + n % 10 + 0.25 * (n % 4))) for n, (d, i, q, _) in enumerate(random_rows(6))]
+        engine = make_engine(rows, exact=True, report_divergences=True)
+        self.assertTrue(engine.years_data[2021].sales)
+        self.assertEqual(engine.divergences, [])
+
+    def test_divergences_are_reported(self):
+        rows = [
+            # 1/3 de lote: -0,0033 € en float (bloqueada por la recompra), 0 € exacto
+            ('01-02-2023', 'ISIN_A', 3, -10.00), ('01-03-2023', 'ISIN_A', -1, 3.33),
+            ('10-03-2023', 'ISIN_A', 1, -3.00),
+            # Resto por debajo de la tolerancia del float (0,001 acciones)
+            ('01-02-2023', 'ISIN_B', 1, -100.00), ('01-03-2023', 'ISIN_B', -0.9995, 120.00),
+        ]
+        engine = make_engine(rows, exact=True, report_divergences=True)
+        sale = next(s for s in engine.years_data[2023].sales if s.isin == 'ISIN_A')
+        self.assertEqual((sale.pnl, sale.blocked, sale.note), (0.0, False, ""))
+
+        # Menos de un céntimo de coste, pero cambian el bloqueo y el signo del P&L
+        divergences = {(d['kind'], d['isin']): d for d in engine.divergences}
+        self.assertEqual(sorted(divergences), [('position', 'ISIN_B'), ('sale', 'ISIN_A')])
+        divergence = divergences['sale', 'ISIN_A']
+        self.assertEqual((divergence['float_blocked'], divergence['exact_blocked']), (True, False))
+        self.assertEqual((divergence['cost_diff_cents'], divergence['pnl_diff_cents']), (0, 0))
+        self.assertEqual(divergences['position', 'ISIN_B']['qty_diff_micro'], -500)
+        self.assertEqual(make_engine(rows, exact=True).divergences, [])
+        position = next(p for p in engine.years_data[2023].portfolio if p.isin == 'ISIN_B')
+        self.assertEqual((position.qty, position.total_cost), (0.0005, 0.05))
+        self.assertEqual(engine.years_data[2023].stats_blocked, 0.0)
+
+    def test_exact_mode_skips_float_ledgers(self):
+        rows = [('01-02-2023', 'ISIN_A', 3, -10.00), ('01-03-2023', 'ISIN_A', -1, 4.00),
+                ('01-04-2023', 'ISIN_A', 2, -7.00)]
+        with mock.patch.object(PortfolioEngine, '_process_sequential') as sequential:
+            engine = make_engine(rows, exact=True)
+        sequential.assert_not_called()
+
+        # Lotes abiertos para simular: el primero consumido en parte, al céntimo
+        ledger = engine.portfolio['ISIN_A']
+        self.assertEqual([(b.quantity, round(b.quantity * b.unit_cost, 2)) for b in ledger.lots], [(2.0, 6.67), (2.0, 7.0)])
+        self.assertEqual(engine.simulate_sale('ISIN_A', 2, 5.0)['cost_basis'], 6.67)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime
+import numpy as np
+from degiro_app.harvest import harvest_candidates, plan_harvest
+from tests.helpers import make_engine
+
+class TestHarvest(unittest.TestCase):
+
+    def setUp(self):
+        self.date = datetime(2023, 9, 1)
+        self.engine = make_engine([
+            ('10-01-2023', 'ISIN_A', 10, -100), ('10-02-2023', 'ISIN_A', 10, -200),
+            ('12-01-2023', 'ISIN_B', 5, -500),
+            ('15-01-2023', 'ISIN_C', 10, -100), ('15-08-2023', 'ISIN_C', 1, -10), # Compra reciente
+            ('20-01-2023', 'ISIN_D', 10, -100),
+            ('25-01-2023', 'ISIN_E', 10, -100),
+        ])
+        self.prices = {'ISIN_A': 12.0, 'ISIN_B': 50.0, 'ISIN_C': 5.0, 'ISIN_D': 30.0}
+
+    def test_candidates_respect_fifo_and_flag_blocked(self):
+        candidates = {c['isin']: c for c in harvest_candidates(self.engine, self.prices, self.date)}
+
+        self.assertEqual(sorted(candidates), ['ISIN_A', 'ISIN_B', 'ISIN_C']) # D solo tiene ganancia
+        # A: el primer lote (a 10) da +20, hay que venderlo para llegar al segundo (a 20): -60
+        self.assertAlmostEqual(candidates['ISIN_A']['max_loss'], -60.0)
+        self.assertEqual(candidates['ISIN_A']['qty'], 20.0)
+        self.assertAlmostEqual(candidates['ISIN_B']['max_loss'], -250.0)
+        self.assertTrue(candidates['ISIN_C']['blocked'])
+        self.assertFalse(candidates['ISIN_A']['blocked'])
+
+    def test_plan_offsets_target_with_partial_last_sale(self):
+        result = plan_harvest(self.engine, 300.0, self.prices, self.date)
+
+        self.assertEqual([(s['isin'], s['qty']) for s in result['plan']], [('ISIN_B', 5.0), ('ISIN_A', 19.0)])
+        self.assertAlmostEqual(result['total_offset'], -302.0) # -250 + (20 - 9 * 8)
+        self.assertAlmostEqual(result['remaining_gain'], -2.0)
+        self.assertNotIn('ISIN_C', [s['isin'] for s in result['plan']])
+        self.assertEqual(result['missing_prices'], ['ISIN_E'])
+        # El motor no se modifica
+        self.assertEqual(self.engine.portfolio['ISIN_B'].quantity, 5.0)
+
+        small = plan_harvest(self.engine, 100.0, self.prices, self.date)
+        self.assertEqual([(s['isin'], s['qty'], s['pnl']) for s in small['plan']], [('ISIN_B', 2.0, -100.0)])
+
+    def test_vectorized_candidates_match_lot_by_lot_simulation(self):
+        rng = np.random.default_rng(3)
+        rows = []
+        for i in range(30):
+            for _ in range(rng.integers(1, 8)):
+                qty = int(rng.integers(1, 20))
+                rows.append((f'{rng.integers(1, 28):02d}-0{rng.integers(1, 6)}-2023', f'ISIN_{i}', qty,
+                             -qty * rng.uniform(5, 15)))
+        engine = make_engine(rows)
+        prices = {f'ISIN_{i}': float(rng.uniform(5, 15)) for i in range(30)}
+
+        candidates = {c['isin']: c for c in harvest_candidates(engine, prices, self.date)}
+        for isin, ledger in engine.portfolio.items():
+            # Pérdida de vender hasta el final de cada lote, simulada venta a venta
+            ends = np.cumsum([b.quantity for b in ledger.lots])
+            best = min(engine.simulate_sale(isin, q, prices[isin], self.date)['pnl'] for q in ends)
+            if best < -0.005:
+                self.assertAlmostEqual(candidates[isin]['max_loss'], best, places=6)
+            else:
+                self.assertNotIn(isin, candidates)
+
+if __name__ == '__main__':
+    unittest.main()
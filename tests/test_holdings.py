@@ -0,0 +1,53 @@
+import unittest
+from datetime import datetime
+import pandas as pd
+from degiro_app.engine import PortfolioEngine
+from degiro_app.holdings import HoldingsIndex
+from tests.helpers import make_df, random_rows
+
+class TestHoldingsIndex(unittest.TestCase):
+
+    def test_matches_full_replay_truncated_at_date(self):
+        engine = PortfolioEngine(make_df(random_rows(5)), pd.DataFrame())
+        engine.process()
+        index = HoldingsIndex(engine.df_trans)
+        self.assertGreater(len(index._cp_rows), 30) # Un checkpoint por mes con operaciones
+
+        for day in pd.date_range('2019-12-31', '2023-01-05', freq='17D').to_pydatetime():
+            sub = engine.df_trans[engine.df_trans['date_obj'] <= day]
+            reference = PortfolioEngine(sub.copy(), pd.DataFrame())
+            reference.process()
+            ledgers = index.ledgers_at(day)
+            self.assertEqual(list(ledgers), list(reference.portfolio))
+            for isin, ledger in reference.portfolio.items():
+                self.assertEqual([(b.quantity, b.unit_cost, b.date) for b in ledgers[isin].lots],
+                                 [(b.quantity, b.unit_cost, b.date) for b in ledger.lots])
+                self.assertAlmostEqual(ledgers[isin].quantity, ledger.quantity, places=6)
+                self.assertAlmostEqual(ledgers[isin].cost, ledger.cost, places=6)
+
+    def test_year_end_matches_engine_portfolio(self):
+        engine = PortfolioEngine(make_df(random_rows(8)), pd.DataFrame())
+        engine.process()
+        index = HoldingsIndex(engine.df_trans)
+        for year, stats in engine.years_data.items():
+            holdings = index.holdings_at(datetime(year, 12, 31))
+            self.assertEqual([p['isin'] for p in holdings['portfolio']], [p.isin for p in stats.portfolio])
+            for got, expected in zip(holdings['portfolio'], stats.portfolio):
+                self.assertAlmostEqual(got['qty'], expected.qty, places=6)
+                self.assertAlmostEqual(got['total_cost'], expected.total_cost, places=6)
+            self.assertAlmostEqual(holdings['portfolio_value'], stats.portfolio_value, places=6)
+
+    def test_lots_and_empty_dates(self):
+        index = HoldingsIndex(make_df([
+            ('10-01-2023', 'ISIN_A', 10, -100), ('10-02-2023', 'ISIN_A', 10, -200),
+            ('15-03-2023', 'ISIN_A', -15, 300),
+        ]).sort_values('date_obj').reset_index(drop=True))
+
+        self.assertEqual(index.holdings_at(datetime(2022, 12, 31))['portfolio'], [])
+        holdings = index.holdings_at(datetime(2023, 3, 15))
+        self.assertEqual(holdings['lots']['ISIN_A'], [{'qty': 5.0, 'unit_cost': 20.0, 'date': datetime(2023, 2, 10)}])
+        self.assertAlmostEqual(holdings['portfolio_value'], 100.0)
+        self.assertEqual(HoldingsIndex(make_df([]).iloc[:0]).holdings_at(datetime(2023, 1, 1))['portfolio'], [])
+
+if __name__ == '__main__':
+    unittest.main()
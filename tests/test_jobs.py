@@ -0,0 +1,33 @@
+import threading
+import unittest
+from degiro_app.jobs import JobQueue, QueueFull
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_states_and_bounded_queue(self):
+        queue = JobQueue(workers=1, max_pending=2)
+        release = threading.Event()
+
+        def slow(progress):
+            progress('fifo', 5, 10)
+            release.wait(5)
+            return True
+
+        first = queue.submit('a', slow)
+        second = queue.submit('b', lambda progress: False, "Fallo")
+        with self.assertRaises(QueueFull):
+            queue.submit('c', slow)
+        self.assertIs(queue.active('a'), first)
+
+        release.set()
+        self.assertEqual(queue.wait(first.id).to_dict()['state'], 'done')
+        self.assertEqual((queue.wait(second.id).state, second.error), ('error', "Fallo"))
+        self.assertEqual((first.stage, first.done, first.total), ('fifo', 5, 10))
+        self.assertIsNone(queue.active('a'))
+
+        failed = queue.wait(queue.submit('c', lambda progress: 1 / 0).id)
+        self.assertEqual(failed.state, 'error')
+        self.assertIn('division', failed.error)
+
+if __name__ == '__main__':
+    unittest.main()
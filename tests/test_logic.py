@@ -1,8 +1,25 @@
+import json
+import os
+import tempfile
 import unittest
+import unittest.mock
 import pandas as pd
 from io import StringIO
 from datetime import datetime
-from degiro_app.logic import clean_number, load_data_frames, process_year
+from dataclasses import asdict, astuple
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from degiro_app import logic
+from degiro_app.logic import (
+    clean_number, clean_number_series, load_data_frames, process_year,
+    load_data_frames_cached, analyze_frames
+)
+from degiro_app.models import (
+    LotLedger, PortfolioBatch, YearStats, SaleResult, Purchase, DividendResult, PortfolioPosition
+)
 
 class TestLogic(unittest.TestCase):
 
@@ -21,6 +38,29 @@ class TestLogic(unittest.TestCase):
         self.assertEqual(clean_number("abc"), 0.0)
         self.assertEqual(clean_number("EUR 1.000,00"), 1000.0)
 
+    def test_clean_number_series_matches_clean_number(self):
+        """clean_number_series debe devolver exactamente lo mismo que clean_number celda a celda."""
+        rng = random.Random(1234)
+        alphabet = ['0', '1', '5', '9', '.', ',', '-', ' ', '"', 'EUR ', '$', '€', 'a']
+        corpus = [
+            "1.234,56", "1,234.56", "1.234", "1,23", "-50.00", "  25.5  ", '"100"', "",
+            "abc", "EUR 1.000,00", "1.234.567", "1,234,567", "1.", ".5", "-", "--5",
+            "5-", "1.2.3,4", "USD -1.234,5", "0,001", "12.3456", None, float('nan'), pd.NA,
+            1234.5, 1.234, 10, -3.0,
+        ]
+        for _ in range(20000):
+            corpus.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+        for _ in range(20000):
+            num = rng.uniform(-1e6, 1e6)
+            s = f"{num:,.{rng.randint(0, 4)}f}"
+            if rng.random() < 0.5:
+                s = s.replace(',', '_').replace('.', ',').replace('_', '.')
+            corpus.append(s)
+
+        expected = np.array([clean_number(x) for x in corpus], dtype=np.float64)
+        result = clean_number_series(pd.Series(corpus, dtype=object))
+        np.testing.assert_array_equal(result, expected)
+
     def test_load_data_frames(self):
         """Tests loading data from CSV streams."""
         trans_csv = (
@@ -61,6 +101,30 @@ class TestLogic(unittest.TestCase):
         self.assertTrue(df_t_malformed.empty) # Should fail to parse and return empty
         self.assertTrue(df_a_malformed.empty)
 
+    def test_load_data_frames_semicolon_and_ragged_rows(self):
+        """El separador se detecta sobre el prefijo y se toleran filas con menos columnas."""
+        trans_csv = (
+            '"Fecha";"Hora";"Producto";"ISIN";"Número";"Total (EUR)";"Costes de transacción (EUR)"\n'
+            '"25-05-2023";"15:30";"TESLA; INC";"US88160R1014";"10";"-1.000,50";"-1,00"\n'
+        )
+        acc_csv = (
+            'Fecha,Hora,Producto,ISIN,Descripción,Variación,,Saldo\n'
+            '10-06-2023,09:00,TESLA,US88160R1014,Dividendo,EUR,"50,25",EUR\n'
+            '11-06-2023,09:00,,,Ingreso\n'
+        )
+        df_t, df_a = load_data_frames(StringIO(trans_csv), StringIO(acc_csv))
+
+        self.assertEqual(len(df_t), 1)
+        self.assertEqual(df_t.iloc[0]['product'], "TESLA; INC")
+        self.assertEqual(df_t.iloc[0]['time'], "15:30")
+        self.assertEqual(df_t.iloc[0]['total_eur'], -1000.50)
+        self.assertEqual(df_t.iloc[0]['fee_eur'], -1.00)
+
+        self.assertEqual(len(df_a), 2)
+        self.assertEqual(df_a.iloc[0]['amount_fix'], 50.25)
+        self.assertEqual(df_a.iloc[0]['currency_fix'], 'EUR')
+        self.assertEqual(df_a.iloc[1]['amount_fix'], 0.0)
+
     def test_process_year(self):
         """Tests the main process_year logic with a sample set of transactions."""
         trans_data = {
@@ -294,14 +358,144 @@ class TestLogic(unittest.TestCase):
         self.assertEqual(df_a.iloc[0]['amount_fix'], 50.0)
         self.assertEqual(df_a.iloc[0]['currency_fix'], 'EUR')
 
-
-
-
-
-
-
-
-
+    def test_analyze_years_are_materialized_lazily(self):
+        """Los años se convierten a dict al pedirlos, una sola vez, y coinciden con process_year."""
+        trans_csv = (
+            '"Fecha","Hora","Producto","ISIN","Número","Total (EUR)","Costes"\n'
+            '"10-01-2022","10:00","PROD","ISIN1","10","-1000","-2"\n'
+            '"15-03-2023","10:00","PROD","ISIN1","-4","480","-2"\n'
+        )
+        df_t, df_a = load_data_frames(StringIO(trans_csv), StringIO(""))
+        years = analyze_frames(df_t.copy(), df_a)['years']
+
+        self.assertIsInstance(years.stats(2023), YearStats)
+        self.assertNotIn(2023, [year for year, _ in years._dicts])
+        self.assertIs(years[2023], years[2023])
+        self.assertEqual(years[2023], process_year(df_t.copy(), df_a, 2023))
+        self.assertNotIn(2022, [year for year, _ in years._dicts])
+        self.assertEqual(json.loads(json.dumps(dict(years), default=str))['2022']['purchases'][0]['qty'], 10.0)
+
+    def test_lazy_years_build_once_across_threads(self):
+        """Con varios hilos pidiendo el mismo año a la vez, se convierte una sola vez."""
+        trans_csv = (
+            '"Fecha","Hora","Producto","ISIN","Número","Total (EUR)","Costes"\n'
+            '"10-01-2022","10:00","PROD","ISIN1","10","-1000","-2"\n'
+            '"15-03-2023","10:00","PROD","ISIN1","-4","480","-2"\n'
+        )
+        df_t, df_a = load_data_frames(StringIO(trans_csv), StringIO(""))
+        years = analyze_frames(df_t, df_a)['years']
+        real = logic.year_to_dict
+        barrier = threading.Barrier(8)
+
+        def slow(*args):
+            time.sleep(0.05) # Deja que el resto de hilos lleguen mientras se convierte
+            return real(*args)
+
+        def get(_):
+            barrier.wait()
+            return years[2023]
+
+        with unittest.mock.patch.object(logic, 'year_to_dict', side_effect=slow) as spy:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(pool.map(get, range(8)))
+        self.assertEqual(spy.call_count, 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+
+
+
+
+
+
+
+
+
+class TestModelSerializers(unittest.TestCase):
+
+    def test_to_dict_and_to_row_match_dataclasses(self):
+        """Los serializadores generados equivalen a asdict/astuple y los modelos no tienen __dict__."""
+        models = [
+            SaleResult(date=datetime(2023, 3, 15), product='P', isin='I', qty=4.0, sale_net=480.0,
+                       cost_basis=400.0, pnl=80.0, note='OPA', blocked=True, unlock_date='15-05-2023'),
+            Purchase(date='10-01-2023', product='P', isin='I', qty=10.0, price=100.0, total=1000.0, fee=-2.0),
+            DividendResult(date=datetime(2023, 6, 1), product='P', isin='I', currency='EUR',
+                           gross=5.0, wht=0.75, net=4.25, desc='Dividendo'),
+            PortfolioPosition(name='P', isin='I', qty=6.0, avg_price=100.0, total_cost=600.0),
+        ]
+        for model in models:
+            self.assertEqual(model.to_dict(), asdict(model))
+            self.assertEqual(list(model.to_dict()), list(asdict(model)))
+            self.assertEqual(model.to_row(), astuple(model))
+            self.assertEqual(type(model)(*model.to_row()), model)
+            self.assertFalse(hasattr(model, '__dict__'))
+
+class TestLotLedger(unittest.TestCase):
+
+    def test_consume_keeps_running_totals(self):
+        """La cola FIFO consume desde el principio y mantiene cantidad y coste abiertos."""
+        ledger = LotLedger('PRODUCT_A')
+        ledger.add(PortfolioBatch(quantity=10.0, unit_cost=10.0, date=datetime(2023, 1, 5)))
+        ledger.add(PortfolioBatch(quantity=10.0, unit_cost=12.0, date=datetime(2023, 2, 10)))
+
+        cost, warning, min_date = ledger.consume(15.0)
+        self.assertAlmostEqual(cost, 160.0)
+        self.assertFalse(warning)
+        self.assertEqual(min_date, datetime(2023, 1, 5))
+        self.assertEqual(len(ledger), 1)
+        self.assertAlmostEqual(ledger.quantity, 5.0)
+        self.assertAlmostEqual(ledger.cost, 60.0)
+
+        cost, warning, _ = ledger.consume(8.0)
+        self.assertAlmostEqual(cost, 60.0)
+        self.assertTrue(warning)
+        self.assertEqual(len(ledger), 0)
+        self.assertEqual(ledger.quantity, 0.0)
+        self.assertEqual(ledger.cost, 0.0)
+
+class TestFramesCache(unittest.TestCase):
+
+    TRANS_CSV = (
+        '"Fecha","Hora","Producto","ISIN","Número","Total (EUR)","Costes de transacción (EUR)"\n'
+        '"25-05-2023","15:30","BUY TESLA","US88160R1014","10.0","-1000.50","-1.00"\n'
+    )
+    ACC_CSV = (
+        '"Fecha","Producto","ISIN","Descripción","Variación",""\n'
+        '"10-06-2023","TESLA","US88160R1014","Dividendo","EUR","50,25"\n'
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.path_t = os.path.join(self.tmp.name, 'Transactions.csv')
+        self.path_a = os.path.join(self.tmp.name, 'Account.csv')
+        self._write(self.TRANS_CSV, self.ACC_CSV)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, trans, acc):
+        with open(self.path_t, 'w', encoding='utf-8') as f: f.write(trans)
+        with open(self.path_a, 'w', encoding='utf-8') as f: f.write(acc)
+
+    def test_cache_hit_returns_same_frames_and_evicts_stale(self):
+        df_t, df_a = load_data_frames_cached(self.path_t, self.path_a, self.cache_dir)
+        entries = sorted(os.listdir(self.cache_dir))
+        self.assertEqual(len(entries), 2)
+
+        # Segunda carga: viene de la cache y es idéntica
+        with unittest.mock.patch('degiro_app.logic.load_data_frames') as parse:
+            df_t2, df_a2 = load_data_frames_cached(self.path_t, self.path_a, self.cache_dir)
+            parse.assert_not_called()
+        pd.testing.assert_frame_equal(df_t, df_t2)
+        pd.testing.assert_frame_equal(df_a, df_a2)
+
+        # Si cambia el fichero, la entrada antigua se elimina
+        self._write(self.TRANS_CSV.replace('10.0', '12.0'), self.ACC_CSV)
+        df_t3, _ = load_data_frames_cached(self.path_t, self.path_a, self.cache_dir)
+        self.assertEqual(df_t3.iloc[0]['qty'], 12.0)
+        new_entries = sorted(os.listdir(self.cache_dir))
+        self.assertEqual(len(new_entries), 2)
+        self.assertFalse(set(entries) & set(new_entries))
 
 if __name__ == '__main__':
     unittest.main()
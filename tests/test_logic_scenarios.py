@@ -1,8 +1,13 @@
+import os
+import tempfile
 import unittest
+import numpy as np
 import pandas as pd
-from datetime import timedelta
-from degiro_app.logic import process_year, analyze_full_history, load_data_frames
+from datetime import datetime, timedelta
+from degiro_app.logic import process_year, analyze_full_history, load_data_frames, analyze_frames, load_checkpoints
+from degiro_app.engine import PortfolioEngine
 from io import StringIO
+from tests.helpers import make_df, random_rows
 
 class TestLogicScenarios(unittest.TestCase):
 
@@ -156,6 +161,26 @@ class TestLogicScenarios(unittest.TestCase):
         self.assertEqual(y23['portfolio'][0]['qty'], 5.0)
         self.assertEqual(y23['portfolio'][0]['total_cost'], 500.0)
 
+    def test_wash_sale_window_edges(self):
+        """
+        La ventana de 2 meses es inclusiva: una recompra a 62 días bloquea la pérdida,
+        a 63 días ya no.
+        """
+        sale_date = pd.to_datetime('2023-03-15')
+        for days, expected in ((62, True), (63, False)):
+            rebuy = sale_date + timedelta(days=days)
+            trans_data = {
+                'date': ['15-01-2023', '15-03-2023', rebuy.strftime('%d-%m-%Y')],
+                'time': ['10:00', '10:00', '10:00'],
+                'product': ['PRODUCT_A'] * 3,
+                'isin': ['ISIN_A'] * 3,
+                'qty': [10.0, -10.0, 10.0],
+                'total_eur': [-100.0, 80.0, -90.0], 'fee_eur': [0.0, 0.0, 0.0],
+                'date_obj': [pd.to_datetime('2023-01-15'), sale_date, rebuy]
+            }
+            result = process_year(pd.DataFrame(trans_data), pd.DataFrame(), 2023)
+            self.assertEqual(result['sales'][0]['blocked'], expected, f"Recompra a {days} días")
+
     def test_quiet_year_with_portfolio(self):
         """
         Tests a year with no transactions but with a holding portfolio.
@@ -178,5 +203,116 @@ class TestLogicScenarios(unittest.TestCase):
         self.assertEqual(len(y23['portfolio']), 1)
         self.assertEqual(y23['portfolio'][0]['qty'], 10.0)
 
+    def test_checkpoint_resume_matches_full_replay(self):
+        """
+        Al añadir filas nuevas se reanuda desde el último año cerrado con resultado
+        idéntico; si cambia una fila antigua se recalcula todo.
+        """
+        rows = [
+            ('10-01-2021', 'ISIN_A', 10.0, -100.0), ('20-06-2021', 'ISIN_A', -5.0, 40.0),
+            ('15-11-2021', 'ISIN_B', 8.0, -80.0), ('10-02-2022', 'ISIN_B', -8.0, 60.0),
+            ('01-03-2022', 'ISIN_A', 5.0, -45.0), ('05-05-2023', 'ISIN_A', -10.0, 120.0),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoints.pkl')
+            analyze_frames(make_df(rows), pd.DataFrame(), checkpoint_path=path)
+
+            extended = rows + [('01-09-2023', 'ISIN_B', 3.0, -30.0)]
+            engine = PortfolioEngine(make_df(extended), pd.DataFrame(), checkpoints=load_checkpoints(path))
+            engine.process()
+            self.assertEqual(engine.resumed_from, 2022)
+            self.assertEqual(analyze_frames(make_df(extended), pd.DataFrame(), checkpoint_path=path),
+                             analyze_frames(make_df(extended), pd.DataFrame()))
+
+            modified = [('10-01-2021', 'ISIN_A', 10.0, -90.0)] + extended[1:]
+            engine = PortfolioEngine(make_df(modified), pd.DataFrame(), checkpoints=load_checkpoints(path))
+            engine.process()
+            self.assertIsNone(engine.resumed_from)
+            self.assertEqual(analyze_frames(make_df(modified), pd.DataFrame(), checkpoint_path=path),
+                             analyze_frames(make_df(modified), pd.DataFrame()))
+
+    def test_parallel_matches_sequential(self):
+        """El modo paralelo por ISIN produce exactamente el mismo resultado que el secuencial."""
+        rng = np.random.default_rng(7)
+        n = 400
+        isins = rng.choice(['ISIN_A', 'ISIN_B', 'ISIN_C', 'ISIN_D', 'ISIN_E'], n)
+        # Sin operaciones en 2022 para cubrir el relleno de años intermedios
+        dates = pd.to_datetime('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 5 * 365, n)), unit='D')
+        dates = dates.where(dates.year != 2022, dates + pd.DateOffset(years=1))
+        qty = np.where(rng.random(n) < 0.6, 1, -1) * rng.integers(1, 20, n).astype(float)
+        df_t = pd.DataFrame({
+            'date': dates.strftime('%d-%m-%Y'), 'time': '10:00',
+            'product': ['OPA ' + i if i == 'ISIN_E' else 'P_' + i for i in isins], 'isin': isins,
+            'qty': qty, 'total_eur': -qty * rng.uniform(5, 15, n).round(2), 'fee_eur': -rng.uniform(0, 2, n).round(2),
+            'date_obj': dates,
+        })
+        df_a = pd.DataFrame({
+            'date': ['01-03-2021', '01-03-2021', '15-06-2023'], 'product': ['P_ISIN_A', 'P_ISIN_A', 'OPA ISIN_E'],
+            'isin': ['ISIN_A', 'ISIN_A', 'ISIN_E'], 'desc': ['Dividendo', 'Retención del dividendo', 'Efectivo OPA'],
+            'amount_fix': [10.0, -1.5, 30.0], 'currency_fix': ['EUR'] * 3,
+            'date_obj': pd.to_datetime(['2021-03-01', '2021-03-01', '2023-06-15']),
+        })
+
+        sequential = analyze_frames(df_t.copy(), df_a.copy())
+        parallel = analyze_frames(df_t.copy(), df_a.copy(), workers=3)
+        self.assertEqual(list(parallel['years']), list(sequential['years']))
+        self.assertEqual(parallel, sequential)
+
+    def test_parallel_keeps_open_lots(self):
+        """Tras el modo paralelo quedan los lotes abiertos: la simulación coincide con la secuencial."""
+        df = make_df(random_rows(11))
+        sequential = PortfolioEngine(df.copy(), pd.DataFrame())
+        sequential.process()
+        parallel = PortfolioEngine(df.copy(), pd.DataFrame())
+        parallel.process(workers=3)
+
+        self.assertEqual(len(parallel.portfolio), 8)
+        self.assertEqual(list(parallel.portfolio), list(sequential.portfolio))
+        date = datetime(2023, 6, 1)
+        for isin, ledger in sequential.portfolio.items():
+            self.assertEqual(list(parallel.portfolio[isin].lots), list(ledger.lots))
+            self.assertEqual(parallel.simulate_sale(isin, 5, 10.0, date, as_of=date),
+                             sequential.simulate_sale(isin, 5, 10.0, date, as_of=date))
+
+    def test_simulate_sale_does_not_mutate_engine(self):
+        """
+        La venta hipotética aplica FIFO y la regla de los 2 meses sobre una copia de los
+        lotes del ISIN: el motor queda intacto.
+        """
+        trans_data = {
+            'date': ['15-01-2023', '01-03-2023', '10-03-2023'],
+            'time': ['10:00', '11:00', '12:00'],
+            'product': ['PRODUCT_A', 'PRODUCT_A', 'PRODUCT_B'],
+            'isin': ['ISIN_A', 'ISIN_A', 'ISIN_B'],
+            'qty': [10.0, 10.0, 5.0],
+            'total_eur': [-100.0, -120.0, -50.0],
+            'fee_eur': [-1.0, -1.0, -1.0],
+            'date_obj': pd.to_datetime(['2023-01-15', '2023-03-01', '2023-03-10'])
+        }
+        engine = PortfolioEngine(pd.DataFrame(trans_data), pd.DataFrame())
+        engine.process()
+
+        # Pérdida con compra 14 días antes: bloqueada
+        sim = engine.simulate_sale('ISIN_A', 15.0, 8.0, pd.Timestamp('2023-03-15').to_pydatetime())
+        self.assertEqual(sim['cost_basis'], 160.0) # 10 a 10 + 5 a 12 (FIFO)
+        self.assertEqual(sim['pnl'], -40.0)
+        self.assertTrue(sim['blocked'])
+        self.assertEqual(sim['remaining_qty'], 5.0)
+
+        # Lejos de las compras: pérdida computable
+        sim = engine.simulate_sale('ISIN_A', 15.0, 8.0, pd.Timestamp('2023-09-01').to_pydatetime())
+        self.assertFalse(sim['blocked'])
+
+        # Más acciones de las disponibles
+        sim = engine.simulate_sale('ISIN_B', 8.0, 20.0)
+        self.assertTrue(sim['warning'])
+        self.assertEqual(sim['available_qty'], 5.0)
+
+        ledger = engine.portfolio['ISIN_A']
+        self.assertEqual((ledger.quantity, ledger.cost, len(ledger)), (20.0, 220.0, 2))
+        self.assertEqual(ledger.lots[0].quantity, 10.0)
+        self.assertEqual(engine.portfolio['ISIN_B'].quantity, 5.0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from degiro_app.engine import PortfolioEngine
+from degiro_app.holdings import HoldingsIndex
+from degiro_app.series import cost_basis_series
+from tests.helpers import make_df, random_rows
+
+class TestCostBasisSeries(unittest.TestCase):
+
+    def test_matches_fifo_lots_every_day(self):
+        rows = random_rows(11) + [('01-06-2021', 'ISIN_X', -5, 50), ('02-06-2021', 'ISIN_X', 3, -30)] # Venta sin lotes
+        engine = PortfolioEngine(make_df(rows), pd.DataFrame())
+        engine.process()
+        series = cost_basis_series(engine.df_trans)
+        index = HoldingsIndex(engine.df_trans)
+
+        self.assertEqual(series.start, np.datetime64(engine.df_trans['date_obj'].iloc[0].date()))
+        for k in range(0, len(series), 23):
+            day = series.days[k].astype('datetime64[us]').item()
+            ledgers = index.ledgers_at(day)
+            self.assertAlmostEqual(series.total_cost[k], sum(l.cost for l in ledgers.values()), places=6)
+            self.assertAlmostEqual(series.total_qty[k], sum(l.quantity for l in ledgers.values()), places=6)
+            for isin in series.isins:
+                qty, cost = series.isin_series(isin)
+                expected = ledgers.get(isin)
+                self.assertAlmostEqual(qty[k], expected.quantity if expected else 0.0, places=6)
+                self.assertAlmostEqual(cost[k], expected.cost if expected else 0.0, places=6)
+
+        self.assertAlmostEqual(series.total_cost[-1], sum(l.cost for l in engine.portfolio.values()), places=6)
+        self.assertEqual(series.isin_series('ISIN_X')[0][-1], 3.0)
+
+    def test_per_isin_keeps_only_change_days(self):
+        series = cost_basis_series(make_df([
+            ('10-01-2023', 'ISIN_A', 10, -100), ('10-01-2023', 'ISIN_A', 10, -200),
+            ('12-01-2023', 'ISIN_B', 5, -50), ('20-01-2023', 'ISIN_A', -15, 300),
+        ]))
+        self.assertEqual(len(series), 11)
+        self.assertEqual(series.isins, ['ISIN_A', 'ISIN_B'])
+        self.assertEqual(series.day.tolist(), [0, 10, 2])
+        self.assertEqual(series.cost.tolist(), [300.0, 100.0, 50.0])
+        self.assertEqual(series.total_cost[[0, 1, 2, 9, 10]].tolist(), [300.0, 300.0, 350.0, 350.0, 150.0])
+
+        sampled = series.downsample(3)
+        self.assertEqual(sampled['dates'], ['2023-01-10', '2023-01-15', '2023-01-20'])
+        self.assertEqual(sampled['cost'], [300.0, 350.0, 150.0])
+
+    def test_empty(self):
+        series = cost_basis_series(make_df([]))
+        self.assertEqual(len(series), 0)
+        self.assertEqual(series.downsample(), {'dates': [], 'cost': [], 'qty': []})
+
+if __name__ == '__main__':
+    unittest.main()
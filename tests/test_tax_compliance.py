@@ -1,6 +1,8 @@
 import unittest
 import pandas as pd
-from degiro_app.logic import process_year
+from degiro_app.logic import process_year, year_to_dict
+from degiro_app.engine import PortfolioEngine
+from degiro_app.models import SaleResult
 
 class TestSpanishTaxLogic(unittest.TestCase):
     def test_wash_sale_with_old_shares(self):
@@ -191,5 +193,35 @@ class TestSpanishTaxLogic(unittest.TestCase):
         self.assertFalse(sale['wash_sale_risk'])
         self.assertTrue(sale['loss_consolidated'], "Debería estar consolidada por ser antigua y sin recompras.")
 
+    def test_status_as_of_reference_date(self):
+        """
+        El estado fiscal se deriva al leer: el mismo motor da el estado a cualquier fecha
+        sin reprocesar, y las ventas guardadas no dependen de la fecha actual.
+        """
+        from datetime import datetime
+        trans_data = {
+            'date': ['01-03-2023', '10-03-2023', '20-03-2023', '01-04-2023', '10-04-2023'],
+            'time': ['10:00'] * 5,
+            'product': ['BLOCK', 'BLOCK', 'BLOCK', 'CLEAN', 'CLEAN'],
+            'isin': ['ISIN_B', 'ISIN_B', 'ISIN_B', 'ISIN_C', 'ISIN_C'],
+            'qty': [10.0, -10.0, 5.0, 10.0, -10.0],
+            'total_eur': [-1000.0, 800.0, -400.0, -1000.0, 900.0],
+            'fee_eur': [0] * 5,
+            'date_obj': [datetime(2023, 3, 1), datetime(2023, 3, 10), datetime(2023, 3, 20),
+                         datetime(2023, 4, 1), datetime(2023, 4, 10)],
+        }
+        engine = PortfolioEngine(pd.DataFrame(trans_data), pd.DataFrame())
+        engine.process()
+        self.assertFalse({'blocked_status', 'wash_sale_risk', 'loss_consolidated'} & set(SaleResult.FIELDS))
+
+        def statuses(as_of):
+            sales = year_to_dict(engine.years_data[2023], as_of)['sales']
+            return [(s['blocked_status'], s['wash_sale_risk'], s['loss_consolidated']) for s in sales]
+
+        self.assertEqual(statuses(datetime(2023, 4, 15)), [('active', False, False), (None, True, False)])
+        self.assertEqual(statuses(datetime(2023, 5, 11)), [('released', False, False), (None, True, False)])
+        self.assertEqual(statuses(datetime(2023, 6, 11)), [('released', False, False), (None, False, True)])
+        self.assertEqual(statuses(None), statuses(datetime(2030, 1, 1)))
+
 if __name__ == '__main__':
     unittest.main()